@@ -0,0 +1,287 @@
+"""
+In-memory stand-ins for the OpsWorks, EC2 & CloudWatch clients and the
+Matterhorn API, with a configurable per-call latency. Every remote call is
+counted in a shared CallCounter.
+"""
+
+import time
+import threading
+from collections import Counter
+from datetime import datetime, timedelta
+from botocore.hooks import HierarchicalEmitter
+
+STACK_ID = "bench-stack-id"
+ADMIN_LAYER_ID = "bench-admin-layer"
+WORKERS_LAYER_ID = "bench-workers-layer"
+EC2_PAGE_SIZE = 200
+
+
+class CallCounter(object):
+    def __init__(self, latency=0):
+        self.latency = latency
+        self.calls = Counter()
+        self._lock = threading.Lock()
+
+    def __call__(self, name):
+        with self._lock:
+            self.calls[name] += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def reset(self):
+        with self._lock:
+            self.calls = Counter()
+
+    def total(self):
+        return sum(self.calls.values())
+
+
+class FakeCluster(object):
+    """
+    A cluster with an admin node and `size` workers, `online` of which are
+    online. Half of the online workers are busy.
+    """
+
+    def __init__(self, name, size, online, counter):
+        self.name = name
+        self.counter = counter
+        self.launch_time = datetime.utcnow() - timedelta(minutes=55)
+        self.instances = [
+            {
+                "InstanceId": "admin",
+                "Ec2InstanceId": "i-admin",
+                "Hostname": "admin1",
+                "PublicDns": "admin.bench",
+                "PrivateDns": "admin.bench",
+                "Status": "online",
+                "LayerIds": [ADMIN_LAYER_ID],
+                "InstanceType": "m4.xlarge",
+            }
+        ]
+        for idx in range(size):
+            self.instances.append(
+                {
+                    "InstanceId": "worker-%d" % idx,
+                    "Ec2InstanceId": "i-worker-%d" % idx,
+                    "Hostname": "workers%d" % idx,
+                    "PrivateDns": "workers%d.bench" % idx,
+                    "Status": "online" if idx < online else "stopped",
+                    "LayerIds": [WORKERS_LAYER_ID],
+                    "InstanceType": "c4.2xlarge",
+                }
+            )
+        self.busy = set("http://workers%d.bench" % idx for idx in range(0, online, 2))
+
+    def client(self, service, *args, **kwargs):
+        return {
+            "opsworks": FakeOpsworks,
+            "ec2": FakeEc2,
+            "cloudwatch": FakeCloudwatch,
+        }[service](self)
+
+
+class FakeMeta(object):
+    def __init__(self):
+        self.events = HierarchicalEmitter()
+
+
+class FakeClient(object):
+    service = None
+
+    def __init__(self, cluster):
+        self.cluster = cluster
+        self.meta = FakeMeta()
+
+    def _call(self, operation):
+        # emit the same events as a real client so instrumentation sees them
+        context = {}
+        event = "%s.%s" % (self.service, operation)
+        self.meta.events.emit("before-call." + event, context=context)
+        self.cluster.counter(event)
+        self.meta.events.emit(
+            "after-call." + event,
+            parsed={"ResponseMetadata": {"RetryAttempts": 0}},
+            context=context,
+        )
+
+
+class FakePaginator(object):
+    def __init__(self, client, operation, pages):
+        self.client = client
+        self.operation = operation
+        self.pages = pages
+
+    def paginate(self, **kwargs):
+        for page in self.pages(**kwargs):
+            self.client._call(self.operation)
+            yield page
+
+
+class FakeOpsworks(FakeClient):
+    service = "opsworks"
+
+    def describe_stacks(self, **kwargs):
+        self._call("describe_stacks")
+        stacks = [
+            {"StackId": "other-%d" % x, "Name": "other-%d" % x} for x in range(20)
+        ]
+        stacks.append({"StackId": STACK_ID, "Name": self.cluster.name})
+        return {"Stacks": stacks}
+
+    def describe_layers(self, StackId):
+        self._call("describe_layers")
+        return {
+            "Layers": [
+                {"Name": "Admin", "LayerId": ADMIN_LAYER_ID},
+                {"Name": "Workers", "LayerId": WORKERS_LAYER_ID},
+            ]
+        }
+
+    def describe_instances(self, StackId):
+        self._call("describe_instances")
+        return {"Instances": [dict(x) for x in self.cluster.instances]}
+
+    def start_instance(self, InstanceId):
+        self._call("start_instance")
+
+    def stop_instance(self, InstanceId):
+        self._call("stop_instance")
+
+
+class FakeEc2(FakeClient):
+    service = "ec2"
+
+    def get_paginator(self, operation):
+        assert operation == "describe_instances"
+        return FakePaginator(self, operation, self._pages)
+
+    def _pages(self, Filters):
+        ids = Filters[0]["Values"]
+        for offset in range(0, len(ids), EC2_PAGE_SIZE):
+            end = offset + EC2_PAGE_SIZE
+            yield {
+                "Reservations": [
+                    {
+                        "Instances": [
+                            {"InstanceId": x, "LaunchTime": self.cluster.launch_time}
+                            for x in ids[offset:end]
+                        ]
+                    }
+                ]
+            }
+
+
+class FakeCloudwatch(FakeClient):
+    service = "cloudwatch"
+
+    def get_paginator(self, operation):
+        assert operation == "get_metric_data"
+        return FakePaginator(self, operation, self._pages)
+
+    def _pages(self, MetricDataQueries, StartTime, EndTime):
+        timestamps = [EndTime - timedelta(minutes=x) for x in range(5)]
+        yield {
+            "MetricDataResults": [
+                {"Id": x["Id"], "Timestamps": timestamps, "Values": [1.0] * 5}
+                for x in MetricDataQueries
+            ]
+        }
+
+
+class FakeHost(object):
+    def __init__(self, client, base_url):
+        self.client = client
+        self.base_url = base_url
+        self.maintenance = False
+
+    def set_maintenance(self, state):
+        self.client._call("set_maintenance")
+        self.maintenance = state
+
+
+class FakeStatistics(object):
+    def __init__(self, cluster):
+        self.cluster = cluster
+
+    def running_jobs(self, host=None):
+        if host is None:
+            return len(self.cluster.busy)
+        return 1 if host in self.cluster.busy else 0
+
+
+class FakeMHClient(object):
+    """
+    replaces pyhorn.MHClient; needs to be bound to a cluster via `for_cluster`
+    """
+
+    cluster = None
+
+    @classmethod
+    def for_cluster(cls, cluster):
+        return type("BoundFakeMHClient", (cls,), {"cluster": cluster})
+
+    def __init__(self, base_url, user=None, passwd=None, timeout=None):
+        self.base_url = base_url
+        self.host_objs = [
+            FakeHost(self, "http://" + x["PrivateDns"])
+            for x in self.cluster.instances
+            if x["Status"] == "online"
+        ]
+
+    def _call(self, operation):
+        self.cluster.counter("matterhorn.%s" % operation)
+
+    def me(self):
+        self._call("me")
+        return {"username": "bench"}
+
+    def hosts(self):
+        self._call("hosts")
+        return list(self.host_objs)
+
+    def statistics(self):
+        self._call("statistics")
+        return FakeStatistics(self.cluster)
+
+
+class FakeRequest(object):
+    def __init__(self, method, url):
+        self.method = method
+        self.url = url
+
+
+class FakeResponse(object):
+    status_code = 200
+    text = "3"
+    raw = None
+
+    history = ()
+
+    def __init__(self, request):
+        self.request = request
+
+
+class FakeSession(object):
+    """
+    replaces requests.Session for the queued job count requests
+    """
+
+    cluster = None
+
+    @classmethod
+    def for_cluster(cls, cluster):
+        return type("BoundFakeSession", (cls,), {"cluster": cluster})
+
+    def __init__(self):
+        self.headers = {}
+        self.auth = None
+
+    def mount(self, prefix, adapter):
+        pass
+
+    def request(self, method, url, timeout=None):
+        self.cluster.counter("matterhorn.queued_job_count")
+        return FakeResponse(FakeRequest(method, url))
+
+    def get(self, url, timeout=None):
+        return self.request("GET", url, timeout=timeout)
@@ -0,0 +1,230 @@
+#!/usr/bin/env python
+"""
+Benchmarks of the controller & autoscaler against synthetic clusters.
+
+    python -m benchmarks.run [--sizes 10,100,1000] [--latency 0.02]
+
+For each cluster size and operation the best wall time of `--repeat` runs
+and the number of remote (aws/matterhorn) calls made are reported. With
+`--baseline` the process exits non-zero if any operation makes more remote
+calls than recorded in the baseline file, e.g. because of a new N+1 call.
+"""
+
+import sys
+import json
+import time
+import click
+import shutil
+import tempfile
+from collections import OrderedDict
+from mock import patch
+from tabulate import tabulate
+
+from moscaler.autoscale import Autoscaler
+from moscaler.opsworks import OpsworksController
+from benchmarks.fakes import (
+    CallCounter,
+    FakeCluster,
+    FakeMHClient,
+    FakeSession,
+)
+
+CLUSTER_NAME = "bench"
+DOWN_INCREMENT = 2
+AUTOSCALE_CONFIG = {
+    "up_increment": 2,
+    "down_increment": DOWN_INCREMENT,
+    "pause_cycles": 0,
+    "strategies": [
+        {
+            "method": "cloudwatch",
+            "name": "layer load",
+            "settings": {
+                "metric": "load_1",
+                "layer_name": "Workers",
+                "namespace": "AWS/OpsWorks",
+                "up_threshold": 10.0,
+                "down_threshold": 5.0,
+            },
+        },
+        {
+            "method": "cloudwatch",
+            "name": "admin load",
+            "settings": {
+                "metric": "load_1",
+                "instance_name": "admin1",
+                "namespace": "AWS/OpsWorks",
+                "up_threshold": 10.0,
+                "down_threshold": 5.0,
+            },
+        },
+        {
+            "method": "queued_jobs",
+            "name": "queued jobs",
+            "settings": {"up_threshold": 20, "down_threshold": 10},
+        },
+    ],
+}
+
+
+def construct_cold(cache_dir):
+    # nothing cached yet
+    return lambda: OpsworksController(CLUSTER_NAME, cache_dir=cache_dir)
+
+
+def construct_warm(cache_dir):
+    OpsworksController(CLUSTER_NAME, cache_dir=cache_dir)
+    return lambda: OpsworksController(CLUSTER_NAME, cache_dir=cache_dir)
+
+
+def status(cache_dir):
+    controller = OpsworksController(CLUSTER_NAME, cache_dir=cache_dir)
+    return controller.status
+
+
+def refresh(cache_dir):
+    # as in a daemon cycle after the first: matterhorn connected & launch
+    # times already needed once
+    controller = OpsworksController(CLUSTER_NAME, cache_dir=cache_dir)
+    controller.mhorn
+    controller.get_launch_time(None)
+    return controller.refresh
+
+
+def scale_down(cache_dir):
+    controller = OpsworksController(CLUSTER_NAME, cache_dir=cache_dir)
+    return lambda: controller._scale_down(
+        DOWN_INCREMENT, check_uptime=True, scale_available=True
+    )
+
+
+def autoscale(cache_dir):
+    controller = OpsworksController(CLUSTER_NAME, cache_dir=cache_dir)
+    autoscaler = Autoscaler(controller, AUTOSCALE_CONFIG, pause_file_dir=cache_dir)
+    return autoscaler.execute
+
+
+# each of these sets up whatever's needed and returns the callable to time
+OPERATIONS = OrderedDict(
+    [
+        ("construct (cold)", construct_cold),
+        ("construct (warm)", construct_warm),
+        ("status", status),
+        ("refresh", refresh),
+        ("scale down", scale_down),
+        ("autoscale", autoscale),
+    ]
+)
+
+
+def run_operation(size, setup, latency, repeat):
+    """
+    returns the best wall time of `repeat` runs and the remote calls made
+    in the last one
+    """
+    counter = CallCounter(latency)
+    cluster = FakeCluster(CLUSTER_NAME, size, size // 2, counter)
+
+    best = None
+    with patch("boto3.client", side_effect=cluster.client), patch(
+        "pyhorn.MHClient", FakeMHClient.for_cluster(cluster)
+    ), patch("requests.Session", FakeSession.for_cluster(cluster)):
+        for _ in range(repeat):
+            cache_dir = tempfile.mkdtemp()
+            try:
+                operation = setup(cache_dir)
+                counter.reset()
+                start = time.time()
+                operation()
+                elapsed = time.time() - start
+            finally:
+                shutil.rmtree(cache_dir, ignore_errors=True)
+            best = elapsed if best is None else min(best, elapsed)
+
+    return best, dict(counter.calls)
+
+
+@click.command()
+@click.option(
+    "-s", "--sizes", default="10,100,1000", help="comma-separated worker counts"
+)
+@click.option(
+    "-l", "--latency", type=float, default=0.0, help="seconds added to each call"
+)
+@click.option("-r", "--repeat", type=int, default=3, help="runs per operation")
+@click.option("-o", "--operation", multiple=True, help="only run these operations")
+@click.option("-f", "--format", default="table")
+@click.option(
+    "--baseline",
+    type=click.Path(exists=True, dir_okay=False),
+    help="fail if call counts exceed those in this file",
+)
+@click.option("--save-baseline", type=click.Path(), help="write call counts here")
+def main(sizes, latency, repeat, operation, format, baseline, save_baseline):
+
+    results = []
+    for size in [int(x) for x in sizes.split(",")]:
+        for name, setup in OPERATIONS.items():
+            if operation and name not in operation:
+                continue
+            wall, calls = run_operation(size, setup, latency, repeat)
+            results.append(
+                {
+                    "workers": size,
+                    "operation": name,
+                    "wall_ms": wall * 1000,
+                    "calls": sum(calls.values()),
+                    "calls_by_type": calls,
+                }
+            )
+
+    if format == "json":
+        print(json.dumps(results, indent=2))
+    else:
+        print(
+            tabulate(
+                [
+                    [
+                        x["workers"],
+                        x["operation"],
+                        "%.1f" % x["wall_ms"],
+                        x["calls"],
+                        " ".join(
+                            "%s=%d" % item
+                            for item in sorted(x["calls_by_type"].items())
+                        ),
+                    ]
+                    for x in results
+                ],
+                headers=["Workers", "Operation", "Wall (ms)", "Calls", "Breakdown"],
+            )
+        )
+
+    if save_baseline:
+        with open(save_baseline, "w") as f:
+            json.dump(
+                {"%(workers)d %(operation)s" % x: x["calls"] for x in results},
+                f,
+                indent=2,
+                sort_keys=True,
+            )
+
+    if baseline:
+        with open(baseline, "r") as f:
+            expected = json.load(f)
+        regressions = [
+            (key, expected[key], x["calls"])
+            for x in results
+            for key in ["%(workers)d %(operation)s" % x]
+            if key in expected and x["calls"] > expected[key]
+        ]
+        for key, was, now in regressions:
+            click.echo(
+                "%s: %d remote calls, baseline is %d" % (key, now, was), err=True
+            )
+        if regressions:
+            sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
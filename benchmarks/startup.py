@@ -0,0 +1,97 @@
+#!/usr/bin/env python
+"""
+Startup time of the cli.
+
+    python -m benchmarks.startup [--runs 5] [--budget 0.25]
+
+Runs `manager.py --version` in fresh interpreters and reports the best wall
+time along with the modules it imported. Exits non-zero if startup is over
+`--budget` seconds or any of the heavy dependencies that should only be
+loaded when a command needs them were imported.
+"""
+
+import os
+import sys
+import time
+import click
+import subprocess
+
+MANAGER = os.path.join(os.path.dirname(os.path.dirname(__file__)), "manager.py")
+
+# only needed once a command actually talks to aws/matterhorn or prints tables
+DEFERRED_MODULES = [
+    "boto3",
+    "botocore",
+    "pyhorn",
+    "requests",
+    "stopit",
+    "arrow",
+    "tabulate",
+    "moscaler.opsworks",
+    "moscaler.matterhorn",
+    "moscaler.autoscale",
+]
+
+
+def imported_modules(args=("--version",)):
+    """
+    top-level names of the modules imported by running the cli with `args`
+    """
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", MANAGER] + list(args),
+        stdout=subprocess.DEVNULL,
+        stderr=subprocess.PIPE,
+        universal_newlines=True,
+        check=True,
+    )
+    modules = set()
+    for line in proc.stderr.splitlines():
+        if not line.startswith("import time:") or line.endswith("package"):
+            continue
+        modules.add(line.rsplit("|", 1)[1].strip())
+    return modules
+
+
+def deferred_imports(modules):
+    """
+    the DEFERRED_MODULES (or their submodules) that were imported anyway
+    """
+    return sorted(
+        x
+        for x in DEFERRED_MODULES
+        if any(m == x or m.startswith(x + ".") for m in modules)
+    )
+
+
+def startup_time(runs, args=("--version",)):
+    best = None
+    for _ in range(runs):
+        start = time.perf_counter()
+        subprocess.run(
+            [sys.executable, MANAGER] + list(args),
+            stdout=subprocess.DEVNULL,
+            stderr=subprocess.DEVNULL,
+            check=True,
+        )
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best
+
+
+@click.command()
+@click.option("-r", "--runs", type=int, default=5, help="interpreter starts to time")
+@click.option("-b", "--budget", type=float, default=0.25, help="max acceptable seconds")
+def main(runs, budget):
+
+    best = startup_time(runs)
+    deferred = deferred_imports(imported_modules())
+
+    print("startup: %.3fs (best of %d, budget %.3fs)" % (best, runs, budget))
+    if deferred:
+        click.echo("imported at startup: %s" % ", ".join(deferred), err=True)
+    if best > budget or deferred:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -3,83 +3,211 @@
 import os
 import sys
 import json
-import boto3
+import time
 import click
 import dotenv
 import unipath
 import logging
 from functools import wraps
 from os import getenv as env
-from tabulate import tabulate
 from click.exceptions import UsageError
 
 import moscaler
-from moscaler.opsworks import OpsworksController
 from moscaler.exceptions import OpsworksControllerException
+from moscaler.instrumentation import STATS as CALL_STATS, SCOPE
+from moscaler.clusters import ClusterLogFilter, ClusterSet, read_cluster_file
+from moscaler import exporter
+from moscaler.timing import TIMINGS
 
 base_dir = unipath.Path(__file__).absolute().parent
 dotenv.load_dotenv(base_dir.child(".env"))
 
 LOGGER = logging.getLogger("moscaler")
 
+# commands that don't operate on a real cluster
+OFFLINE_COMMANDS = ["simulate"]
+
+# where the metrics of each scaling command/cycle get sent, if anywhere
+EXPORTERS = []
+
 
 def handle_exit(cmd):
     """
-    execute the command and catch any cluster exceptions. The return value
-    will be used as the arg for sys.exit().
+    execute the command for each cluster and catch any cluster exceptions.
+    The return value, non-zero if the command failed for any of the
+    clusters, will be used as the arg for sys.exit().
     """
 
     @wraps(cmd)
-    def exit_wrapper(cluster, *args, **kwargs):
-        try:
-            cmd(cluster, *args, **kwargs)
-            return 0
-        except OpsworksControllerException as exc:
-            LOGGER.info(str(exc))
-            return 1
+    def exit_wrapper(clusters, *args, **kwargs):
+        clusters.run(cmd, *args, **kwargs)
+        clusters.log_results()
+        return clusters.exit_code
 
     return exit_wrapper
 
 
-def log_before_after_stats(cmd):
-    @wraps(cmd)
-    def wrapped(controller, *args, **kwargs):
-        status = controller.status()
-        LOGGER.info("Cluster status: %s", status_summary(status), extra=status)
-        result = cmd(controller, *args, **kwargs)
-        actions = controller.actions()
-        LOGGER.info("Action summary: %s", action_summary(actions), extra=actions)
-        return result
+def log_before_after_stats(matterhorn=True):
+    """
+    log a cluster status summary before the command and an action summary
+    after. `matterhorn` says whether the status should include the matterhorn
+    job/node details, which means connecting to the admin node; it can also be
+    a callable that's passed the command's kwargs and returns a bool.
+    """
+
+    def decorator(cmd):
+        @wraps(cmd)
+        def wrapped(controller, *args, **kwargs):
+            start = time.time()
+            include_matterhorn = matterhorn
+            if callable(matterhorn):
+                include_matterhorn = matterhorn(kwargs)
+            with TIMINGS.phase("status"):
+                status = controller.status(include_matterhorn=include_matterhorn)
+            LOGGER.info("Cluster status: %s", status_summary(status), extra=status)
+            with TIMINGS.phase("actions"):
+                result = cmd(controller, *args, **kwargs)
+            actions = controller.actions()
+            LOGGER.info("Action summary: %s", action_summary(actions), extra=actions)
+            remote_calls = log_remote_calls()
+            if EXPORTERS:
+                samples = exporter.cycle_samples(
+                    controller, status, actions, time.time() - start, remote_calls
+                )
+                exporter.export(EXPORTERS, samples)
+            return result
+
+        return wrapped
+
+    return decorator
+
+
+def uses_matterhorn(kwargs):
+    """
+    whether any of the autoscale strategies consult matterhorn directly,
+    i.e. aren't based on cloudwatch metrics
+    """
+    from moscaler.autoscale import METRIC_SAMPLE_COUNTS
+
+    strategies = kwargs["config"].get("strategies", [])
+    return any(x["method"] not in METRIC_SAMPLE_COUNTS for x in strategies)
 
-    return wrapped
+
+def load_autoscale_config(ctx, param, config):
+    """
+    click callback that parses the --config value into a dict
+    """
+
+    if config is None:
+        raise click.ClickException("No autoscale config provided")
+
+    try:
+        if os.path.isfile(config):
+            with open(config, "r") as f:
+                return json.load(f)
+        else:
+            return json.loads(config)
+    except Exception as e:
+        raise click.BadParameter("Failed to parse autoscale config: %s" % str(e))
 
 
 @click.group()
-@click.option("-c", "--cluster", help="opsworks cluster name")
+@click.option(
+    "-c",
+    "--cluster",
+    multiple=True,
+    help="opsworks cluster name; can be given more than once",
+)
+@click.option(
+    "--cluster-file",
+    type=click.Path(exists=True, dir_okay=False),
+    help="file listing opsworks cluster names, one per line",
+)
 @click.option("-p", "--profile", help="set/override default aws profile")
 @click.option("-d", "--debug", help="enable debug output", is_flag=True)
 @click.option("-f", "--force", is_flag=True)
 @click.option("-n", "--dry-run", is_flag=True)
+@click.option(
+    "--prometheus-textfile",
+    envvar="MOSCALER_PROMETHEUS_TEXTFILE",
+    type=click.Path(dir_okay=False),
+    help="write cycle metrics to this prometheus textfile",
+)
+@click.option(
+    "--statsd",
+    envvar="MOSCALER_STATSD_ADDRESS",
+    help="send cycle metrics to this statsd host:port",
+)
+@click.option(
+    "--profile-output",
+    type=click.Path(dir_okay=False),
+    help="profile the command with cProfile and write the stats here",
+)
+@click.option("--timings", is_flag=True, help="print where the time went when done")
 @click.version_option(moscaler.__version__)
 @click.pass_context
-def cli(ctx, cluster, profile, debug, force, dry_run):
-
-    if cluster is None:
-        cluster = env("MOSCALER_CLUSTER")
-        if cluster is None:
+def cli(
+    ctx,
+    cluster,
+    cluster_file,
+    profile,
+    debug,
+    force,
+    dry_run,
+    prometheus_textfile,
+    statsd,
+    profile_output,
+    timings,
+):
+
+    TIMINGS.add("startup", time.perf_counter() - TIMINGS.start)
+
+    if profile_output is not None:
+        start_profiler(ctx, profile_output)
+    if timings:
+        ctx.call_on_close(print_timings)
+
+    if ctx.invoked_subcommand in OFFLINE_COMMANDS:
+        init_logging(ctx.invoked_subcommand, debug)
+        return
+
+    clusters = list(cluster)
+    if cluster_file is not None:
+        clusters += read_cluster_file(cluster_file)
+    if not clusters:
+        # can be a comma/space separated list
+        clusters = env("MOSCALER_CLUSTER", "").replace(",", " ").split()
+        if not clusters:
             raise UsageError("No cluster specified")
 
     if profile is not None:
+        import boto3
+
         boto3.setup_default_session(profile_name=profile)
 
-    init_logging(cluster, debug)
+    init_logging(",".join(clusters), debug)
+
+    if prometheus_textfile is not None:
+        EXPORTERS.append(exporter.PrometheusTextfileExporter(prometheus_textfile))
+    if statsd is not None:
+        EXPORTERS.append(exporter.StatsdExporter(statsd))
 
     if force:
         LOGGER.warn("--force mode enabled")
     if dry_run:
         LOGGER.warn("--dry-run mode enabled")
 
-    ctx.obj = OpsworksController(cluster, force, dry_run)
+    with TIMINGS.phase("construction"):
+        # deferred so that --help/--version etc. don't pay for boto3 & co.
+        from moscaler.clients import AwsClients
+        from moscaler.opsworks import OpsworksController
+
+        # one set of clients shared by all the clusters' controllers
+        clients = AwsClients()
+        ctx.obj = ClusterSet(
+            clusters,
+            lambda name: OpsworksController(name, force, dry_run, clients=clients),
+        )
 
 
 @cli.result_callback()
@@ -90,17 +218,32 @@ def exit_with_code(result, *args, **kwargs):
 
 @cli.command()
 @click.option("-f", "--format", default="table")
+@click.option(
+    "--no-matterhorn",
+    is_flag=True,
+    help="skip the matterhorn job/node details (no admin node connection)",
+)
 @click.pass_obj
-@handle_exit
-def status(controller, format):
-
-    status = controller.status()
-    print_status(status, format=format)
+def status(clusters, format, no_matterhorn):
+    def get_status(controller):
+        with TIMINGS.phase("status"):
+            status = controller.status(include_matterhorn=not no_matterhorn)
+        log_remote_calls()
+        return status
+
+    statuses = list(clusters.run(get_status).values())
+    if format == "json" and len(clusters) > 1:
+        print(json.dumps(statuses, indent=2))
+    else:
+        for status in statuses:
+            print_status(status, format=format)
+    clusters.log_results()
+    return clusters.exit_code
 
 
 @cli.group()
 @click.pass_obj
-def scale(controller):
+def scale(clusters):
     pass
 
 
@@ -109,7 +252,7 @@ def scale(controller):
 @click.option("--scale-available", is_flag=True, default=False)
 @click.pass_obj
 @handle_exit
-@log_before_after_stats
+@log_before_after_stats()
 def to(controller, num_workers, scale_available):
 
     controller.scale_to(num_workers, scale_available)
@@ -120,7 +263,7 @@ def to(controller, num_workers, scale_available):
 @click.option("--scale-available", is_flag=True, default=False)
 @click.pass_obj
 @handle_exit
-@log_before_after_stats
+@log_before_after_stats(matterhorn=False)
 def up(controller, num_workers, scale_available):
 
     controller.scale("up", num_workers, scale_available)
@@ -130,7 +273,7 @@ def up(controller, num_workers, scale_available):
 @click.argument("num_workers", type=int, default=1)
 @click.pass_obj
 @handle_exit
-@log_before_after_stats
+@log_before_after_stats()
 def down(controller, num_workers):
 
     controller.scale("down", num_workers)
@@ -141,41 +284,196 @@ def down(controller, num_workers):
     "-c",
     "--config",
     envvar="AUTOSCALE_CONFIG",
+    callback=load_autoscale_config,
     help=("json string or path to json file " "containing autoscale configuration"),
 )
 @click.pass_obj
 @handle_exit
-@log_before_after_stats
+@log_before_after_stats(matterhorn=uses_matterhorn)
 def auto(controller, config):
 
-    if config is None:
-        raise click.ClickException("No autoscale config provided")
+    controller.autoscale(config)
+
+
+@scale.command()
+@click.option(
+    "-c",
+    "--config",
+    envvar="AUTOSCALE_CONFIG",
+    callback=load_autoscale_config,
+    help=("json string or path to json file " "containing autoscale configuration"),
+)
+@click.option(
+    "-i",
+    "--interval",
+    type=int,
+    default=60,
+    envvar="MOSCALER_DAEMON_INTERVAL",
+    help="seconds between the start of each autoscale cycle",
+)
+@click.option(
+    "--cycles", type=int, default=0, help="exit after this many cycles (0 = no limit)"
+)
+@click.pass_obj
+def daemon(clusters, config, interval, cycles):
+
+    if not clusters.controllers:
+        return clusters.exit_code
+
+    LOGGER.info("Starting autoscale daemon with %ds interval", interval)
+
+    def run_cycle(controller, cycle):
+        cycle_start = time.time()
+        refresh_time = 0
+        try:
+            # the controller was freshly built for the first cycle
+            if cycle > 1:
+                with TIMINGS.phase("refresh"):
+                    controller.refresh()
+                refresh_time = time.time() - cycle_start
+            autoscale_cycle(controller, config=config)
+        finally:
+            elapsed = time.time() - cycle_start
+            timing = {
+                "cycle": cycle,
+                "refresh_seconds": refresh_time,
+                "autoscale_seconds": elapsed - refresh_time,
+                "cycle_seconds": elapsed,
+            }
+            LOGGER.info(
+                "Cycle %d timing: refresh %.2fs, autoscale %.2fs, total %.2fs",
+                cycle,
+                timing["refresh_seconds"],
+                timing["autoscale_seconds"],
+                timing["cycle_seconds"],
+                extra=timing,
+            )
+
+    cycle = 0
+    while True:
+        cycle += 1
+        cycle_start = time.time()
+        # report each cycle's remote calls separately
+        if cycle > 1:
+            CALL_STATS.reset()
+        try:
+            # all clusters are cycled in step; failures are logged per cluster
+            clusters.run(run_cycle, cycle)
+        except KeyboardInterrupt:
+            LOGGER.info("Interrupted; stopping autoscale daemon")
+            return clusters.exit_code
+        clusters.log_results()
+
+        if cycles and cycle >= cycles:
+            return clusters.exit_code
+
+        elapsed = time.time() - cycle_start
+
+        try:
+            time.sleep(max(0, interval - elapsed))
+        except KeyboardInterrupt:
+            LOGGER.info("Interrupted; stopping autoscale daemon")
+            return clusters.exit_code
+
+
+@cli.command()
+@click.argument("trace", type=click.Path(exists=True, dir_okay=False))
+@click.option(
+    "-c",
+    "--config",
+    envvar="AUTOSCALE_CONFIG",
+    callback=load_autoscale_config,
+    help=("json string or path to json file " "containing autoscale configuration"),
+)
+@click.option("-w", "--workers", type=int, help="number of workers in the cluster")
+@click.option(
+    "--boot-time", type=int, help="seconds a started worker takes to come online"
+)
+@click.option(
+    "--spike-threshold", type=int, help="queued jobs count that counts as a spike"
+)
+@click.option("-f", "--format", default="table")
+def simulate(trace, config, workers, boot_time, spike_threshold, format):
+    """
+    replay a recorded trace through the autoscaler
+    """
+    from moscaler.simulate import Simulation, load_trace
 
     try:
-        if os.path.isfile(config):
-            with open(config, "r") as f:
-                config = json.load(f)
-        else:
-            config = json.loads(config)
-    except Exception as e:
-        raise click.BadParameter("Failed to parse autoscale config: %s" % str(e))
+        simulation = Simulation(
+            load_trace(trace), config, workers, boot_time, spike_threshold
+        )
+    except OpsworksControllerException as exc:
+        LOGGER.info(str(exc))
+        return 1
+    results = simulation.run()
+    print_simulation(results, format=format)
+    if results["aborted_cycles"]:
+        LOGGER.error(
+            "%d of %d cycles were aborted; see the log for why",
+            results["aborted_cycles"],
+            results["cycles"],
+        )
+        return 1
+    return 0
+
 
+@log_before_after_stats(matterhorn=uses_matterhorn)
+def autoscale_cycle(controller, config):
     controller.autoscale(config)
 
 
+def start_profiler(ctx, path):
+    """
+    profile the rest of the run, writing the stats when the command is done.
+    Only the main thread is profiled.
+    """
+    import cProfile
+
+    profiler = cProfile.Profile()
+
+    def write_stats():
+        profiler.disable()
+        profiler.dump_stats(path)
+        LOGGER.info("Wrote profile stats to %s", path)
+
+    ctx.call_on_close(write_stats)
+    profiler.enable()
+
+
+def print_timings():
+    from tabulate import tabulate
+
+    report = TIMINGS.report()
+    total = report[-1][1]
+    click.echo(
+        tabulate(
+            [
+                [name, "%.3f" % seconds, "%.1f%%" % (100 * seconds / total)]
+                for name, seconds in report
+            ],
+            headers=["Phase", "Seconds", "%"],
+        ),
+        err=True,
+    )
+
+
 def init_logging(cluster, debug):
+    """
+    records are tagged with the cluster they're about, or `cluster` if
+    they're not about any one cluster in particular
+    """
     import logging.config
 
     if debug:
         level = logging.getLevelName(logging.DEBUG)
         format = (
-            "[%(levelname)s] ["
-            + cluster
-            + "] [%(module)s:%(funcName)s:%(lineno)d] %(message)s"
+            "[%(levelname)s] [%(cluster)s] "
+            "[%(module)s:%(funcName)s:%(lineno)d] %(message)s"
         )
     else:
         level = logging.getLevelName(logging.INFO)
-        format = "[%(levelname)s] [" + cluster + "] %(message)s"
+        format = "[%(levelname)s] [%(cluster)s] %(message)s"
 
     config = {
         "version": 1,
@@ -186,14 +484,17 @@ def init_logging(cluster, debug):
                 "level": level,
                 "stream": "ext://sys.stdout",
                 "formatter": "basic",
+                "filters": ["cluster"],
             },
             "stderr": {
                 "class": "logging.StreamHandler",
                 "level": "ERROR",
                 "stream": "ext://sys.stderr",
                 "formatter": "basic",
+                "filters": ["cluster"],
             },
         },
+        "filters": {"cluster": {"()": ClusterLogFilter, "default": cluster}},
         "formatters": {"basic": {"format": format}},
     }
 
@@ -202,24 +503,46 @@ def init_logging(cluster, debug):
 
 def status_summary(status):
 
-    return ", ".join(
-        [
-            "workers: %d" % status["workers"],
-            "online workers: %d" % status["workers_online"],
+    summary = [
+        "workers: %d" % status["workers"],
+        "online workers: %d" % status["workers_online"],
+    ]
+    # the matterhorn details are left out when it wasn't consulted
+    if "job_status" in status:
+        summary += [
             "queued high load jobs: %d" % status["job_status"]["queued_jobs_high_load"],
             "running jobs: %d" % status["job_status"]["running_jobs"],
         ]
+    return ", ".join(summary)
+
+
+def log_remote_calls():
+    # just the calls made for the cluster being worked on, if any
+    report = CALL_STATS.report(scope=SCOPE.get())
+    LOGGER.info(
+        "Remote calls: %s",
+        CALL_STATS.summary(report),
+        extra={"remote_calls": report},
     )
+    return report
 
 
 def action_summary(actions):
-    return "stopped: %d, started: %d" % (
+    summary = "stopped: %d, started: %d" % (
         actions["total_stopped"],
         actions["total_started"],
     )
+    if "mh_snapshot" in actions:
+        summary += ", matterhorn snapshot hits/misses: %d/%d" % (
+            actions["mh_snapshot"]["hits"],
+            actions["mh_snapshot"]["misses"],
+        )
+    return summary
 
 
 def print_status(status, format="table"):
+    from tabulate import tabulate
+
     if format == "json":
         print(json.dumps(status, indent=2))
     elif format == "table":
@@ -228,10 +551,16 @@ def print_status(status, format="table"):
             ["Workers", status["workers"]],
             ["Workers Online", status["workers_online"]],
             ["Workers Pending", status["workers_pending"]],
-            ["MH Online", status["matterhorn_online"]],
-            ["Running Jobs", status["job_status"]["running_jobs"]],
-            ["Queued High Load Jobs", status["job_status"]["queued_jobs_high_load"]],
         ]
+        if "job_status" in status:
+            cluster += [
+                ["MH Online", status["matterhorn_online"]],
+                ["Running Jobs", status["job_status"]["running_jobs"]],
+                [
+                    "Queued High Load Jobs",
+                    status["job_status"]["queued_jobs_high_load"],
+                ],
+            ]
         print(tabulate(cluster))
         instance_headers = [
             "Opsworks Id",
@@ -253,9 +582,9 @@ def print_status(status, format="table"):
                 x["hostname"],
                 x["uptime"],
                 x["billed_minutes"],
-                x["idle"],
-                x["maintenance"],
-                x["registered"],
+                x.get("idle"),
+                x.get("maintenance"),
+                x.get("registered"),
                 x["mh_host_url"],
             ]
             for x in status["worker_details"]
@@ -263,5 +592,36 @@ def print_status(status, format="table"):
         print(tabulate(instances, headers=instance_headers))
 
 
+def print_simulation(results, format="table"):
+    from tabulate import tabulate
+
+    if format == "json":
+        print(json.dumps(results, indent=2))
+    elif format == "table":
+        print(tabulate([[k, v] for k, v in results.items() if k != "spikes"]))
+        spike_headers = [
+            "Start (s)",
+            "Duration (s)",
+            "Peak Queued Jobs",
+            "Peak Online Workers",
+            "Time to Capacity (s)",
+        ]
+        spikes = [
+            [
+                x["start"],
+                x["duration"],
+                x["peak_queued_jobs"],
+                x["peak_online_workers"],
+                (
+                    "not reached"
+                    if x["time_to_capacity"] is None
+                    else x["time_to_capacity"]
+                ),
+            ]
+            for x in results["spikes"]
+        ]
+        print(tabulate(spikes, headers=spike_headers))
+
+
 if __name__ == "__main__":
     cli()
@@ -1,25 +1,79 @@
 import os
-import boto3
+import re
+import math
+import time
 import logging
+import threading
+from collections import namedtuple
+from concurrent.futures import TimeoutError
 from datetime import datetime, timedelta
 from operator import itemgetter
 from moscaler.exceptions import OpsworksScalingException
+from moscaler.concurrency import submit_daemon
+from moscaler import evaluators, forecast
+from moscaler.history import MetricHistory, series_key, to_epoch
+from moscaler.timing import TIMINGS
 
 LOGGER = logging.getLogger(__name__)
 
+# GetMetricData accepts at most this many queries per request
+METRIC_DATA_MAX_QUERIES = 500
+
+# strategy methods that look at cloudwatch metrics -> their default number
+# of datapoints to consider
+METRIC_SAMPLE_COUNTS = {"cloudwatch": 3, "forecast": 15}
+# seconds ahead the forecast strategy looks, by default about a worker's
+# boot time
+FORECAST_HORIZON = 300
+# with a metric history, the number of most recent periods to fetch again
+# anyway, as cloudwatch may still be filling them in
+HISTORY_REFETCH_PERIODS = 2
+
+MetricQuery = namedtuple(
+    "MetricQuery", ["namespace", "metric", "dimension", "period", "window"]
+)
+
 
 class AutoscaleException(OpsworksScalingException):
     pass
 
 
+class MetricPrefetch(object):
+    """
+    The datapoints of an execution's strategies, fetched together by
+    whichever strategy needs them first. Each execution gets its own, so that
+    a timed-out strategy still running from an earlier one can't change
+    what a later one sees.
+    """
+
+    def __init__(self):
+        self.lock = threading.Lock()
+        self.data = None
+
+
 class Autoscaler(object):
-    def __init__(self, controller, config, pause_file_dir=None):
+    def __init__(self, controller, config, pause_file_dir=None, cluster=None):
         self.controller = controller
         self.config = config
 
         if pause_file_dir is None:
             pause_file_dir = os.path.expanduser("~")
-        self.pause_file = os.path.join(pause_file_dir, ".moscaler-pause")
+        self.pause_file_dir = pause_file_dir
+        pause_file = ".moscaler-pause"
+        if cluster is not None:
+            # so that scaling one cluster doesn't pause the others
+            pause_file += "-" + re.sub(r"[^\w\-.]", "_", cluster)
+        self.pause_file = os.path.join(pause_file_dir, pause_file)
+
+        # wall time, in seconds, each strategy took in the last execution
+        self.strategy_times = {}
+        # each strategy's decision, and the value it was based on, in the
+        # last execution
+        self.strategy_results = {}
+        self.strategy_values = {}
+        # the (up, down) thresholds each strategy compared its value to
+        self.strategy_thresholds = {}
+        self._local = threading.local()
 
     @property
     def up_increment(self):
@@ -29,6 +83,18 @@ class Autoscaler(object):
     def down_increment(self):
         return self.config["down_increment"]
 
+    @property
+    def sizing(self):
+        return self.config.get("sizing", "fixed")
+
+    @property
+    def max_up_increment(self):
+        return self.config.get("max_up_increment")
+
+    @property
+    def max_down_increment(self):
+        return self.config.get("max_down_increment")
+
     @property
     def pause_cycles(self):
         return self.config["pause_cycles"]
@@ -37,6 +103,36 @@ class Autoscaler(object):
     def strategies(self):
         return self.config["strategies"]
 
+    @property
+    def parallel(self):
+        return self.config.get("parallel", False)
+
+    @property
+    def strategy_timeout(self):
+        return self.config.get("strategy_timeout")
+
+    @property
+    def metric_history(self):
+        """
+        the MetricHistory fetched datapoints are kept in, if enabled. The
+        `metric_history` setting can be `true` or the path of the database.
+        """
+        setting = self.config.get("metric_history")
+        if not setting:
+            return None
+        if not hasattr(self, "_metric_history"):
+            path = setting
+            if setting is True:
+                path = os.path.join(self.pause_file_dir, ".moscaler-metrics.db")
+            self._metric_history = MetricHistory(path)
+        return self._metric_history
+
+    def now(self):
+        """
+        the current (naive, utc) time that metric windows are relative to
+        """
+        return datetime.utcnow()
+
     def pause_scaling(self, cycles):
         LOGGER.debug("Updating %s to indicate %d pause cycles", self.pause_file, cycles)
         self._write_pause_file(cycles)
@@ -75,130 +171,488 @@ class Autoscaler(object):
 
     def execute(self):
 
-        results = {}
         for strategy in self.strategies:
-            try:
-                method = getattr(self, strategy["method"])
-                direction = method(strategy["settings"])
-
-            except AttributeError:
+            if not hasattr(self, strategy["method"]):
                 raise OpsworksScalingException(
-                    "No such autoscale method: '%s'", strategy["method"]
+                    "No such autoscale method: '%s'" % strategy["method"]
                 )
 
+        with TIMINGS.phase("strategies"):
+            # fetched by whichever strategy needs them first, so that a slow
+            # cloudwatch only holds up the strategies that depend on it and
+            # counts towards their time & timeout
+            prefetch = MetricPrefetch()
+
+            if self.parallel:
+                outcomes = self._run_strategies_concurrently(prefetch)
+            else:
+                outcomes = [self._run_strategy(x, prefetch) for x in self.strategies]
+
+        results = {}
+        self.strategy_values = {}
+        self.strategy_thresholds = {}
+        for strategy, outcome in zip(self.strategies, outcomes):
+            direction, value, thresholds, elapsed = outcome
+
             if direction is None:
                 LOGGER.info("%s indicates no action", strategy["name"])
 
-            LOGGER.info("%s says: '%s'", strategy["name"], direction)
+            LOGGER.info("%s says: '%s' (%.2fs)", strategy["name"], direction, elapsed)
             results[strategy["name"]] = direction
+            self.strategy_times[strategy["name"]] = elapsed
+            self.strategy_values[strategy["name"]] = value
+            self.strategy_thresholds[strategy["name"]] = thresholds
 
-        self._scale_up_or_down(results)
+        self.strategy_results = results
+        with TIMINGS.phase("actions"):
+            self._scale_up_or_down(results)
+
+    def _run_strategy(self, strategy, prefetch=None):
+        """
+        returns the strategy's direction, the value it reported basing that
+        on (if any), the (up, down) thresholds it compared that to and how
+        long it took to decide
+        """
+        method = getattr(self, strategy["method"])
+        # strategies may run concurrently, and outlive their execution, so
+        # this is all per-thread
+        self._local.prefetch = prefetch
+        self._local.value = None
+        self._local.thresholds = (None, None)
+        start = time.time()
+        direction = method(strategy["settings"])
+        return (
+            direction,
+            self._local.value,
+            self._local.thresholds,
+            time.time() - start,
+        )
+
+    def _report_value(self, value, up_threshold=None, down_threshold=None):
+        # strategies may run concurrently, so this is per-thread
+        self._local.value = value
+        self._local.thresholds = (up_threshold, down_threshold)
+
+    def _run_strategies_concurrently(self, prefetch=None):
+        """
+        evaluate all strategies, each in its own thread. Any strategy that
+        hasn't finished within `strategy_timeout` seconds of the start is
+        treated as indicating no action. Its thread is left to finish in the
+        background (or not; it won't keep the process from exiting).
+        """
+        timeout = self.strategy_timeout
+        start = time.time()
+        futures = [
+            submit_daemon(self._run_strategy, x, prefetch) for x in self.strategies
+        ]
+
+        outcomes = []
+        for strategy, future in zip(self.strategies, futures):
+            remaining = None
+            if timeout is not None:
+                remaining = max(0, timeout - (time.time() - start))
+            try:
+                outcomes.append(future.result(timeout=remaining))
+            except TimeoutError:
+                LOGGER.warning(
+                    "%s timed out after %ss; treating as no action",
+                    strategy["name"],
+                    timeout,
+                )
+                outcomes.append((None, None, (None, None), time.time() - start))
+
+        return outcomes
 
     def _scale_up_or_down(self, results):
 
         # only one has to say 'up' to go up
         if "up" in results.values() and not self.scaling_paused():
-            self.controller._scale_up(self.up_increment, scale_available=True)
-            if self.pause_cycles:
-                self.pause_scaling(self.pause_cycles)
-            # return here to avoid ticking the pause cycle value
-            return
+            num_workers = self._up_size(results)
+            if num_workers:
+                self.controller._scale_up(num_workers, scale_available=True)
+                if self.pause_cycles:
+                    self.pause_scaling(self.pause_cycles)
+                # return here to avoid ticking the pause cycle value
+                return
 
         # everyone has to agree to go down
         elif results and all(d == "down" for d in results.values()):
+            num_workers = self._down_size(results)
             with self.controller.mhorn.in_maintenance(
                 self.controller.online_workers, dry_run=self.controller.dry_run
             ):
                 self.controller._scale_down(
-                    self.down_increment, check_uptime=True, scale_available=True
+                    num_workers, check_uptime=True, scale_available=True
                 )
 
         self._tick_pause_cycles()
 
+    def _up_size(self, results):
+        """
+        the number of workers to start. With proportional sizing, enough to
+        cover the largest excess over a strategy's up threshold, less the
+        workers already on their way up.
+        """
+        if self.sizing != "proportional":
+            return self.up_increment
+
+        num_workers = max(
+            self._proportional_size(x, "up", self.up_increment)
+            for x in self.strategies
+            if results.get(x["name"]) == "up"
+        )
+        pending = len(self.controller.pending_workers)
+        if pending:
+            LOGGER.debug("%d workers are already starting", pending)
+            num_workers -= pending
+        if self.max_up_increment is not None:
+            num_workers = min(num_workers, self.max_up_increment)
+        num_workers = min(num_workers, len(self.controller.stopped_workers))
+        if num_workers < 1:
+            LOGGER.info("No more workers needed to scale up")
+            return 0
+        LOGGER.info("Proportional scale up by %d workers", num_workers)
+        return num_workers
+
+    def _down_size(self, results):
+        """
+        the number of workers to stop. With proportional sizing, as many as
+        the smallest shortfall under a strategy's down threshold allows.
+        """
+        if self.sizing != "proportional":
+            return self.down_increment
+
+        num_workers = min(
+            self._proportional_size(x, "down", self.down_increment)
+            for x in self.strategies
+        )
+        if self.max_down_increment is not None:
+            num_workers = min(num_workers, self.max_down_increment)
+        LOGGER.info("Proportional scale down by %d workers", num_workers)
+        return num_workers
+
+    def _proportional_size(self, strategy, direction, increment):
+        """
+        the number of workers that would bring the strategy's value back
+        within its threshold, given that each worker accounts for
+        `per_worker` of it. Never less than the fixed `increment`, which is
+        also what's used if the strategy doesn't say how much a worker
+        accounts for.
+        """
+        settings = strategy["settings"]
+        per_worker = settings.get(
+            "per_worker", settings.get("up_threshold_online_workers_multiplier")
+        )
+        value = self.strategy_values.get(strategy["name"])
+        up_threshold, down_threshold = self.strategy_thresholds.get(
+            strategy["name"], (None, None)
+        )
+
+        if direction == "up":
+            threshold = up_threshold
+        else:
+            threshold = down_threshold
+        if not per_worker or value is None or threshold is None:
+            return increment
+
+        if direction == "up":
+            # being at the threshold takes one more worker
+            num_workers = int(math.floor((value - threshold) / per_worker)) + 1
+        else:
+            # err on the side of keeping workers
+            num_workers = int(math.floor((threshold - value) / per_worker))
+        LOGGER.debug(
+            "%s: %s is %d workers' worth past %s",
+            strategy["name"],
+            value,
+            num_workers,
+            threshold,
+        )
+        return max(num_workers, increment)
+
     @property
     def cw(self):
         if not hasattr(self, "_cw"):
-            self._cw = boto3.client("cloudwatch")
+            self._cw = self.controller.clients.get("cloudwatch")
         return self._cw
 
-    def cloudwatch(self, settings):
+    def _prefetch_metrics(self):
         """
-        determines 'up' or 'down' based on the cloudwatch metric data for
-        an opsworks cluster layer
+        fetch the datapoints for all of the configured cloudwatch strategies
+        in as few GetMetricData requests as possible
         """
+        queries = set(
+            self._metric_query(x["settings"], METRIC_SAMPLE_COUNTS[x["method"]])
+            for x in self.strategies
+            if x["method"] in METRIC_SAMPLE_COUNTS
+        )
+        if not queries:
+            return {}
+        return self._get_metric_data(queries)
 
+    def _prefetched_metrics(self):
+        """
+        the datapoints fetched for all of the current execution's strategies,
+        fetching them if this is the first strategy to need them. Empty
+        outside of an execution.
+        """
+        prefetch = getattr(self._local, "prefetch", None)
+        if prefetch is None:
+            return {}
+        with prefetch.lock:
+            if prefetch.data is None:
+                prefetch.data = self._prefetch_metrics()
+        return prefetch.data
+
+    def _metric_query(self, settings, default_sample_count=None):
+
+        if default_sample_count is None:
+            default_sample_count = METRIC_SAMPLE_COUNTS["cloudwatch"]
         try:
             metric = settings["metric"]
             namespace = settings["namespace"]
-            up_threshold = settings["up_threshold"]
-            down_threshold = settings.get("down_threshold")
-            sample_count = settings.get("sample_count", 3)
+            sample_count = settings.get("sample_count", default_sample_count)
             sample_period = settings.get("sample_period", 60)
-            up_threshold_online_workers_multiplier = settings.get(
-                "up_threshold_online_workers_multiplier", 0
-            )
         except KeyError as e:
             raise AutoscaleException(
                 "Invalid settings for metric autoscaling: %s" % str(e)
             )
 
         if "layer_name" in settings:
-            layer_name = settings["layer_name"]
-            dimensions = {
-                "Name": "LayerId",
-                "Value": self.controller.get_layer_id(layer_name),
-            }
-            LOGGER.debug(
-                "Fetching recent datapoints for metric %s on layer '%s'",
-                metric,
-                layer_name,
+            dimension = (
+                "LayerId",
+                self.controller.get_layer_id(settings["layer_name"]),
             )
 
         elif "instance_name" in settings:
-            instance_name = settings["instance_name"]
-            dimensions = {
-                "Name": "InstanceId",
-                "Value": self.controller.get_ec2_id(instance_name),
-            }
-            LOGGER.debug(
-                "Fetching recent datapoints for metric %s on instance '%s'",
-                metric,
-                instance_name,
+            dimension = (
+                "InstanceId",
+                self.controller.get_ec2_id(settings["instance_name"]),
             )
 
         else:
             # assume this is a stack metric
-            stack_id = self.controller.stack["StackId"]
-            dimensions = {
-                "Name": "StackId",
-                "Value": stack_id
-            }
-            LOGGER.debug(
-                "Fetching recent datapoints for metric %s on stack '%s'",
-                metric,
-                stack_id,
-            )
+            dimension = ("StackId", self.controller.stack["StackId"])
 
         # +2 * sample_period here to add some padding to the time window
         # because there can be some amount of (unfortunate) delay in
         # metric data availability
-        start_time_seconds = (sample_count + 2) * sample_period
-        start_time = datetime.utcnow() - timedelta(seconds=start_time_seconds)
-        end_time = datetime.utcnow()
-
-        resp = self.cw.get_metric_statistics(
-            Namespace=namespace,
-            MetricName=metric,
-            Dimensions=[dimensions],
-            StartTime=start_time,
-            EndTime=end_time,
-            Period=sample_period,
-            Statistics=["Average"],
+        window = (sample_count + 2) * sample_period
+
+        return MetricQuery(namespace, metric, dimension, sample_period, window)
+
+    def _get_metric_data(self, queries):
+        """
+        returns a dict of MetricQuery -> list of (timestamp, value) tuples
+        """
+
+        queries = list(queries)
+        end_time = self.now()
+        history = self.metric_history
+
+        if history is None:
+            # one time range per request, so use the widest window asked for,
+            # then trim each series back to its own
+            start_time = end_time - timedelta(seconds=max(x.window for x in queries))
+            fetched = self._fetch_metric_data(queries, start_time, end_time)
+            for query, datapoints in fetched.items():
+                since = to_epoch(end_time - timedelta(seconds=query.window))
+                fetched[query] = [x for x in datapoints if to_epoch(x[0]) >= since]
+            return fetched
+
+        # only fetch what isn't in the history yet, in one request for the
+        # series whose window it covers and one for those it doesn't (yet),
+        # e.g. because a strategy with a longer window started using them
+        start_times = {}
+        stored, unstored = [], []
+        for query in queries:
+            start_times[query] = end_time - timedelta(seconds=query.window)
+            key = series_key(query)
+            latest = history.latest(key)
+            covered_since = history.covered_since(key)
+            if (
+                latest is None
+                or covered_since is None
+                or covered_since > start_times[query]
+            ):
+                unstored.append(query)
+                continue
+            stored.append(query)
+            refetch = timedelta(seconds=HISTORY_REFETCH_PERIODS * query.period)
+            start_times[query] = max(start_times[query], latest - refetch)
+
+        for group in [stored, unstored]:
+            if not group:
+                continue
+            start_time = min(start_times[x] for x in group)
+            LOGGER.debug(
+                "Fetching %d metrics' datapoints since %s", len(group), start_time
+            )
+            fetched = self._fetch_metric_data(group, start_time, end_time)
+            for query, datapoints in fetched.items():
+                history.add(series_key(query), datapoints, since=start_time)
+
+        return {
+            x: history.get(series_key(x), end_time - timedelta(seconds=x.window))
+            for x in queries
+        }
+
+    def _fetch_metric_data(self, queries, start_time, end_time):
+
+        series = {x: [] for x in queries}
+        paginator = self.cw.get_paginator("get_metric_data")
+
+        for offset in range(0, len(queries), METRIC_DATA_MAX_QUERIES):
+            end = offset + METRIC_DATA_MAX_QUERIES
+            chunk = queries[offset:end]
+            query_ids = {"q%d" % idx: query for idx, query in enumerate(chunk)}
+            metric_data_queries = [
+                {
+                    "Id": query_id,
+                    "MetricStat": {
+                        "Metric": {
+                            "Namespace": query.namespace,
+                            "MetricName": query.metric,
+                            "Dimensions": [
+                                {
+                                    "Name": query.dimension[0],
+                                    "Value": query.dimension[1],
+                                }
+                            ],
+                        },
+                        "Period": query.period,
+                        "Stat": "Average",
+                    },
+                    "ReturnData": True,
+                }
+                for query_id, query in query_ids.items()
+            ]
+            for query in chunk:
+                LOGGER.debug(
+                    "Fetching recent datapoints for metric %s on %s '%s'",
+                    query.metric,
+                    query.dimension[0],
+                    query.dimension[1],
+                )
+
+            pages = paginator.paginate(
+                MetricDataQueries=metric_data_queries,
+                StartTime=start_time,
+                EndTime=end_time,
+            )
+            for page in pages:
+                for result in page["MetricDataResults"]:
+                    series[query_ids[result["Id"]]].extend(
+                        zip(result["Timestamps"], result["Values"])
+                    )
+
+        return series
+
+    def cloudwatch(self, settings):
+        """
+        determines 'up' or 'down' based on the cloudwatch metric data for
+        an opsworks cluster layer
+        """
+
+        try:
+            up_threshold = settings["up_threshold"]
+            down_threshold = settings.get("down_threshold")
+            statistic = settings.get("statistic", "all")
+        except KeyError as e:
+            raise AutoscaleException(
+                "Invalid settings for metric autoscaling: %s" % str(e)
+            )
+
+        datapoints = self._recent_datapoints(
+            settings, METRIC_SAMPLE_COUNTS["cloudwatch"]
         )
+        if datapoints is None:
+            return
 
-        datapoints = sorted(
-            resp["Datapoints"], key=itemgetter("Timestamp"), reverse=True
+        try:
+            values, fraction = evaluators.evaluate(statistic, datapoints, settings)
+        except ValueError as e:
+            raise AutoscaleException(
+                "Invalid settings for metric autoscaling: %s" % str(e)
+            )
+        LOGGER.debug("%s of %s datapoints: %s", statistic, len(datapoints), values)
+
+        up_threshold = self._adjust_up_threshold(settings, up_threshold)
+        self._report_value(values[0], up_threshold, down_threshold)
+
+        return self._up_or_down(values, up_threshold, down_threshold, fraction)
+
+    def forecast(self, settings):
+        """
+        'up' if the cloudwatch metric is projected to reach the up threshold
+        within `horizon` seconds, based on a linear trend fitted to a longer
+        window of datapoints; 'down' if it's below, and projected to stay
+        below, the down threshold
+        """
+
+        try:
+            metric = settings["metric"]
+            up_threshold = settings["up_threshold"]
+            down_threshold = settings.get("down_threshold")
+            sample_period = settings.get("sample_period", 60)
+            horizon = settings.get("horizon", FORECAST_HORIZON)
+            model = settings.get("model", "holt")
+            alpha = settings.get("alpha", forecast.ALPHA)
+            beta = settings.get("beta", forecast.BETA)
+        except KeyError as e:
+            raise AutoscaleException(
+                "Invalid settings for forecast autoscaling: %s" % str(e)
+            )
+
+        datapoints = self._recent_datapoints(settings, METRIC_SAMPLE_COUNTS["forecast"])
+        if datapoints is None:
+            return
+
+        if model == "holt":
+            level, trend = forecast.holt(datapoints[::-1], alpha, beta)
+        elif model == "ewma":
+            # smoothing only, no trend
+            level, trend = forecast.ewma(datapoints[::-1], alpha), 0.0
+        else:
+            raise AutoscaleException("Unknown forecast model: '%s'" % model)
+        projected = forecast.project(level, trend, horizon / float(sample_period))
+        LOGGER.info(
+            "%s: smoothed %.2f, trend %+.2f per %ds, projected %.2f in %ds",
+            metric,
+            level,
+            trend,
+            sample_period,
+            projected,
+            horizon,
         )
+        up_threshold = self._adjust_up_threshold(settings, up_threshold)
+        self._report_value(projected, up_threshold, down_threshold)
+
+        # the trend is linear, so the projection's highest point over the
+        # horizon is at one end or the other
+        peak = max(level, projected)
+        if peak >= up_threshold:
+            LOGGER.debug("scale up threshold met within %ds", horizon)
+            return "up"
+        elif down_threshold is not None and peak < down_threshold:
+            LOGGER.debug("scale down threshold met for the next %ds", horizon)
+            return "down"
+
+    def _recent_datapoints(self, settings, default_sample_count):
+        """
+        values of the most recent `sample_count` datapoints of the strategy's
+        metric, newest first, or None if there aren't enough of them
+        """
+
+        metric = settings["metric"]
+        sample_count = settings.get("sample_count", default_sample_count)
+
+        query = self._metric_query(settings, default_sample_count)
+        metric_data = self._prefetched_metrics()
+        if query not in metric_data:
+            metric_data = self._get_metric_data([query])
+
+        datapoints = sorted(metric_data[query], key=itemgetter(0), reverse=True)
 
         if not datapoints:
             LOGGER.error("No datapoints received for metric %s!", metric)
@@ -206,9 +660,7 @@ class Autoscaler(object):
 
         LOGGER.debug(
             "Most recent datapoint is %d seconds old",
-            (
-                datetime.utcnow() - datapoints[0]["Timestamp"].replace(tzinfo=None)
-            ).seconds,
+            (self.now() - datapoints[0][0].replace(tzinfo=None)).seconds,
         )
 
         if len(datapoints) < sample_count:
@@ -219,9 +671,15 @@ class Autoscaler(object):
             )
             return
 
-        datapoints = [x["Average"] for x in datapoints[:sample_count]]
+        datapoints = [x[1] for x in datapoints[:sample_count]]
         LOGGER.debug("Datapoints for %s: %s", metric, datapoints)
+        return datapoints
 
+    def _adjust_up_threshold(self, settings, up_threshold):
+
+        up_threshold_online_workers_multiplier = settings.get(
+            "up_threshold_online_workers_multiplier", 0
+        )
         up_threshold += (
             len(self.controller.online_workers) * up_threshold_online_workers_multiplier
         )
@@ -230,8 +688,7 @@ class Autoscaler(object):
             up_threshold_online_workers_multiplier,
             up_threshold,
         )
-
-        return self._up_or_down(datapoints, up_threshold, down_threshold)
+        return up_threshold
 
     def queued_jobs(self, settings):
         """
@@ -259,15 +716,28 @@ class Autoscaler(object):
         )
 
         LOGGER.info("MH reports %d queued jobs", queued_jobs)
+        self._report_value(queued_jobs, up_threshold, down_threshold)
 
         return self._up_or_down([queued_jobs], up_threshold, down_threshold)
 
-    def _up_or_down(self, datapoints, up_threshold, down_threshold):
+    def _up_or_down(self, datapoints, up_threshold, down_threshold, fraction=1.0):
+        """
+        'up' if at least `fraction` of the datapoints equal or exceed the up
+        threshold; 'down' if at least `fraction` of them are below the down
+        threshold
+        """
+
+        if not datapoints:
+            return
 
-        if datapoints and all(x >= up_threshold for x in datapoints):
+        if evaluators.fraction_past(datapoints, up_threshold) >= fraction:
             LOGGER.debug("scale up threshold met")
             return "up"
 
-        elif datapoints and all(x < down_threshold for x in datapoints):
+        elif (
+            down_threshold is not None
+            and evaluators.fraction_past(datapoints, down_threshold, above=False)
+            >= fraction
+        ):
             LOGGER.debug("scale down threshold met")
             return "down"
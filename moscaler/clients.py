@@ -0,0 +1,30 @@
+import boto3
+import logging
+import threading
+from moscaler.instrumentation import instrument_client
+
+LOGGER = logging.getLogger(__name__)
+
+
+class AwsClients(object):
+    """
+    Instrumented boto3 clients, created on first use and then shared by
+    everything given this object, e.g. the controllers of several clusters.
+    Clients are thread-safe once created but creating them isn't.
+    """
+
+    def __init__(self, session=None):
+        self.session = session
+        self._clients = {}
+        self._lock = threading.Lock()
+
+    def get(self, service):
+        with self._lock:
+            if service not in self._clients:
+                LOGGER.debug("Creating %s client", service)
+                if self.session is None:
+                    client = boto3.client(service)
+                else:
+                    client = self.session.client(service)
+                self._clients[service] = instrument_client(client)
+            return self._clients[service]
@@ -0,0 +1,130 @@
+import logging
+import contextvars
+from os import getenv as env
+from collections import OrderedDict
+from contextlib import contextmanager
+from moscaler.concurrency import map_concurrently
+from moscaler.instrumentation import SCOPE
+from moscaler.exceptions import OpsworksControllerException
+
+LOGGER = logging.getLogger(__name__)
+
+# max number of clusters to work on at the same time
+CLUSTER_CONCURRENCY = 8
+
+# the cluster being worked on in the current context, if any
+CURRENT_CLUSTER = contextvars.ContextVar("moscaler_cluster", default=None)
+
+
+def read_cluster_file(path):
+    """
+    cluster names from a file listing one per line. Blank lines and
+    everything after a `#` are ignored.
+    """
+    with open(path, "r") as f:
+        lines = [x.split("#", 1)[0].strip() for x in f]
+    return [x for x in lines if x]
+
+
+@contextmanager
+def cluster_context(name):
+    """
+    attribute the logging & remote calls of the block to cluster `name`
+    """
+    cluster_token = CURRENT_CLUSTER.set(name)
+    scope_token = SCOPE.set(name)
+    try:
+        yield
+    finally:
+        SCOPE.reset(scope_token)
+        CURRENT_CLUSTER.reset(cluster_token)
+
+
+class ClusterLogFilter(logging.Filter):
+    """
+    Adds the name of the cluster being worked on to log records as
+    `cluster`, or `default` if the record isn't about any one cluster
+    """
+
+    def __init__(self, default=""):
+        super(ClusterLogFilter, self).__init__()
+        self.default = default
+
+    def filter(self, record):
+        record.cluster = CURRENT_CLUSTER.get() or self.default
+        return True
+
+
+class ClusterSet(object):
+    """
+    Controllers for one or more clusters, built by `factory` (called with
+    each cluster's name) and worked on concurrently. Failures are logged &
+    tracked per cluster so that one cluster's problems don't get in the way
+    of the others.
+    """
+
+    def __init__(self, names, factory, concurrency=None):
+        # in the order given, minus any duplicates
+        self.names = list(OrderedDict.fromkeys(names))
+
+        if concurrency is None:
+            concurrency = int(env("MOSCALER_CLUSTER_CONCURRENCY", CLUSTER_CONCURRENCY))
+        self.concurrency = concurrency
+
+        self.exit_codes = OrderedDict((x, 0) for x in self.names)
+        self.controllers = self._map(factory, self.names)
+
+    def __repr__(self):
+        return "%s (%s)" % (self.__class__, ", ".join(self.names))
+
+    def __len__(self):
+        return len(self.names)
+
+    def _map(self, func, names):
+        def call(name):
+            with cluster_context(name):
+                try:
+                    return func(name)
+                except OpsworksControllerException as exc:
+                    LOGGER.info(str(exc))
+                    raise
+                except Exception:
+                    LOGGER.exception("Failed working on cluster %s", name)
+                    raise
+
+        results = OrderedDict()
+        for name, result, exc in map_concurrently(call, names, self.concurrency):
+            self.exit_codes[name] = 0 if exc is None else 1
+            if exc is None:
+                results[name] = result
+        return results
+
+    def run(self, func, *args, **kwargs):
+        """
+        call `func` with each cluster's controller (and `args`/`kwargs`).
+        Returns the results of the calls that succeeded, by cluster name.
+        Clusters whose controller couldn't be built are skipped.
+        """
+        return self._map(
+            lambda name: func(self.controllers[name], *args, **kwargs),
+            list(self.controllers),
+        )
+
+    @property
+    def exit_code(self):
+        """
+        non-zero if the last operation failed for any of the clusters
+        """
+        return max(self.exit_codes.values() or [0])
+
+    def log_results(self):
+        if len(self.names) < 2:
+            return
+        LOGGER.info(
+            "Cluster results: %s",
+            ", ".join(
+                "%s %s" % (name, "failed" if code else "ok")
+                for name, code in self.exit_codes.items()
+            ),
+            extra={"exit_codes": dict(self.exit_codes)},
+        )
@@ -0,0 +1,84 @@
+import logging
+import threading
+import contextvars
+from concurrent.futures import Future, ThreadPoolExecutor
+
+LOGGER = logging.getLogger(__name__)
+
+
+def map_concurrently(func, items, max_workers):
+    """
+    call `func` on each of `items` using at most `max_workers` threads.
+    Returns a list of (item, result, exception) tuples in the order of
+    `items`. Exceptions are collected rather than raised so that one
+    failing call doesn't prevent the others from completing. Each call runs
+    in a copy of the caller's context variables, e.g. which cluster is being
+    worked on.
+    """
+    items = list(items)
+
+    def call(item):
+        try:
+            return item, func(item), None
+        except Exception as exc:
+            return item, None, exc
+
+    if max_workers <= 1 or len(items) <= 1:
+        return [call(x) for x in items]
+
+    LOGGER.debug("Running %d calls with %d threads", len(items), max_workers)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(items))) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, call, x) for x in items
+        ]
+        return [x.result() for x in futures]
+
+
+def call_concurrently(funcs, max_workers):
+    """
+    call each of the no-argument `funcs` using at most `max_workers` threads.
+    The first one is always called in the current thread, so it's the one
+    to put anything relying on signals (e.g. stopit's SignalTimeout) in.
+    Returns a list of (result, exception) tuples in the order of `funcs`.
+    """
+    funcs = list(funcs)
+
+    def call(func):
+        try:
+            return func(), None
+        except Exception as exc:
+            return None, exc
+
+    if max_workers <= 1 or len(funcs) <= 1:
+        return [call(x) for x in funcs]
+
+    LOGGER.debug("Running %d calls with %d threads", len(funcs), max_workers)
+    with ThreadPoolExecutor(max_workers=min(max_workers, len(funcs)) - 1) as executor:
+        futures = [
+            executor.submit(contextvars.copy_context().run, call, x) for x in funcs[1:]
+        ]
+        first = call(funcs[0])
+        return [first] + [x.result() for x in futures]
+
+
+def submit_daemon(func, *args):
+    """
+    call `func` with `args` in a new daemon thread. Returns a Future for
+    the result. Unlike a ThreadPoolExecutor's threads, which are joined at
+    interpreter exit, a call that hangs won't keep the process from exiting
+    once it's given up on. The call runs in a copy of the caller's context
+    variables.
+    """
+    future = Future()
+
+    def run():
+        if not future.set_running_or_notify_cancel():
+            return
+        try:
+            future.set_result(func(*args))
+        except BaseException as exc:
+            future.set_exception(exc)
+
+    context = contextvars.copy_context()
+    threading.Thread(target=context.run, args=(run,), daemon=True).start()
+    return future
@@ -0,0 +1,108 @@
+import math
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+# percentile used by the "percentile" statistic if not specified
+PERCENTILE = 90
+# datapoints per mean for the "rolling_mean" statistic if not specified
+ROLLING_WINDOW = 3
+# share of the values that have to be past a threshold for the
+# "fraction_above" statistic if not specified
+FRACTION = 0.5
+
+
+def _mean(values):
+    if numpy is not None:
+        return float(numpy.mean(values))
+    return sum(values) / float(len(values))
+
+
+def _percentile(values, pct):
+    """
+    percentile with linear interpolation between the closest ranks, as
+    numpy does by default
+    """
+    if numpy is not None:
+        return float(numpy.percentile(values, pct))
+    ordered = sorted(values)
+    rank = (len(ordered) - 1) * pct / 100.0
+    low, high = int(math.floor(rank)), int(math.ceil(rank))
+    return ordered[low] + (ordered[high] - ordered[low]) * (rank - low)
+
+
+def _rolling_mean(values, window):
+    window = max(1, min(window, len(values)))
+    if numpy is not None:
+        kernel = numpy.ones(window) / window
+        return numpy.convolve(values, kernel, mode="valid").tolist()
+    sums = [0.0]
+    for x in values:
+        sums.append(sums[-1] + x)
+    return [
+        (sums[idx + window] - sums[idx]) / window
+        for idx in range(len(values) - window + 1)
+    ]
+
+
+def _slope(values):
+    """
+    least squares slope of `values`, oldest first, per datapoint
+    """
+    if len(values) < 2:
+        return 0.0
+    if numpy is not None:
+        return float(numpy.polyfit(numpy.arange(len(values)), values, 1)[0])
+    x_mean = (len(values) - 1) / 2.0
+    y_mean = _mean(values)
+    numerator = sum((x - x_mean) * (y - y_mean) for x, y in enumerate(values))
+    denominator = sum((x - x_mean) ** 2 for x in range(len(values)))
+    return numerator / denominator
+
+
+def fraction_past(values, threshold, above=True):
+    """
+    the share of `values` at/above (or below) `threshold`
+    """
+    if numpy is not None:
+        array = numpy.asarray(values, dtype=float)
+        past = array >= threshold if above else array < threshold
+        return float(numpy.count_nonzero(past)) / len(array)
+    if above:
+        past = [x for x in values if x >= threshold]
+    else:
+        past = [x for x in values if x < threshold]
+    return len(past) / float(len(values))
+
+
+def evaluate(statistic, values, settings):
+    """
+    reduce the datapoint `values`, newest first, to the values the
+    thresholds are checked against, also newest first. Returns these along
+    with the share of them that have to be past a threshold.
+    """
+    if not values:
+        raise ValueError("Nothing to evaluate")
+
+    if statistic == "all":
+        return list(values), 1.0
+    elif statistic == "fraction_above":
+        return list(values), settings.get("fraction", FRACTION)
+    elif statistic == "mean":
+        return [_mean(values)], 1.0
+    elif statistic == "max":
+        return [max(values)], 1.0
+    elif statistic == "min":
+        return [min(values)], 1.0
+    elif statistic == "percentile":
+        return [_percentile(values, settings.get("percentile", PERCENTILE))], 1.0
+    elif statistic == "rolling_mean":
+        # smooths over the odd dip/spike, but every mean has to be past
+        means = _rolling_mean(values, settings.get("window", ROLLING_WINDOW))
+        return means, 1.0
+    elif statistic == "slope":
+        # rising is positive
+        return [_slope(list(values)[::-1])], 1.0
+    raise ValueError("Unknown statistic: '%s'" % statistic)
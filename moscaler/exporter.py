@@ -0,0 +1,226 @@
+import os
+import re
+import time
+import socket
+import logging
+import threading
+from collections import OrderedDict, namedtuple
+
+LOGGER = logging.getLogger(__name__)
+
+STATSD_PREFIX = "moscaler"
+# keep packets under the common safe udp payload size
+STATSD_MAX_PACKET = 512
+
+Sample = namedtuple("Sample", ["name", "labels", "value"])
+
+# name -> (type, help)
+METRICS = OrderedDict(
+    [
+        (
+            "moscaler_cycle_duration_seconds",
+            ("gauge", "Time taken by the last scaling command/cycle"),
+        ),
+        (
+            "moscaler_last_cycle_timestamp_seconds",
+            ("gauge", "Unix time at which the last cycle finished"),
+        ),
+        ("moscaler_workers", ("gauge", "Number of workers by state")),
+        ("moscaler_queued_jobs", ("gauge", "Number of jobs queued in Matterhorn")),
+        ("moscaler_actions", ("gauge", "Number of instances started/stopped")),
+        (
+            "moscaler_mh_snapshot_lookups",
+            ("gauge", "Matterhorn hosts/statistics lookups by snapshot hit/miss"),
+        ),
+        (
+            "moscaler_strategy_decision",
+            ("gauge", "Autoscale strategy decision: 1 up, -1 down, 0 no action"),
+        ),
+        (
+            "moscaler_strategy_value",
+            ("gauge", "Value an autoscale strategy based its decision on"),
+        ),
+        (
+            "moscaler_strategy_duration_seconds",
+            ("gauge", "Time an autoscale strategy took to decide"),
+        ),
+        ("moscaler_remote_calls", ("gauge", "Number of remote api calls made")),
+        (
+            "moscaler_remote_call_seconds",
+            ("gauge", "Total time spent in remote api calls"),
+        ),
+    ]
+)
+
+DECISIONS = {"up": 1, "down": -1, None: 0}
+
+
+def cycle_samples(controller, status, actions, elapsed, remote_calls=None):
+    """
+    the metrics of a scaling command/cycle as a list of Samples
+    """
+    cluster = status["cluster"]
+
+    def sample(name, value, **labels):
+        return Sample(
+            name, OrderedDict([("cluster", cluster)] + list(labels.items())), value
+        )
+
+    samples = [
+        sample("moscaler_cycle_duration_seconds", elapsed),
+        sample("moscaler_last_cycle_timestamp_seconds", time.time()),
+        sample("moscaler_workers", status["workers_online"], state="online"),
+        sample("moscaler_workers", status["workers_pending"], state="pending"),
+        sample("moscaler_workers", len(controller.stopped_workers), state="stopped"),
+        sample("moscaler_actions", actions["total_started"], action="started"),
+        sample("moscaler_actions", actions["total_stopped"], action="stopped"),
+    ]
+
+    # only there if matterhorn was consulted
+    if "job_status" in status:
+        samples.append(
+            sample("moscaler_queued_jobs", status["job_status"]["queued_jobs"])
+        )
+    if "mh_snapshot" in actions:
+        for result, key in [("hit", "hits"), ("miss", "misses")]:
+            samples.append(
+                sample(
+                    "moscaler_mh_snapshot_lookups",
+                    actions["mh_snapshot"][key],
+                    result=result,
+                )
+            )
+
+    autoscaler = controller.autoscaler
+    if autoscaler is not None:
+        for name, direction in autoscaler.strategy_results.items():
+            samples.append(
+                sample(
+                    "moscaler_strategy_decision", DECISIONS[direction], strategy=name
+                )
+            )
+            value = autoscaler.strategy_values.get(name)
+            if value is not None:
+                samples.append(sample("moscaler_strategy_value", value, strategy=name))
+            samples.append(
+                sample(
+                    "moscaler_strategy_duration_seconds",
+                    autoscaler.strategy_times[name],
+                    strategy=name,
+                )
+            )
+
+    if remote_calls is not None:
+        samples.append(sample("moscaler_remote_calls", remote_calls["calls"]))
+        samples.append(sample("moscaler_remote_call_seconds", remote_calls["seconds"]))
+
+    return samples
+
+
+def _escape_label(value):
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+class PrometheusTextfileExporter(object):
+    """
+    Writes the samples to a file in the Prometheus text format, e.g. for the
+    node_exporter textfile collector. The file is replaced atomically so a
+    scrape never sees a partial write. It covers the latest samples of every
+    cluster exported so far.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._samples = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __repr__(self):
+        return "%s (%s)" % (self.__class__, self.path)
+
+    def format(self, samples):
+        lines = []
+        for name, (metric_type, help) in METRICS.items():
+            metric_samples = [x for x in samples if x.name == name]
+            if not metric_samples:
+                continue
+            lines.append("# HELP %s %s" % (name, help))
+            lines.append("# TYPE %s %s" % (name, metric_type))
+            for x in metric_samples:
+                labels = ",".join(
+                    '%s="%s"' % (k, _escape_label(v)) for k, v in x.labels.items()
+                )
+                lines.append("%s{%s} %s" % (name, labels, repr(float(x.value))))
+        return "\n".join(lines) + "\n"
+
+    def export(self, samples):
+        by_cluster = OrderedDict()
+        for x in samples:
+            by_cluster.setdefault(x.labels.get("cluster"), []).append(x)
+        with self._lock:
+            self._samples.update(by_cluster)
+            samples = [x for group in self._samples.values() for x in group]
+            tmp_path = "%s.%d" % (self.path, os.getpid())
+            with open(tmp_path, "w") as f:
+                f.write(self.format(samples))
+            os.replace(tmp_path, self.path)
+
+
+class StatsdExporter(object):
+    """
+    Sends the samples as StatsD gauges/timers over udp, e.g. the worker counts
+    as `moscaler.<cluster>.workers.online:3|g`
+    """
+
+    def __init__(self, address, prefix=STATSD_PREFIX):
+        host, _, port = address.rpartition(":")
+        self.address = (host or "127.0.0.1", int(port))
+        self.prefix = prefix
+
+    def __repr__(self):
+        return "%s (%s:%d)" % (self.__class__, self.address[0], self.address[1])
+
+    def _name(self, sample):
+        parts = [self.prefix] + list(sample.labels.values())[:1]
+        # less the "moscaler_" prefix
+        parts.append(sample.name.split("_", 1)[1])
+        parts.extend(list(sample.labels.values())[1:])
+        return ".".join(re.sub(r"[^\w\-]", "_", str(x)) for x in parts)
+
+    def format(self, samples):
+        lines = []
+        for x in samples:
+            if x.name.endswith("_seconds") and "timestamp" not in x.name:
+                lines.append("%s:%d|ms" % (self._name(x), x.value * 1000))
+            else:
+                lines.append("%s:%s|g" % (self._name(x), x.value))
+        return lines
+
+    def packets(self, samples):
+        packet = []
+        for line in self.format(samples):
+            if packet and len("\n".join(packet + [line])) > STATSD_MAX_PACKET:
+                yield "\n".join(packet)
+                packet = []
+            packet.append(line)
+        if packet:
+            yield "\n".join(packet)
+
+    def export(self, samples):
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        try:
+            for packet in self.packets(samples):
+                sock.sendto(packet.encode("utf-8"), self.address)
+        finally:
+            sock.close()
+
+
+def export(exporters, samples):
+    """
+    hand the samples to each exporter; failures are logged, not raised, so
+    that monitoring problems don't get in the way of scaling
+    """
+    for exporter in exporters:
+        try:
+            exporter.export(samples)
+        except (IOError, OSError) as exc:
+            LOGGER.warning("Failed exporting metrics via %r: %s", exporter, str(exc))
@@ -0,0 +1,42 @@
+# default smoothing factors; higher values weight recent datapoints more
+ALPHA = 0.5
+BETA = 0.3
+
+
+def ewma(values, alpha=ALPHA):
+    """
+    exponentially weighted moving average of `values`, oldest first
+    """
+    if not values:
+        raise ValueError("Can't smooth an empty series")
+    average = values[0]
+    for x in values[1:]:
+        average = alpha * x + (1 - alpha) * average
+    return average
+
+
+def holt(values, alpha=ALPHA, beta=BETA):
+    """
+    fit Holt's linear trend (double exponential smoothing) model to
+    `values`, oldest first. Returns the final (level, trend), the trend
+    being the change per step.
+    """
+    if not values:
+        raise ValueError("Can't fit an empty series")
+    if len(values) == 1:
+        return values[0], 0.0
+
+    level = values[0]
+    trend = values[1] - values[0]
+    for x in values[1:]:
+        previous = level
+        level = alpha * x + (1 - alpha) * (level + trend)
+        trend = beta * (level - previous) + (1 - beta) * trend
+    return level, trend
+
+
+def project(level, trend, steps):
+    """
+    the value the fitted model expects `steps` steps ahead
+    """
+    return level + trend * steps
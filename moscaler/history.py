@@ -0,0 +1,159 @@
+import sqlite3
+import logging
+import calendar
+from datetime import datetime
+from os import getenv as env
+
+LOGGER = logging.getLogger(__name__)
+
+# seconds of datapoints to keep
+HISTORY_RETENTION = 86400
+# seconds to wait for another process/thread's write to finish
+SQLITE_TIMEOUT = 10
+
+
+def to_epoch(ts):
+    """
+    seconds since the epoch of a utc datetime, naive or not
+    """
+    return calendar.timegm(ts.utctimetuple()) + ts.microsecond / 1e6
+
+
+def series_key(query):
+    """
+    e.g. "AWS/OpsWorks/load_1/LayerId=1234-abcd/60" for a MetricQuery
+    """
+    return "%s/%s/%s=%s/%d" % (
+        query.namespace,
+        query.metric,
+        query.dimension[0],
+        query.dimension[1],
+        query.period,
+    )
+
+
+class MetricHistory(object):
+    """
+    On-disk (sqlite) store of metric datapoints, by series, so that each
+    cycle only needs to fetch the datapoints that are new since the last one.
+    Datapoints more than `retention` seconds older than the newest ones
+    added to their series are dropped. It also keeps track of how far back
+    each series has been fetched, as a series may not have datapoints for
+    every period.
+    """
+
+    def __init__(self, path, retention=None):
+        self.path = path
+
+        if retention is None:
+            retention = int(env("MOSCALER_METRIC_HISTORY_RETENTION", HISTORY_RETENTION))
+        self.retention = retention
+
+        with self._connect() as conn:
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS datapoints ("
+                "series TEXT NOT NULL, "
+                "timestamp REAL NOT NULL, "
+                "value REAL NOT NULL, "
+                "PRIMARY KEY (series, timestamp))"
+            )
+            conn.execute(
+                "CREATE TABLE IF NOT EXISTS coverage ("
+                "series TEXT PRIMARY KEY, "
+                "start REAL NOT NULL)"
+            )
+
+    def __repr__(self):
+        return "%s (%s)" % (self.__class__, self.path)
+
+    def _connect(self):
+        # a connection per operation keeps this safe to use from any thread
+        return _Connection(sqlite3.connect(self.path, timeout=SQLITE_TIMEOUT))
+
+    def latest(self, series):
+        """
+        the (naive, utc) time of the series' most recent datapoint, if any
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT MAX(timestamp) FROM datapoints WHERE series = ?", (series,)
+            ).fetchone()
+        if row[0] is None:
+            return None
+        return datetime.utcfromtimestamp(row[0])
+
+    def covered_since(self, series):
+        """
+        the (naive, utc) time from which on all of the series' datapoints
+        have been fetched, if any have
+        """
+        with self._connect() as conn:
+            row = conn.execute(
+                "SELECT start FROM coverage WHERE series = ?", (series,)
+            ).fetchone()
+        if row is None:
+            return None
+        return datetime.utcfromtimestamp(row[0])
+
+    def add(self, series, datapoints, since=None):
+        """
+        store (timestamp, value) datapoints, replacing any already stored
+        for the same times. `since` is the start of the time range they were
+        fetched for, if that was all of the series' datapoints in it.
+        """
+        rows = [(series, to_epoch(ts), value) for ts, value in datapoints]
+        with self._connect() as conn:
+            if since is not None:
+                conn.execute(
+                    "INSERT INTO coverage VALUES (?, ?) ON CONFLICT(series) "
+                    "DO UPDATE SET start = MIN(start, excluded.start)",
+                    (series, to_epoch(since)),
+                )
+            if not rows:
+                return
+            cutoff = max(x[1] for x in rows) - self.retention
+            conn.executemany("INSERT OR REPLACE INTO datapoints VALUES (?, ?, ?)", rows)
+            # other series' retention is relative to their own datapoints
+            conn.execute(
+                "DELETE FROM datapoints WHERE series = ? AND timestamp < ?",
+                (series, cutoff),
+            )
+            conn.execute(
+                "UPDATE coverage SET start = MAX(start, ?) WHERE series = ?",
+                (cutoff, series),
+            )
+
+    def get(self, series, start_time):
+        """
+        the series' (timestamp, value) datapoints from `start_time` on,
+        oldest first
+        """
+        with self._connect() as conn:
+            rows = conn.execute(
+                "SELECT timestamp, value FROM datapoints "
+                "WHERE series = ? AND timestamp >= ? ORDER BY timestamp",
+                (series, to_epoch(start_time)),
+            ).fetchall()
+        return [(datetime.utcfromtimestamp(ts), value) for ts, value in rows]
+
+
+class _Connection(object):
+    """
+    commits (or rolls back) and closes the connection on exit, which
+    sqlite3's own context manager doesn't do
+    """
+
+    def __init__(self, conn):
+        self.conn = conn
+
+    def __enter__(self):
+        return self.conn
+
+    def __exit__(self, exc_type, exc, tb):
+        try:
+            if exc_type is None:
+                self.conn.commit()
+            else:
+                self.conn.rollback()
+        finally:
+            self.conn.close()
@@ -0,0 +1,201 @@
+import math
+import time
+import logging
+import threading
+import contextvars
+from urllib.parse import urlparse
+
+LOGGER = logging.getLogger(__name__)
+
+# what the calls made in the current context should be attributed to, e.g.
+# the name of the cluster being worked on
+SCOPE = contextvars.ContextVar("moscaler_stats_scope", default=None)
+
+THROTTLING_ERROR_CODES = [
+    "Throttling",
+    "ThrottlingException",
+    "RequestLimitExceeded",
+    "TooManyRequestsException",
+]
+
+
+def percentile(values, pct):
+    """
+    nearest-rank percentile of a non-empty list of numbers
+    """
+    ordered = sorted(values)
+    rank = int(math.ceil(pct / 100.0 * len(ordered)))
+    return ordered[min(max(rank, 1), len(ordered)) - 1]
+
+
+class CallStats(object):
+    """
+    Counts & latencies of the remote calls made, grouped by operation, e.g.
+    "opsworks.DescribeInstances" or "matterhorn.GET /services/hosts.json",
+    and by the SCOPE they were made in
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.reset()
+
+    def reset(self):
+        with self._lock:
+            self._latencies = {}
+            self._retries = {}
+            self._throttles = {}
+            self._errors = {}
+
+    def record(self, operation, elapsed, retries=0, throttled=False, error=False):
+        key = (SCOPE.get(), operation)
+        with self._lock:
+            self._latencies.setdefault(key, []).append(elapsed)
+            self._retries[key] = self._retries.get(key, 0) + retries
+            self._throttles[key] = self._throttles.get(key, 0) + int(throttled)
+            self._errors[key] = self._errors.get(key, 0) + int(error)
+
+    def report(self, scope=None):
+        """
+        totals & per operation stats of the calls made in `scope`, or in any
+        scope if not given
+        """
+        latencies = {}
+        retries = {}
+        throttles = {}
+        errors = {}
+        with self._lock:
+            for key, values in self._latencies.items():
+                if scope is not None and key[0] != scope:
+                    continue
+                name = key[1]
+                latencies.setdefault(name, []).extend(values)
+                retries[name] = retries.get(name, 0) + self._retries[key]
+                throttles[name] = throttles.get(name, 0) + self._throttles[key]
+                errors[name] = errors.get(name, 0) + self._errors[key]
+
+        operations = {
+            name: {
+                "calls": len(values),
+                "seconds": sum(values),
+                "p50": percentile(values, 50),
+                "p95": percentile(values, 95),
+                "max": max(values),
+                "retries": retries[name],
+                "throttles": throttles[name],
+                "errors": errors[name],
+            }
+            for name, values in latencies.items()
+        }
+        return {
+            "calls": sum(x["calls"] for x in operations.values()),
+            "seconds": sum(x["seconds"] for x in operations.values()),
+            "retries": sum(x["retries"] for x in operations.values()),
+            "throttles": sum(x["throttles"] for x in operations.values()),
+            "operations": operations,
+        }
+
+    def summary(self, report=None):
+        if report is None:
+            report = self.report()
+        # slowest dependencies first
+        operations = sorted(
+            report["operations"].items(), key=lambda x: x[1]["seconds"], reverse=True
+        )
+        return "%d calls, %.2fs total, %d retries, %d throttles; %s" % (
+            report["calls"],
+            report["seconds"],
+            report["retries"],
+            report["throttles"],
+            ", ".join(
+                "%s x%d %.2fs (p50 %.2fs, p95 %.2fs)"
+                % (name, x["calls"], x["seconds"], x["p50"], x["p95"])
+                for name, x in operations
+            ),
+        )
+
+
+# shared by everything in the process
+STATS = CallStats()
+
+
+def _operation_name(event_name):
+    # e.g. "before-call.opsworks.DescribeInstances"
+    return ".".join(event_name.split(".")[1:])
+
+
+def _before_call(event_name=None, context=None, **kwargs):
+    if context is not None:
+        context["moscaler_call_start"] = time.time()
+
+
+def _after_call(event_name=None, parsed=None, context=None, **kwargs):
+    start = (context or {}).get("moscaler_call_start")
+    if start is None:
+        return
+    parsed = parsed or {}
+    code = parsed.get("Error", {}).get("Code")
+    STATS.record(
+        _operation_name(event_name),
+        time.time() - start,
+        retries=parsed.get("ResponseMetadata", {}).get("RetryAttempts", 0),
+        throttled=code in THROTTLING_ERROR_CODES,
+        error=code is not None,
+    )
+
+
+def _after_call_error(event_name=None, context=None, **kwargs):
+    start = (context or {}).get("moscaler_call_start")
+    if start is None:
+        return
+    STATS.record(_operation_name(event_name), time.time() - start, error=True)
+
+
+def instrument_client(client):
+    """
+    count & time every api call the boto3 client makes
+    """
+    events = client.meta.events
+    # the unique ids make instrumenting the same client again a no-op
+    events.register("before-call.*.*", _before_call, unique_id="moscaler-before")
+    events.register("after-call.*.*", _after_call, unique_id="moscaler-after")
+    events.register(
+        "after-call-error.*.*", _after_call_error, unique_id="moscaler-after-error"
+    )
+    return client
+
+
+def _retries(resp):
+    retries = getattr(getattr(resp.raw, "retries", None), "history", None)
+    return len(retries or ())
+
+
+def instrument_session(session, prefix="matterhorn"):
+    """
+    count & time every request the requests session makes. The whole call
+    is timed as a response's `elapsed` leaves out any requests made on the
+    way to it, e.g. the one answered by a digest auth challenge.
+    """
+    if getattr(session, "moscaler_prefix", None) == prefix:
+        return session
+    request = session.request
+
+    def timed_request(method, url, *args, **kwargs):
+        operation = "%s.%s %s" % (prefix, method.upper(), urlparse(url).path)
+        start = time.monotonic()
+        try:
+            resp = request(method, url, *args, **kwargs)
+        except Exception:
+            STATS.record(operation, time.monotonic() - start, error=True)
+            raise
+        STATS.record(
+            operation,
+            time.monotonic() - start,
+            retries=sum(_retries(x) for x in list(resp.history) + [resp]),
+            throttled=resp.status_code == 429,
+            error=resp.status_code >= 400,
+        )
+        return resp
+
+    session.request = timed_request
+    session.moscaler_prefix = prefix
+    return session
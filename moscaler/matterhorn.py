@@ -1,20 +1,44 @@
 import pyhorn
 
+import re
+import time
 import logging
 import requests
-from stopit import SignalTimeout, TimeoutException as StopitTimeout
-from requests.exceptions import Timeout as RequestsTimeout, ConnectionError
+import threading
+from pyhorn.utils import default_headers
+from requests.adapters import HTTPAdapter
+from requests.auth import HTTPDigestAuth
+from stopit import (
+    SignalTimeout,
+    ThreadingTimeout,
+    TimeoutException as StopitTimeout,
+)
+from requests.exceptions import (
+    Timeout as RequestsTimeout,
+    ConnectionError,
+    RequestException,
+)
+from urllib3.util.retry import Retry
 
 from contextlib import contextmanager
 from os import getenv as env
+from moscaler.concurrency import call_concurrently, map_concurrently
+from moscaler.instrumentation import instrument_session
 from moscaler.exceptions import MatterhornCommunicationException
 
-# this is a hack until pyhorn can get it's caching controls sorted out
-pyhorn.client._session._is_cache_disabled = True
-
 LOGGER = logging.getLogger(__name__)
 
 PYHORN_TIMEOUT = 30
+# connect/read timeouts & retries for the requests made outside of pyhorn
+HTTP_CONNECT_TIMEOUT = 5
+HTTP_READ_TIMEOUT = 30
+HTTP_RETRIES = 2
+# seconds a hosts/statistics snapshot can be reused before being re-fetched
+STATS_MAX_AGE = 10
+# max number of hosts to toggle maintenance mode on at the same time
+MAINTENANCE_CONCURRENCY = 8
+# max number of hosts/statistics requests to have in flight during a refresh
+REFRESH_CONCURRENCY = 2
 URI_SCHEME = "http"
 HIGH_LOAD_JOB_TYPES = [
     "autotrim",
@@ -30,9 +54,35 @@ HIGH_LOAD_JOB_TYPES = [
 ]
 
 
-class MatterhornController(object):
-    def __init__(self, host):
+def normalize_url(url):
+    """
+    reduce a host url to a form suitable for comparison, i.e. without the
+    scheme, trailing slashes or case differences
+    """
+    if url is None:
+        return None
+    return re.sub(r"^\w+://", "", url.strip().lower()).rstrip("/")
+
+
+def configure_pyhorn_session():
+    """
+    adjust the module-level session pyhorn makes all its requests with
+    """
+    # this is a hack until pyhorn can get it's caching controls sorted out
+    pyhorn.client._session._is_cache_disabled = True
+    instrument_session(pyhorn.client._session)
+
 
+class MatterhornController(object):
+    def __init__(
+        self,
+        host,
+        stats_max_age=None,
+        maintenance_concurrency=None,
+        refresh_concurrency=None,
+    ):
+
+        configure_pyhorn_session()
         self.mh_url = "%s://%s" % (URI_SCHEME, host)
         self.client = pyhorn.MHClient(
             self.mh_url,
@@ -40,22 +90,81 @@ class MatterhornController(object):
             passwd=env("MATTERHORN_PASS"),
             timeout=env("PYHORN_TIMEOUT", PYHORN_TIMEOUT),
         )
+        self._session = None
 
-        try:
-            self.verify_connection()
-            self.refresh_stats()
-            self._online = True
-        except MatterhornCommunicationException as exc:
-            LOGGER.warning("Matterhorn connection failure: %s", str(exc))
-            self._online = False
+        if stats_max_age is None:
+            stats_max_age = float(env("MOSCALER_MH_STATS_MAX_AGE", STATS_MAX_AGE))
+        self.stats_max_age = stats_max_age
+
+        if maintenance_concurrency is None:
+            maintenance_concurrency = int(
+                env("MOSCALER_MAINTENANCE_CONCURRENCY", MAINTENANCE_CONCURRENCY)
+            )
+        self.maintenance_concurrency = maintenance_concurrency
+
+        if refresh_concurrency is None:
+            refresh_concurrency = int(
+                env("MOSCALER_REFRESH_CONCURRENCY", REFRESH_CONCURRENCY)
+            )
+        self.refresh_concurrency = refresh_concurrency
+        self._snapshot_time = None
+        self.reset_snapshot_counts()
+
+        self._hosts = []
+        self._online = False
+        self.refresh()
 
     def __repr__(self):
         return "%s (%s)" % (self.__class__, self.mh_url)
 
+    @property
+    def _hosts(self):
+        return self._host_list
+
+    @_hosts.setter
+    def _hosts(self, hosts):
+        self._host_list = hosts
+        self._hosts_by_url = {normalize_url(x.base_url): x for x in hosts}
+
+    @property
+    def session(self):
+        """
+        keep-alive session, authenticated the same way as the pyhorn client,
+        for the endpoints that pyhorn doesn't cover
+        """
+        if self._session is None:
+            user = env("MATTERHORN_USER")
+            passwd = env("MATTERHORN_PASS")
+            session = requests.Session()
+            session.headers.update(default_headers(user and passwd))
+            if user and passwd:
+                session.auth = HTTPDigestAuth(user, passwd)
+            retry = Retry(
+                total=int(env("MOSCALER_MH_HTTP_RETRIES", HTTP_RETRIES)),
+                backoff_factor=0.5,
+                status_forcelist=[502, 503, 504],
+            )
+            session.mount("http://", HTTPAdapter(max_retries=retry))
+            session.mount("https://", HTTPAdapter(max_retries=retry))
+            self._session = instrument_session(session)
+        return self._session
+
+    @property
+    def http_timeout(self):
+        return (
+            float(env("MOSCALER_MH_CONNECT_TIMEOUT", HTTP_CONNECT_TIMEOUT)),
+            float(env("MOSCALER_MH_READ_TIMEOUT", HTTP_READ_TIMEOUT)),
+        )
+
     def verify_connection(self):
         try:
             LOGGER.debug("verifying pyhorn client connection")
-            with SignalTimeout(5, swallow_exc=False):
+            # signals can only be used from the main thread
+            if threading.current_thread() is threading.main_thread():
+                timeout = SignalTimeout
+            else:
+                timeout = ThreadingTimeout
+            with timeout(5, swallow_exc=False):
                 assert self.client.me() is not None
         except (ConnectionError, RequestsTimeout, StopitTimeout) as exc:
             raise MatterhornCommunicationException(
@@ -67,14 +176,68 @@ class MatterhornController(object):
     def is_online(self):
         return self._online
 
-    def refresh_stats(self):
-        self._hosts = self.client.hosts()
-        self._stats = self.client.statistics()
+    def refresh(self):
+        """
+        refresh hosts & statistics, (re)verifying the connection first if
+        the last attempt failed
+        """
+        try:
+            if not self._online:
+                self.verify_connection()
+            self.refresh_stats(force=True)
+            self._online = True
+        except (
+            MatterhornCommunicationException,
+            ConnectionError,
+            RequestsTimeout,
+        ) as exc:
+            LOGGER.warning("Matterhorn connection failure: %s", str(exc))
+            self._online = False
+
+    def reset_snapshot_counts(self):
+        """
+        start counting how often the snapshot is reused (hits) or fetched
+        (misses) afresh, e.g. for a new daemon cycle
+        """
+        self.snapshot_hits = 0
+        self.snapshot_misses = 0
+
+    def refresh_stats(self, force=False):
+        """
+        fetch the hosts & statistics, unless the current snapshot is younger
+        than `stats_max_age` seconds
+        """
+        if not force and self._snapshot_time is not None:
+            age = time.time() - self._snapshot_time
+            if age < self.stats_max_age:
+                self.snapshot_hits += 1
+                LOGGER.debug("Reusing %.1fs old matterhorn snapshot", age)
+                return
+
+        self.snapshot_misses += 1
+        # independent of each other, so fetched side by side
+        (hosts, hosts_exc), (stats, stats_exc) = call_concurrently(
+            [self.client.hosts, self.client.statistics], self.refresh_concurrency
+        )
+        if hosts_exc is not None or stats_exc is not None:
+            raise hosts_exc or stats_exc
+        self._hosts = hosts
+        self._stats = stats
+        self._snapshot_time = time.time()
+
+    def invalidate(self):
+        """
+        make the next refresh_stats() call re-fetch regardless of age
+        """
+        self._snapshot_time = None
 
     def job_status(self):
+        queued_jobs, queued_jobs_high_load = self.queued_job_counts(
+            [None, HIGH_LOAD_JOB_TYPES]
+        )
         status = {
-            "queued_jobs": self.queued_job_count(),
-            "queued_jobs_high_load": self.queued_high_load_job_count(),
+            "queued_jobs": queued_jobs,
+            "queued_jobs_high_load": queued_jobs_high_load,
         }
         if self.is_online():
             status["running_jobs"] = self._stats.running_jobs()
@@ -106,7 +269,14 @@ class MatterhornController(object):
             f"?operations={','.join(operation_types)}" if operation_types else ""
         )
         queued_jobs_count_url = f"{self.mh_url}/workflow/queuedJobCount{operations}"
-        resp = requests.get(queued_jobs_count_url)
+        try:
+            resp = self.session.get(queued_jobs_count_url, timeout=self.http_timeout)
+        except RequestException as exc:
+            raise MatterhornCommunicationException(
+                "Error getting queued job count from {}: {}".format(
+                    self.mh_url, str(exc)
+                )
+            )
         if resp.status_code != 200:
             LOGGER.error(
                 "Error getting queued job count from Matterhorn: %s", resp.text
@@ -115,19 +285,27 @@ class MatterhornController(object):
 
         return int(resp.text)
 
+    def queued_job_counts(self, operation_type_sets):
+        """
+        queued job counts for each of a list of operation type lists (or
+        None for all jobs), fetched over the same kept-alive connection
+        """
+        return [self.queued_job_count(x) for x in operation_type_sets]
+
     def is_registered(self, inst):
-        registered_hosts = [x.base_url for x in self._hosts]
-        return hasattr(inst, "mh_host_url") and inst.mh_host_url in registered_hosts
+        return (
+            hasattr(inst, "mh_host_url")
+            and normalize_url(inst.mh_host_url) in self._hosts_by_url
+        )
 
     def get_host(self, inst):
 
-        try:
-            return next(x for x in self._hosts if x.base_url == inst.mh_host_url)
-        except StopIteration:
+        host = self._hosts_by_url.get(normalize_url(inst.mh_host_url))
+        if host is None:
             LOGGER.warn(
                 "Tried to get an unregistered host: {}".format(inst.mh_host_url)
             )
-            return None
+        return host
 
     def is_idle(self, inst):
         running_jobs = self._stats.running_jobs(inst.mh_host_url)
@@ -146,11 +324,31 @@ class MatterhornController(object):
         host = self.get_host(inst)
         LOGGER.debug("Setting maintenance to off for %r", inst)
         host.set_maintenance(False)
+        self.invalidate()
 
     def maintenance_on(self, inst):
         host = self.get_host(inst)
         LOGGER.debug("Setting maintenance to on for %r", inst)
         host.set_maintenance(True)
+        self.invalidate()
+
+    def set_maintenance(self, instances, state):
+        """
+        turn maintenance on/off for several instances concurrently. Returns
+        a list of (instance, exception) tuples for the hosts that failed.
+        """
+        toggle = self.maintenance_on if state else self.maintenance_off
+        outcomes = map_concurrently(toggle, instances, self.maintenance_concurrency)
+
+        failures = [(inst, exc) for inst, _, exc in outcomes if exc is not None]
+        for inst, exc in failures:
+            LOGGER.error(
+                "Failed to turn maintenance %s for %r: %s",
+                "on" if state else "off",
+                inst,
+                str(exc),
+            )
+        return failures
 
     @contextmanager
     def in_maintenance(self, instances, restore_state=True, dry_run=False):
@@ -170,11 +368,20 @@ class MatterhornController(object):
             # don't do anything
             yield
         else:
+            # the nodes that will need maintenance turned back off
+            enabled = for_maintenance
             try:
                 for inst in for_maintenance:
                     LOGGER.debug("Enabling maintenance mode for %r", inst)
-                    if not dry_run:
-                        self.maintenance_on(inst)
+                if not dry_run:
+                    failures = self.set_maintenance(for_maintenance, True)
+                    failed = set(id(inst) for inst, _ in failures)
+                    enabled = [x for x in for_maintenance if id(x) not in failed]
+                    if failures:
+                        raise MatterhornCommunicationException(
+                            "Failed to enable maintenance for %d of %d nodes"
+                            % (len(failures), len(for_maintenance))
+                        )
                 self.refresh_stats()
                 yield  # let calling code do it's thing
             except Exception as exc:
@@ -187,13 +394,15 @@ class MatterhornController(object):
             finally:
                 if restore_state:
                     LOGGER.debug("Restoring maintenance state")
-                    for inst in for_maintenance:
+                    to_restore = []
+                    for inst in enabled:
                         if inst.action_taken == "stopped":
                             LOGGER.debug(
                                 "Not unsetting maintenance for stopped: %r", inst
                             )
                         else:
                             LOGGER.debug("Disabling maintenance for %r", inst)
-                            if not dry_run:
-                                self.maintenance_off(inst)
+                            to_restore.append(inst)
+                    if not dry_run:
+                        self.set_maintenance(to_restore, False)
                     self.refresh_stats()
@@ -1,37 +1,67 @@
 import re
+import time
 import arrow
-import boto3
+import random
 import logging
+import threading
 from os import getenv as env
-from moscaler.matterhorn import MatterhornController
+from botocore.exceptions import ClientError
 from moscaler.autoscale import Autoscaler
+from moscaler.clients import AwsClients
+from moscaler.concurrency import call_concurrently, map_concurrently
+from moscaler.topology import TopologyCache
+from moscaler.instrumentation import THROTTLING_ERROR_CODES
 from moscaler.exceptions import OpsworksControllerException, OpsworksScalingException
 
 LOGGER = logging.getLogger(__name__)
 
+# max number of values allowed in a single describe_instances filter
+EC2_FILTER_MAX_VALUES = 200
+
+# max number of start/stop calls to have in flight at once
+DISPATCH_CONCURRENCY = 4
+# max number of sources (opsworks/ec2, matterhorn) to refresh at once
+REFRESH_CONCURRENCY = 2
+# retries & initial backoff (in seconds) for throttled opsworks calls
+THROTTLE_RETRIES = 5
+THROTTLE_BASE_DELAY = 1.0
+
 
 class OpsworksController(object):
-    def __init__(self, cluster, force=False, dry_run=False):
+    def __init__(
+        self, cluster, force=False, dry_run=False, cache_dir=None, clients=None
+    ):
 
         self.force = force
         self.dry_run = dry_run
 
-        self.opsworks = boto3.client("opsworks")
-        self.ec2 = boto3.resource("ec2")
-        stacks = self.opsworks.describe_stacks()["Stacks"]
-        try:
-            self.stack = next(x for x in stacks if x["Name"] == cluster)
-        except StopIteration:
-            raise OpsworksControllerException(
-                "No opsworks stack named '%s' found" % cluster
-            )
-
-        instances = self.opsworks.describe_instances(StackId=self.stack["StackId"])[
-            "Instances"
-        ]
-
-        layers = self.opsworks.describe_layers(StackId=self.stack["StackId"])["Layers"]
-        self._layers = {x["Name"]: x["LayerId"] for x in layers}
+        if clients is None:
+            clients = AwsClients()
+        self.clients = clients
+        self.opsworks = clients.get("opsworks")
+        self.ec2 = clients.get("ec2")
+
+        self.topology = TopologyCache(cache_dir)
+        cached = self.topology.get(cluster)
+        instances = None
+        if cached is not None:
+            LOGGER.debug("Using cached topology for %s", cluster)
+            self.stack = cached["stack"]
+            self._layers = cached["layers"]
+            self._layers_fetched = False
+            try:
+                instances = self._describe_instances()
+            except ClientError as exc:
+                if exc.response["Error"]["Code"] != "ResourceNotFoundException":
+                    raise
+                self.topology.invalidate(cluster)
+                cached = None
+
+        if cached is None:
+            self._discover_stack(cluster)
+            self._layers = self._describe_layers()
+            self._layers_fetched = True
+            instances = self._describe_instances()
 
         try:
             mh_admin = next(
@@ -42,31 +72,130 @@ class OpsworksController(object):
         except StopIteration:
             raise OpsworksControllerException("No admin node found")
 
-        self.mhorn = MatterhornController(mh_admin["PublicDns"])
+        self.admin_host = mh_admin["PublicDns"]
+        if cached is None or cached["admin_host"] != self.admin_host:
+            self._cache_topology()
+
+        self._mhorn = None
+        self._mhorn_lock = threading.Lock()
         self._instances = [OpsworksInstance(x, self) for x in instances]
+        self._launch_times = None
+        self._autoscaler = None
+        self.refresh_concurrency = int(
+            env("MOSCALER_REFRESH_CONCURRENCY", REFRESH_CONCURRENCY)
+        )
 
     def __repr__(self):
         return "%s (%s)" % (self.__class__, self.stack["Name"])
 
+    @property
+    def mhorn(self):
+        # connecting to matterhorn is deferred until something needs it
+        if self._mhorn is None:
+            # e.g. parallel strategies may need it at the same time, but
+            # should share one connection & snapshot
+            with self._mhorn_lock:
+                if self._mhorn is None:
+                    # pyhorn, requests etc. are only loaded when matterhorn is
+                    # needed
+                    from moscaler.matterhorn import MatterhornController
+
+                    LOGGER.debug("Connecting to matterhorn at %s", self.admin_host)
+                    self._mhorn = MatterhornController(self.admin_host)
+        return self._mhorn
+
+    def _discover_stack(self, cluster):
+        # describe_stacks can't filter by name so this scans every stack
+        stacks = self.opsworks.describe_stacks()["Stacks"]
+        try:
+            stack = next(x for x in stacks if x["Name"] == cluster)
+        except StopIteration:
+            raise OpsworksControllerException(
+                "No opsworks stack named '%s' found" % cluster
+            )
+        self.stack = {"StackId": stack["StackId"], "Name": stack["Name"]}
+
+    def _describe_layers(self):
+        layers = self.opsworks.describe_layers(StackId=self.stack["StackId"])["Layers"]
+        return {x["Name"]: x["LayerId"] for x in layers}
+
+    def _describe_instances(self):
+        return self.opsworks.describe_instances(StackId=self.stack["StackId"])[
+            "Instances"
+        ]
+
+    def _cache_topology(self):
+        self.topology.set(self.stack["Name"], self.stack, self._layers, self.admin_host)
+
+    def refresh(self):
+        """
+        re-fetch the volatile cluster state, i.e. instance statuses, launch
+        times if they've been needed before and, if connected, the matterhorn
+        hosts/statistics. The sources don't depend on each other so they're
+        fetched concurrently. The stack, layers and admin node found at
+        construction time are kept as-is.
+        """
+        LOGGER.debug("Refreshing instance and matterhorn state")
+        fetch_launch_times = self._launch_times is not None
+
+        def refresh_instances():
+            instances = [OpsworksInstance(x, self) for x in self._describe_instances()]
+            launch_times = None
+            if fetch_launch_times:
+                ec2_ids = list(InstanceRegistry(instances).by_ec2_id)
+                launch_times = self._describe_launch_times(ec2_ids)
+            return instances, launch_times
+
+        calls = [refresh_instances]
+        if self._mhorn is not None:
+            # the snapshot reuse is reported per cycle
+            self._mhorn.reset_snapshot_counts()
+            # first, i.e. in this thread, as it may need a signal based timeout
+            calls.insert(0, self._mhorn.refresh)
+
+        outcomes = call_concurrently(calls, self.refresh_concurrency)
+        # any failure, matterhorn's included, leaves the instance state as-is
+        for result, exc in outcomes:
+            if exc is not None:
+                raise exc
+        instances, launch_times = outcomes[-1][0]
+        self._instances = instances
+        self._launch_times = launch_times
+
+    @property
+    def _instances(self):
+        return self._all_instances
+
+    @_instances.setter
+    def _instances(self, instances):
+        self._all_instances = instances
+        self._registry = None
+
+    @property
+    def registry(self):
+        if self._registry is None:
+            self._registry = InstanceRegistry(self._all_instances)
+        return self._registry
+
     @property
     def instances(self):
-        return [x for x in self._instances if not x.is_autoscale()]
+        return list(self.registry.instances)
 
     @property
     def workers(self):
-        return [x for x in self.instances if x.is_worker()]
+        return list(self.registry.workers)
 
     @property
     def online_workers(self):
-        return [x for x in self.workers if x.is_online()]
+        return list(self.registry.online_workers)
 
     @property
     def pending_workers(self):
-        return [x for x in self.workers if x.is_pending()]
+        return list(self.registry.pending_workers)
 
     @property
     def online_or_pending_workers(self):
-        return self.online_workers + self.pending_workers
+        return list(self.registry.online_or_pending_workers)
 
     @property
     def idle_workers(self):
@@ -74,33 +203,81 @@ class OpsworksController(object):
 
     @property
     def stopped_workers(self):
-        return [x for x in self.workers if x.is_stopped()]
+        return list(self.registry.stopped_workers)
 
     @property
     def online_instances(self):
-        return [x for x in self.instances if x.is_online()]
+        return list(self.registry.online_instances)
 
     @property
     def admin(self):
         try:
-            return next(x for x in self.instances if x.is_admin())
-        except StopIteration:
+            return self.registry.admins[0]
+        except IndexError:
             raise OpsworksControllerException("No admin node found")
 
+    def get_instance(self, instance_id):
+        try:
+            return self.registry.by_opsworks_id[instance_id]
+        except KeyError:
+            raise OpsworksControllerException("No instance with id '%s'" % instance_id)
+
     def get_layer_id(self, layer_name):
+        if layer_name not in self._layers and not self._layers_fetched:
+            # the layers may have changed since they were cached
+            LOGGER.debug("Layer '%s' not found; re-fetching layers", layer_name)
+            self._layers = self._describe_layers()
+            self._layers_fetched = True
+            self._cache_topology()
         if layer_name not in self._layers:
             raise OpsworksControllerException("Could not find layer '%s'" % layer_name)
         return self._layers[layer_name]
 
     def get_ec2_id(self, instance_name):
-        return next(
-            x.Ec2InstanceId for x in self.instances if x.Hostname == instance_name
-        )
+        try:
+            return self.registry.by_hostname[instance_name].Ec2InstanceId
+        except KeyError:
+            raise OpsworksControllerException(
+                "No instance with hostname '%s'" % instance_name
+            )
 
-    def status(self):
+    def get_launch_time(self, ec2_id):
+        """
+        launch times for all of the stack's ec2 instances are fetched together
+        on first use rather than one DescribeInstances call per instance
+        """
+        if self._launch_times is None:
+            self._launch_times = self._describe_launch_times(
+                list(self.registry.by_ec2_id)
+            )
+        return self._launch_times.get(ec2_id)
+
+    def now(self):
+        """
+        the current time, as used for uptime calculations
+        """
+        return arrow.utcnow()
+
+    def _describe_launch_times(self, ec2_ids):
+
+        LOGGER.debug("Fetching launch times for %d ec2 instances", len(ec2_ids))
+
+        launch_times = {}
+        paginator = self.ec2.get_paginator("describe_instances")
+        for offset in range(0, len(ec2_ids), EC2_FILTER_MAX_VALUES):
+            end = offset + EC2_FILTER_MAX_VALUES
+            pages = paginator.paginate(
+                Filters=[{"Name": "instance-id", "Values": ec2_ids[offset:end]}]
+            )
+            for page in pages:
+                for reservation in page["Reservations"]:
+                    for inst in reservation["Instances"]:
+                        launch_times[inst["InstanceId"]] = inst["LaunchTime"]
+        return launch_times
+
+    def status(self, include_matterhorn=True):
         status = {
             "cluster": self.stack["Name"],
-            "matterhorn_online": self.mhorn.is_online(),
             "instances": len(self.instances),
             "instances_online": len(self.online_instances),
             "workers": len(self.workers),
@@ -109,7 +286,9 @@ class OpsworksController(object):
             "worker_details": [],
         }
 
-        status["job_status"] = self.mhorn.job_status()
+        if include_matterhorn:
+            status["matterhorn_online"] = self.mhorn.is_online()
+            status["job_status"] = self.mhorn.job_status()
 
         for inst in self.workers:
             inst_status = {
@@ -121,7 +300,8 @@ class OpsworksController(object):
                 "uptime": inst.uptime(),
                 "billed_minutes": inst.billed_minutes(),
             }
-            inst_status.update(self.mhorn.node_status(inst))
+            if include_matterhorn:
+                inst_status.update(self.mhorn.node_status(inst))
             #            if hasattr(inst, 'Ec2InstanceId'):
             #                inst_status['ec2_id'] = inst.Ec2InstanceId
             status["worker_details"].append(inst_status)
@@ -130,22 +310,82 @@ class OpsworksController(object):
     def actions(self):
         stopped = [x for x in self.workers if x.action_taken == "stopped"]
         started = [x for x in self.workers if x.action_taken == "started"]
-        return {
+        actions = {
             "total_stopped": len(stopped),
             "stopped": "; ".join("%r" % x for x in stopped),
             "total_started": len(started),
             "started": ", ".join("%s" % x for x in started),
+            "dispatch_latency": {
+                x.Hostname: x.dispatch_latency
+                for x in self.workers
+                if x.dispatch_latency is not None
+            },
         }
+        # only if matterhorn was consulted
+        if self._mhorn is not None:
+            actions["mh_snapshot"] = {
+                "hits": self._mhorn.snapshot_hits,
+                "misses": self._mhorn.snapshot_misses,
+            }
+        return actions
 
     def start_instance(self, inst):
         LOGGER.info("Starting %r", inst)
         if not self.dry_run:
-            self.opsworks.start_instance(InstanceId=inst.InstanceId)
+            self._call_with_backoff(
+                self.opsworks.start_instance, InstanceId=inst.InstanceId
+            )
+        self._registry = None
 
     def stop_instance(self, inst):
         LOGGER.info("Stopping %r", inst)
         if not self.dry_run:
-            self.opsworks.stop_instance(InstanceId=inst.InstanceId)
+            self._call_with_backoff(
+                self.opsworks.stop_instance, InstanceId=inst.InstanceId
+            )
+        self._registry = None
+
+    def _call_with_backoff(self, method, **kwargs):
+        """
+        make an opsworks api call, retrying with jittered exponential backoff
+        if aws reports that we're being throttled
+        """
+        retries = int(env("MOSCALER_THROTTLE_RETRIES", THROTTLE_RETRIES))
+        for attempt in range(retries + 1):
+            try:
+                return method(**kwargs)
+            except ClientError as exc:
+                code = exc.response.get("Error", {}).get("Code")
+                if code not in THROTTLING_ERROR_CODES or attempt == retries:
+                    raise
+                delay = random.uniform(0, THROTTLE_BASE_DELAY * 2**attempt)
+                LOGGER.warning("Throttled by aws (%s); retrying in %.2fs", code, delay)
+                time.sleep(delay)
+
+    def _dispatch(self, instances, action):
+        """
+        start or stop the instances concurrently. Every instance is attempted
+        even if some fail; the failures are then raised together.
+        """
+        concurrency = int(env("MOSCALER_DISPATCH_CONCURRENCY", DISPATCH_CONCURRENCY))
+
+        def dispatch(inst):
+            start = time.time()
+            try:
+                getattr(inst, action)()
+            finally:
+                inst.dispatch_latency = time.time() - start
+
+        outcomes = map_concurrently(dispatch, instances, concurrency)
+
+        failures = [(inst, exc) for inst, _, exc in outcomes if exc is not None]
+        for inst, exc in failures:
+            LOGGER.error("Failed to %s %r: %s", action, inst, str(exc))
+        if failures:
+            raise OpsworksScalingException(
+                "Failed to %s %d of %d instances"
+                % (action, len(failures), len(instances))
+            )
 
     def scale_to(self, num_workers, scale_available=False):
 
@@ -171,13 +411,23 @@ class OpsworksController(object):
                     LOGGER.info("Attempting to scale down %d workers", num_workers)
                     self._scale_down(num_workers)
 
+    @property
+    def autoscaler(self):
+        """
+        the Autoscaler used by the last autoscale() call, if any
+        """
+        return self._autoscaler
+
     def autoscale(self, settings):
 
-        autoscaler = Autoscaler(self, settings)
+        # hang on to the autoscaler (and its clients) between calls so that
+        # long-running processes don't rebuild it every cycle
+        if self._autoscaler is None or self._autoscaler.config != settings:
+            self._autoscaler = Autoscaler(self, settings, cluster=self.stack["Name"])
 
         try:
             LOGGER.info("Executing autoscaler")
-            autoscaler.execute()
+            self._autoscaler.execute()
         except Exception as e:
             raise OpsworksScalingException("Autoscale aborted: %s" % str(e))
 
@@ -200,66 +450,117 @@ class OpsworksController(object):
 
         instances_to_start = start_candidates[:num_workers]
         LOGGER.info("Starting %d workers", len(instances_to_start))
-        for inst in instances_to_start:
-            inst.start()
+        self._dispatch(instances_to_start, "start")
 
-    def _scale_down(self, num_workers, check_uptime=False, scale_available=False):
+    def plan_scale_down(self, num_workers, check_uptime=False, scale_available=False):
+        """
+        work out, in a single pass and without changing anything, which
+        workers a scale down of `num_workers` would stop. With
+        `scale_available` the number is reduced to the largest one the
+        cluster's state and MIN_WORKERS allow rather than failing.
+        """
 
         MIN_WORKERS = int(env("MOSCALER_MIN_WORKERS", 1))
 
+        plan = ScaleDownPlan(num_workers)
+
         # do we have that many running workers?
-        if len(self.online_or_pending_workers) - num_workers < 0:
+        online_or_pending = len(self.online_or_pending_workers)
+        if online_or_pending < num_workers:
             msg = (
                 "Cluster does not have %d online or pending workers to stop!"
                 % num_workers
             )
-            if scale_available:
-                LOGGER.warn(msg + " Trying with fewer workers.")
-                return self._scale_down(num_workers - 1, check_uptime, scale_available)
-            else:
-                raise OpsworksScalingException(msg)
-
-        if len(self.online_workers) - num_workers < MIN_WORKERS:
-            msg = "Stopping %d workers violates MIN_WORKERS %d!" % (
-                num_workers,
-                MIN_WORKERS,
-            )
+            if not scale_available:
+                return plan.fail(msg)
+            plan.warn(msg + " Trying with %d workers." % online_or_pending)
+            num_workers = online_or_pending
+
+        online = len(self.online_workers)
+        if online - num_workers < MIN_WORKERS:
+            msg = "Stopping %d workers violates MIN_WORKERS %d!"
             if self.force:
-                LOGGER.warning(msg + " Continuing because --force enabled.")
-            elif scale_available and num_workers > 1:
-                LOGGER.warn(msg + " Trying with fewer workers.")
-                return self._scale_down(num_workers - 1, check_uptime, scale_available)
+                plan.warn(
+                    msg % (num_workers, MIN_WORKERS)
+                    + " Continuing because --force enabled."
+                )
+            elif scale_available and online - MIN_WORKERS >= 1:
+                plan.warn(
+                    msg % (num_workers, MIN_WORKERS)
+                    + " Trying with %d workers." % (online - MIN_WORKERS)
+                )
+                num_workers = online - MIN_WORKERS
             else:
-                raise OpsworksScalingException(msg)
+                if scale_available:
+                    # even a single worker is too many
+                    num_workers = min(num_workers, 1)
+                return plan.fail(msg % (num_workers, MIN_WORKERS))
+
+        plan.num_workers = num_workers
+        if not num_workers:
+            return plan
 
-        workers_to_stop = self._get_workers_to_stop(num_workers, check_uptime)
+        plan.instances = self._get_workers_to_stop(
+            num_workers, check_uptime, excluded=plan.excluded
+        )
 
-        if len(workers_to_stop) < num_workers:
+        if len(plan.instances) < num_workers:
             msg = "Cluster does not have %d workers available to stop!" % num_workers
-            if len(workers_to_stop) and scale_available:
-                LOGGER.warn(msg + " Only stopping available workers.")
+            if len(plan.instances) and scale_available:
+                plan.warn(msg + " Only stopping available workers.")
             else:
-                raise OpsworksScalingException(msg)
+                return plan.fail(msg)
 
-        LOGGER.info("Stopping %d workers", len(workers_to_stop))
-        for inst in workers_to_stop:
-            inst.stop()
+        return plan
 
-    def _get_workers_to_stop(self, num_workers, check_uptime):
+    def _scale_down(self, num_workers, check_uptime=False, scale_available=False):
+
+        plan = self.plan_scale_down(num_workers, check_uptime, scale_available)
+
+        for msg in plan.warnings:
+            LOGGER.warning(msg)
+        for inst, reason in plan.excluded:
+            LOGGER.debug("Not stopping %r: %s", inst, reason)
+        if plan.error is not None:
+            raise OpsworksScalingException(plan.error)
+
+        LOGGER.info("Stopping %d workers", len(plan.instances))
+        self._dispatch(plan.instances, "stop")
+
+    def _get_workers_to_stop(self, num_workers, check_uptime, excluded=None):
+        """
+        the (up to) `num_workers` best workers to stop. If given, `excluded`
+        is extended with (instance, reason) tuples for the online or pending
+        workers that weren't picked.
+        """
 
         LOGGER.debug("Looking for %d workers to stop", num_workers)
 
+        if excluded is None:
+            excluded = []
+
         if self.force:
             LOGGER.warning("--force enabled; skipping idleness/uptime checks")
             stop_candidates = self.online_or_pending_workers
         else:
-            stop_candidates = self.pending_workers
-            stop_candidates += self.idle_workers
+            online_workers = self.online_workers
+            idle_workers = self.mhorn.filter_idle(online_workers)
+            idle_ids = set(id(x) for x in idle_workers)
+            excluded.extend(
+                (x, "not idle") for x in online_workers if id(x) not in idle_ids
+            )
+            stop_candidates = self.pending_workers + idle_workers
 
             if check_uptime:
-                stop_candidates = self._filter_by_billing_hour(stop_candidates)
+                stop_candidates = self._filter_by_billing_hour(
+                    stop_candidates, excluded=excluded
+                )
 
         stop_candidates = self._sort_by_uptime(stop_candidates)
+        excluded.extend(
+            (x, "not needed to stop %d workers" % num_workers)
+            for x in stop_candidates[num_workers:]
+        )
         return stop_candidates[:num_workers]
 
     def _sort_by_uptime(self, instances):
@@ -273,7 +574,7 @@ class OpsworksController(object):
             reverse=True,
         )
 
-    def _filter_by_billing_hour(self, instances, uptime_threshold=None):
+    def _filter_by_billing_hour(self, instances, uptime_threshold=None, excluded=None):
         """
         only stop idle workers if approaching uptime near to being
         divisible by 60m since we're paying for the full hour anyway
@@ -297,19 +598,159 @@ class OpsworksController(object):
                     LOGGER.warning("Including %r because --force", inst)
                 else:
                     LOGGER.debug("Not including %r", inst)
+                    if excluded is not None:
+                        excluded.append(
+                            (inst, "only %d minutes into its billing hour" % minutes)
+                        )
                     continue
             filtered_instances.append(inst)
         return filtered_instances
 
 
+class ScaleDownPlan(object):
+    """
+    The outcome of planning a scale down: the workers to stop, why the other
+    running workers weren't picked, and the warning or error messages
+    encountered along the way.
+    """
+
+    def __init__(self, requested):
+        self.requested = requested
+        self.num_workers = 0
+        self.instances = []
+        self.excluded = []
+        self.warnings = []
+        self.error = None
+
+    def __repr__(self):
+        return "%s (requested %d, stopping %d, excluded %d)" % (
+            self.__class__,
+            self.requested,
+            len(self.instances),
+            len(self.excluded),
+        )
+
+    def warn(self, msg):
+        self.warnings.append(msg)
+
+    def fail(self, msg):
+        self.error = msg
+        self.instances = []
+        return self
+
+    @property
+    def feasible(self):
+        return self.error is None
+
+
+class InstanceRegistry(object):
+    """
+    Indexes of a controller's instances by role, status, hostname and id.
+    Each index is built the first time it's used; the controller discards
+    the registry whenever its instance list changes.
+    """
+
+    WORKER_STATES = ["online", "pending", "stopped"]
+
+    def __init__(self, instances):
+        self._all_instances = instances
+        self._indexes = {}
+
+    def _index(self, name, build):
+        if name not in self._indexes:
+            self._indexes[name] = build()
+        return self._indexes[name]
+
+    @property
+    def instances(self):
+        return self._index(
+            "instances",
+            lambda: [x for x in self._all_instances if not x.is_autoscale()],
+        )
+
+    def _by_role(self):
+        roles = {"worker": [], "admin": []}
+        for inst in self.instances:
+            if inst.is_worker():
+                roles["worker"].append(inst)
+            elif inst.is_admin():
+                roles["admin"].append(inst)
+        return roles
+
+    @property
+    def workers(self):
+        return self._index("by_role", self._by_role)["worker"]
+
+    @property
+    def admins(self):
+        return self._index("by_role", self._by_role)["admin"]
+
+    def _workers_by_status(self):
+        states = {x: [] for x in self.WORKER_STATES}
+        for inst in self.workers:
+            if inst.is_online():
+                states["online"].append(inst)
+            elif inst.is_pending():
+                states["pending"].append(inst)
+            elif inst.is_stopped():
+                states["stopped"].append(inst)
+        states["online_or_pending"] = states["online"] + states["pending"]
+        return states
+
+    @property
+    def online_workers(self):
+        return self._index("workers_by_status", self._workers_by_status)["online"]
+
+    @property
+    def pending_workers(self):
+        return self._index("workers_by_status", self._workers_by_status)["pending"]
+
+    @property
+    def stopped_workers(self):
+        return self._index("workers_by_status", self._workers_by_status)["stopped"]
+
+    @property
+    def online_or_pending_workers(self):
+        return self._index("workers_by_status", self._workers_by_status)[
+            "online_or_pending"
+        ]
+
+    @property
+    def online_instances(self):
+        return self._index(
+            "online_instances", lambda: [x for x in self.instances if x.is_online()]
+        )
+
+    @property
+    def by_hostname(self):
+        return self._index(
+            "by_hostname",
+            lambda: {getattr(x, "Hostname", None): x for x in self.instances},
+        )
+
+    @property
+    def by_opsworks_id(self):
+        return self._index(
+            "by_opsworks_id",
+            lambda: {getattr(x, "InstanceId", None): x for x in self.instances},
+        )
+
+    @property
+    def by_ec2_id(self):
+        return self._index(
+            "by_ec2_id",
+            lambda: {
+                x.Ec2InstanceId: x for x in self.instances if x.has_ec2_instance()
+            },
+        )
+
+
 class OpsworksInstance(object):
     def __init__(self, inst_dict, controller):
         self._inst = inst_dict
         self.action_taken = None
+        self.dispatch_latency = None
         self.controller = controller
-        self.ec2_inst = None
-        if "Ec2InstanceId" in inst_dict:
-            self.ec2_inst = controller.ec2.Instance(inst_dict["Ec2InstanceId"])
 
     def __repr__(self):
         return "%s (%s, %s, %s)" % (
@@ -326,7 +767,7 @@ class OpsworksInstance(object):
             raise AttributeError(k)
 
     def has_ec2_instance(self):
-        return self.ec2_inst is not None
+        return self.Ec2InstanceId is not None
 
     def beefiness(self):
         inst_type = self.InstanceType
@@ -349,10 +790,13 @@ class OpsworksInstance(object):
             return "http://" + self.PrivateDns
 
     def uptime(self):
-        if self.ec2_inst is None or not self.is_online():
+        if not self.has_ec2_instance() or not self.is_online():
+            return 0
+        launch_time = self.controller.get_launch_time(self.Ec2InstanceId)
+        if launch_time is None:
             return 0
-        launch_time = arrow.get(self.ec2_inst.launch_time)
-        now = arrow.utcnow()
+        launch_time = arrow.get(launch_time)
+        now = self.controller.now()
         return (now - launch_time).seconds
 
     def billed_minutes(self):
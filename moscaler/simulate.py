@@ -0,0 +1,442 @@
+import json
+import math
+import arrow
+import shutil
+import logging
+import tempfile
+from contextlib import contextmanager
+
+from moscaler.autoscale import Autoscaler, AutoscaleException
+from moscaler.opsworks import OpsworksController, OpsworksInstance
+from moscaler.exceptions import OpsworksControllerException, OpsworksScalingException
+
+LOGGER = logging.getLogger(__name__)
+
+# seconds a started worker spends pending before coming online
+BOOT_TIME = 300
+# queued job count at/above which the queue is considered to be spiking
+SPIKE_THRESHOLD = 10
+TRACE_START = "2016-01-01T00:00:00"
+WORKER_INSTANCE_TYPE = "c4.2xlarge"
+
+
+def load_trace(path):
+    """
+    A trace is a json file like:
+
+        {
+          "interval": 60,
+          "workers": 10,
+          "online_workers": 2,
+          "jobs_per_worker": 1,
+          "samples": [
+            {"queued_jobs": 4, "running_jobs": 2, "metrics": {"load_1": 3.5}},
+            ...
+          ]
+        }
+
+    with one sample per `interval` seconds. All but `samples` are optional.
+    """
+    with open(path, "r") as f:
+        trace = json.load(f)
+    if not trace.get("samples"):
+        raise OpsworksControllerException("Trace %s has no samples" % path)
+    return trace
+
+
+class SimulationClock(object):
+    """
+    virtual clock that only moves when told to
+    """
+
+    def __init__(self, start):
+        self.start = arrow.get(start)
+        self.current = self.start
+
+    def now(self):
+        return self.current
+
+    def set(self, seconds):
+        self.current = self.start.shift(seconds=seconds)
+
+    def elapsed(self):
+        return (self.current - self.start).total_seconds()
+
+
+class SimulatedCloudwatch(object):
+    """
+    stands in for the cloudwatch client, answering GetMetricData queries from
+    the trace samples that are "in the past" according to the clock
+    """
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+        self.requests = 0
+
+    def get_paginator(self, operation):
+        assert operation == "get_metric_data"
+        return self
+
+    def paginate(self, MetricDataQueries, StartTime, EndTime):
+        self.requests += 1
+        results = []
+        for query in MetricDataQueries:
+            metric = query["MetricStat"]["Metric"]["MetricName"]
+            timestamps, values = [], []
+            for ts, sample in self.simulation.samples_between(StartTime, EndTime):
+                if metric in sample.get("metrics", {}):
+                    timestamps.append(ts)
+                    values.append(sample["metrics"][metric])
+            results.append(
+                {"Id": query["Id"], "Timestamps": timestamps, "Values": values}
+            )
+        return [{"MetricDataResults": results}]
+
+
+class SimulatedMatterhorn(object):
+    """
+    stands in for the MatterhornController, reporting the queued/running job
+    counts of the current trace sample
+    """
+
+    def __init__(self, simulation):
+        self.simulation = simulation
+
+    def is_online(self):
+        return True
+
+    def refresh(self):
+        pass
+
+    def queued_job_count(self, operation_types=None):
+        return self.simulation.sample.get("queued_jobs", 0)
+
+    def job_status(self):
+        sample = self.simulation.sample
+        return {
+            "queued_jobs": sample.get("queued_jobs", 0),
+            "queued_jobs_high_load": sample.get("queued_jobs", 0),
+            "running_jobs": sample.get("running_jobs", 0),
+        }
+
+    def node_status(self, inst):
+        return {"registered": inst.is_online(), "maintenance": False, "idle": None}
+
+    def filter_idle(self, instances):
+        # the running jobs are spread over as few workers as possible; the
+        # rest are idle
+        busy = int(
+            math.ceil(
+                self.simulation.sample.get("running_jobs", 0)
+                / float(self.simulation.jobs_per_worker)
+            )
+        )
+        return instances[busy:]
+
+    @contextmanager
+    def in_maintenance(self, instances, restore_state=True, dry_run=False):
+        yield
+
+
+class SimulatedController(OpsworksController):
+    """
+    An OpsworksController whose workers exist only in memory. Starting a
+    worker makes it pending until `boot_time` seconds have passed on the
+    simulation clock; stopping it takes effect immediately.
+    """
+
+    def __init__(self, simulation, workers, online_workers, boot_time):
+        # deliberately not calling the parent constructor; nothing here
+        # talks to aws or matterhorn
+        self.simulation = simulation
+        self.force = False
+        self.dry_run = False
+        self.stack = {"StackId": "simulation", "Name": "simulation"}
+        self._layers = {"Admin": "admin-layer", "Workers": "workers-layer"}
+        self._layers_fetched = True
+        self.admin_host = "admin.simulation"
+        self.boot_time = boot_time
+
+        self._mhorn = SimulatedMatterhorn(simulation)
+        self._autoscaler = None
+        self._launch_times = {}
+        self._online_at = {}
+        # (seconds, "start"|"stop", hostname)
+        self.events = []
+        # hours billed for workers that have since been stopped
+        self.billed_hours = 0
+
+        instances = [
+            {
+                "InstanceId": "admin",
+                "Hostname": "admin1",
+                "PublicDns": self.admin_host,
+                "Status": "online",
+                "LayerIds": ["admin-layer"],
+            }
+        ]
+        for idx in range(1, workers + 1):
+            instances.append(
+                {
+                    "InstanceId": "worker-%d" % idx,
+                    "Ec2InstanceId": "i-worker-%d" % idx,
+                    "Hostname": "workers%d" % idx,
+                    "PrivateDns": "workers%d.simulation" % idx,
+                    "InstanceType": WORKER_INSTANCE_TYPE,
+                    "Status": "stopped",
+                    "LayerIds": ["workers-layer"],
+                }
+            )
+        self._instances = [OpsworksInstance(x, self) for x in instances]
+
+        for inst in self.workers[:online_workers]:
+            inst._inst["Status"] = "online"
+            self._launch_times[inst.Ec2InstanceId] = self.now()
+        self._registry = None
+
+    def now(self):
+        return self.simulation.clock.now()
+
+    def get_layer_id(self, layer_name):
+        # any layer a strategy asks about is fine
+        return self._layers.setdefault(layer_name, "%s-layer" % layer_name.lower())
+
+    def get_ec2_id(self, instance_name):
+        # likewise any instance, e.g. a monitoring node publishing metrics
+        try:
+            return super(SimulatedController, self).get_ec2_id(instance_name)
+        except OpsworksControllerException:
+            return "i-%s" % instance_name
+
+    def get_launch_time(self, ec2_id):
+        return self._launch_times.get(ec2_id)
+
+    def _describe_instances(self):
+        return [x._inst for x in self._instances]
+
+    def _describe_layers(self):
+        return dict(self._layers)
+
+    def _describe_launch_times(self, ec2_ids):
+        return {x: self._launch_times[x] for x in ec2_ids if x in self._launch_times}
+
+    def _cache_topology(self):
+        pass
+
+    def refresh(self):
+        # bring up the workers that have finished booting
+        now = self.now()
+        for inst in self.pending_workers:
+            if self._online_at[inst.InstanceId] <= now:
+                inst._inst["Status"] = "online"
+        for inst in self._instances:
+            inst.action_taken = None
+        self._registry = None
+
+    def start_instance(self, inst):
+        LOGGER.info("Starting %r", inst)
+        inst._inst["Status"] = "requested"
+        self._launch_times[inst.Ec2InstanceId] = self.now()
+        self._online_at[inst.InstanceId] = self.now().shift(seconds=self.boot_time)
+        self.events.append((self.simulation.clock.elapsed(), "start", inst.Hostname))
+        self._registry = None
+
+    def stop_instance(self, inst):
+        LOGGER.info("Stopping %r", inst)
+        self.billed_hours += self._billed_hours(inst)
+        inst._inst["Status"] = "stopped"
+        self._launch_times.pop(inst.Ec2InstanceId, None)
+        self.events.append((self.simulation.clock.elapsed(), "stop", inst.Hostname))
+        self._registry = None
+
+    def _billed_hours(self, inst):
+        launch_time = self._launch_times.get(inst.Ec2InstanceId)
+        if launch_time is None:
+            return 0
+        # every started hour is billed in full
+        return int(math.ceil((self.now() - launch_time).total_seconds() / 3600.0))
+
+    def outstanding_billed_hours(self):
+        return sum(self._billed_hours(x) for x in self.workers if not x.is_stopped())
+
+
+class SimulatedAutoscaler(Autoscaler):
+    def __init__(self, simulation, controller, config, pause_file_dir):
+        super(SimulatedAutoscaler, self).__init__(controller, config, pause_file_dir)
+        self.simulation = simulation
+        self._cw = SimulatedCloudwatch(simulation)
+
+    def now(self):
+        return self.simulation.clock.now().naive
+
+
+class Simulation(object):
+    """
+    Replays a trace through the real autoscaling decision logic, one
+    autoscale cycle per sample, against simulated opsworks & matterhorn.
+    """
+
+    def __init__(
+        self, trace, config, workers=None, boot_time=None, spike_threshold=None
+    ):
+        self.trace = trace
+        self.samples = trace["samples"]
+        self.interval = trace.get("interval", 60)
+        self.jobs_per_worker = trace.get("jobs_per_worker", 1)
+        self.clock = SimulationClock(trace.get("start", TRACE_START))
+        self.sample = self.samples[0]
+
+        if workers is None:
+            workers = trace.get("workers", 10)
+        if boot_time is None:
+            boot_time = BOOT_TIME
+        if spike_threshold is None:
+            spike_threshold = trace.get("spike_threshold", SPIKE_THRESHOLD)
+        self.spike_threshold = spike_threshold
+
+        self.controller = SimulatedController(
+            self, workers, trace.get("online_workers", 1), boot_time
+        )
+        self.config = config
+
+    def samples_between(self, start_time, end_time):
+        """
+        (timestamp, sample) for the samples from start to end, inclusive,
+        that the clock has already reached
+        """
+        start = arrow.get(start_time)
+        end = min(arrow.get(end_time), self.clock.now())
+        for idx, sample in enumerate(self.samples):
+            ts = self.clock.start.shift(seconds=idx * self.interval)
+            if start <= ts <= end:
+                yield ts.naive, sample
+
+    def run(self):
+
+        pause_file_dir = tempfile.mkdtemp()
+        try:
+            autoscaler = SimulatedAutoscaler(
+                self, self.controller, self.config, pause_file_dir
+            )
+            timeline = []
+            for idx, sample in enumerate(self.samples):
+                self.clock.set(idx * self.interval)
+                self.sample = sample
+                self.controller.refresh()
+
+                events_before = len(self.controller.events)
+                aborted = False
+                try:
+                    autoscaler.execute()
+                except AutoscaleException as exc:
+                    # e.g. invalid strategy settings
+                    LOGGER.error("Cycle %d aborted: %s", idx, str(exc))
+                    aborted = True
+                except OpsworksScalingException as exc:
+                    # refused, e.g. by MIN_WORKERS, as it would be for real
+                    LOGGER.info(str(exc))
+                except OpsworksControllerException as exc:
+                    LOGGER.error("Cycle %d aborted: %s", idx, str(exc))
+                    aborted = True
+                actions = set(x[1] for x in self.controller.events[events_before:])
+
+                timeline.append(
+                    {
+                        "time": self.clock.elapsed(),
+                        "queued_jobs": sample.get("queued_jobs", 0),
+                        "online": len(self.controller.online_workers),
+                        "running": len(self.controller.online_or_pending_workers),
+                        "aborted": aborted,
+                        "direction": (
+                            "up"
+                            if "start" in actions
+                            else "down" if "stop" in actions else None
+                        ),
+                    }
+                )
+        finally:
+            shutil.rmtree(pause_file_dir)
+
+        return self.summarize(timeline)
+
+    def summarize(self, timeline):
+
+        directions = [x["direction"] for x in timeline if x["direction"]]
+        flaps = len([1 for a, b in zip(directions, directions[1:]) if a != b])
+
+        spikes = self._spikes(timeline)
+        # leaving out the spikes where no more workers came online
+        times_to_capacity = [
+            x["time_to_capacity"] for x in spikes if x["time_to_capacity"] is not None
+        ]
+        events = self.controller.events
+
+        return {
+            "cycles": len(timeline),
+            # cycles the autoscaler couldn't complete; the results don't
+            # reflect the config if there are any
+            "aborted_cycles": len([x for x in timeline if x["aborted"]]),
+            "simulated_hours": len(timeline) * self.interval / 3600.0,
+            "worker_hours": sum(x["running"] for x in timeline)
+            * self.interval
+            / 3600.0,
+            "billed_worker_hours": self.controller.billed_hours
+            + self.controller.outstanding_billed_hours(),
+            "peak_online_workers": max(x["online"] for x in timeline),
+            "scale_up_events": directions.count("up"),
+            "scale_down_events": directions.count("down"),
+            "workers_started": len([x for x in events if x[1] == "start"]),
+            "workers_stopped": len([x for x in events if x[1] == "stop"]),
+            "flaps": flaps,
+            "spikes": spikes,
+            "mean_time_to_capacity": (
+                sum(times_to_capacity) / len(times_to_capacity)
+                if times_to_capacity
+                else None
+            ),
+            "max_time_to_capacity": (
+                max(times_to_capacity) if times_to_capacity else None
+            ),
+        }
+
+    def _spikes(self, timeline):
+        """
+        A spike starts when the queued jobs reach the spike threshold and
+        lasts until they drop below it again. Its time to capacity is the
+        time from the start of the spike until the most workers online
+        during it (or within a boot time of its end) were first online, or
+        None if no more workers than at its start ever were.
+        """
+        spikes = []
+        idx = 0
+        while idx < len(timeline):
+            if timeline[idx]["queued_jobs"] < self.spike_threshold:
+                idx += 1
+                continue
+            start = idx
+            while (
+                idx < len(timeline)
+                and timeline[idx]["queued_jobs"] >= self.spike_threshold
+            ):
+                idx += 1
+            settle = timeline[idx - 1]["time"] + self.controller.boot_time
+            window = [x for x in timeline[start:] if x["time"] <= settle]
+            peak = max(x["online"] for x in window)
+            time_to_capacity = None
+            if peak > timeline[start]["online"]:
+                reached = next(x for x in window if x["online"] == peak)
+                time_to_capacity = reached["time"] - timeline[start]["time"]
+            spikes.append(
+                {
+                    "start": timeline[start]["time"],
+                    "duration": timeline[idx - 1]["time"]
+                    - timeline[start]["time"]
+                    + self.interval,
+                    "peak_queued_jobs": max(
+                        x["queued_jobs"] for x in timeline[start:idx]
+                    ),
+                    "peak_online_workers": peak,
+                    "time_to_capacity": time_to_capacity,
+                }
+            )
+        return spikes
@@ -0,0 +1,70 @@
+import os
+import time
+import threading
+from collections import OrderedDict
+from contextlib import contextmanager
+
+
+def process_age():
+    """
+    seconds since the process started, if the platform lets us find out
+    """
+    try:
+        with open("/proc/self/stat") as f:
+            # the command name can contain spaces, so split after it
+            fields = f.read().rsplit(")", 1)[1].split()
+        with open("/proc/uptime") as f:
+            uptime = float(f.read().split()[0])
+        return uptime - int(fields[19]) / float(os.sysconf("SC_CLK_TCK"))
+    except (IOError, OSError, ValueError, IndexError, KeyError):
+        return None
+
+
+class Timings(object):
+    """
+    Wall time spent in each named phase of a run. Time spent in a phase that
+    is nested in another is only counted towards the inner one.
+    """
+
+    def __init__(self, start=None):
+        if start is None:
+            start = time.perf_counter() - (process_age() or 0)
+        self.start = start
+        self.phases = OrderedDict()
+        self._lock = threading.Lock()
+        self._local = threading.local()
+
+    def add(self, name, seconds):
+        with self._lock:
+            self.phases[name] = self.phases.get(name, 0) + seconds
+
+    @contextmanager
+    def phase(self, name):
+        if not hasattr(self._local, "stack"):
+            self._local.stack = []
+        stack = self._local.stack
+        # accumulates the time spent in nested phases
+        stack.append(0)
+        begin = time.perf_counter()
+        try:
+            yield
+        finally:
+            elapsed = time.perf_counter() - begin
+            self.add(name, elapsed - stack.pop())
+            if stack:
+                stack[-1] += elapsed
+
+    def report(self):
+        """
+        list of (phase, seconds) tuples, including the time not accounted
+        for by any phase and the total since the start
+        """
+        total = time.perf_counter() - self.start
+        with self._lock:
+            phases = list(self.phases.items())
+        other = total - sum(x[1] for x in phases)
+        return phases + [("other", max(other, 0)), ("total", total)]
+
+
+# for the current process
+TIMINGS = Timings()
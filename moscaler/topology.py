@@ -0,0 +1,84 @@
+import os
+import json
+import time
+import logging
+import threading
+from os import getenv as env
+
+LOGGER = logging.getLogger(__name__)
+
+# seconds before a cached cluster topology is considered stale
+TOPOLOGY_TTL = 86400
+
+# the controllers of several clusters may share the cache file
+_LOCK = threading.Lock()
+
+
+class TopologyCache(object):
+    """
+    On-disk cache of the parts of a cluster's topology that practically
+    never change: the opsworks stack, its layer ids and the admin host.
+    Entries are keyed by cluster name and expire after `ttl` seconds; a ttl
+    of 0 disables the cache.
+    """
+
+    def __init__(self, cache_dir=None, ttl=None):
+        if cache_dir is None:
+            cache_dir = os.path.expanduser("~")
+        self.path = os.path.join(cache_dir, ".moscaler-topology.json")
+
+        if ttl is None:
+            ttl = int(env("MOSCALER_TOPOLOGY_TTL", TOPOLOGY_TTL))
+        self.ttl = ttl
+
+    def get(self, cluster):
+        if not self.ttl:
+            return None
+        entry = self._read().get(cluster)
+        if entry is None:
+            LOGGER.debug("No cached topology for %s", cluster)
+            return None
+        if time.time() - entry.get("timestamp", 0) > self.ttl:
+            LOGGER.debug("Cached topology for %s has expired", cluster)
+            return None
+        return entry
+
+    def set(self, cluster, stack, layers, admin_host):
+        if not self.ttl:
+            return
+        with _LOCK:
+            entries = self._read()
+            entries[cluster] = {
+                "stack": stack,
+                "layers": layers,
+                "admin_host": admin_host,
+                "timestamp": time.time(),
+            }
+            self._write(entries)
+
+    def invalidate(self, cluster):
+        with _LOCK:
+            entries = self._read()
+            if entries.pop(cluster, None) is not None:
+                LOGGER.info("Invalidating cached topology for %s", cluster)
+                self._write(entries)
+
+    def _read(self):
+        if not os.path.exists(self.path):
+            return {}
+        try:
+            with open(self.path, "r") as f:
+                return json.load(f)
+        except ValueError:
+            LOGGER.warning("Failed reading (corrupt?) topology cache")
+            return {}
+
+    def _write(self, entries):
+        # write & rename so concurrent readers never see a partial file
+        tmp_path = "%s.%d" % (self.path, os.getpid())
+        try:
+            with open(tmp_path, "w") as f:
+                json.dump(entries, f)
+            os.rename(tmp_path, self.path)
+        except (IOError, OSError) as exc:
+            LOGGER.warning("Failed writing topology cache: %s", str(exc))
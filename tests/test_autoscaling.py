@@ -1,11 +1,18 @@
 import os
+import time
 import shutil
+import threading
 import unittest
 import tempfile
-from mock import MagicMock, PropertyMock
+from datetime import datetime, timedelta
+from mock import MagicMock, PropertyMock, patch
 
 from moscaler.opsworks import OpsworksController
-from moscaler.autoscale import Autoscaler
+from moscaler.autoscale import Autoscaler, AutoscaleException
+from moscaler.history import series_key
+from moscaler.exceptions import OpsworksScalingException
+from moscaler.clusters import CURRENT_CLUSTER, cluster_context
+from moscaler.instrumentation import SCOPE
 
 
 class TestAutoscaling(unittest.TestCase):
@@ -19,6 +26,14 @@ class TestAutoscaling(unittest.TestCase):
         type(mock_controller).dry_run = False
         return Autoscaler(mock_controller, config, pause_file_dir)
 
+    def test_pause_file_per_cluster(self):
+
+        mock_controller = MagicMock(spec=OpsworksController)
+        prod = Autoscaler(mock_controller, {}, "/tmp", cluster="prod")
+        staging = Autoscaler(mock_controller, {}, "/tmp", cluster="staging/2")
+        self.assertEqual(prod.pause_file, "/tmp/.moscaler-pause-prod")
+        self.assertEqual(staging.pause_file, "/tmp/.moscaler-pause-staging_2")
+
     def test_scaling_paused_no_interval(self):
         self.assertFalse(self._create().scaling_paused())
 
@@ -74,6 +89,12 @@ class TestAutoscaling(unittest.TestCase):
         _check(None, 2, 1, [])
         _check("down", 10, 5, [1, 3.3, 4.9])
         _check("down", 2, 1, [0.2, 0.3, 0.9])
+        _check(None, 10, None, [1, 3.3, 4.9])
+
+        # a share of the datapoints past the threshold is enough
+        self.assertEqual(autoscaler._up_or_down([11, 3, 12, 15], 10, 4, 0.75), "up")
+        self.assertIsNone(autoscaler._up_or_down([11, 3, 12, 5], 10, 4, 0.75))
+        self.assertEqual(autoscaler._up_or_down([1, 3, 12, 2], 10, 4, 0.75), "down")
 
     def test_scale_up_or_down(self):
 
@@ -96,3 +117,509 @@ class TestAutoscaling(unittest.TestCase):
             else:
                 self.assertEquals(autoscaler.controller._scale_up.call_count, 0)
                 self.assertEquals(autoscaler.controller._scale_down.call_count, 0)
+
+    def test_proportional_sizing(self):
+
+        config = {
+            "pause_cycles": 0,
+            "up_increment": 2,
+            "down_increment": 1,
+            "sizing": "proportional",
+            "strategies": [
+                self._cloudwatch_strategy("queued", "queued_jobs", per_worker=10),
+                self._cloudwatch_strategy("load", "load_1"),
+            ],
+        }
+
+        def _size(values, thresholds, results, pending=0, stopped=50, **kwargs):
+            autoscaler = self._create(config=dict(config, **kwargs))
+            autoscaler.controller.pending_workers = [MagicMock()] * pending
+            autoscaler.controller.stopped_workers = [MagicMock()] * stopped
+            autoscaler.controller.online_workers = []
+            autoscaler.strategy_values = values
+            autoscaler.strategy_thresholds = thresholds
+            autoscaler._scale_up_or_down(results)
+            for method in ["_scale_up", "_scale_down"]:
+                scale = getattr(autoscaler.controller, method)
+                if scale.called:
+                    return method, scale.call_args[0][0]
+
+        values = {"queued": 200, "load": 12}
+        thresholds = {"queued": (20, 5), "load": (10, 5)}
+        results = {"queued": "up", "load": "up"}
+        # 180 jobs over at 10 per worker, plus one for being at the threshold
+        self.assertEqual(_size(values, thresholds, results), ("_scale_up", 19))
+        self.assertEqual(
+            _size(values, thresholds, results, pending=5), ("_scale_up", 14)
+        )
+        self.assertEqual(
+            _size(values, thresholds, results, max_up_increment=8), ("_scale_up", 8)
+        )
+        self.assertEqual(
+            _size(values, thresholds, results, stopped=3), ("_scale_up", 3)
+        )
+        # enough are already on their way
+        self.assertIsNone(_size(values, thresholds, results, pending=20))
+        # never less than the fixed increment, which is also what strategies
+        # without a per worker amount get
+        values["queued"] = 20
+        self.assertEqual(_size(values, thresholds, results), ("_scale_up", 2))
+        self.assertEqual(
+            _size(values, thresholds, {"queued": None, "load": "up"}),
+            ("_scale_up", 2),
+        )
+        # fixed sizing ignores the excess
+        values["queued"] = 200
+        self.assertEqual(
+            _size(values, thresholds, results, sizing="fixed"), ("_scale_up", 2)
+        )
+
+        config["strategies"][1]["settings"]["per_worker"] = 1
+        values = {"queued": 0, "load": 2}
+        results = {"queued": "down", "load": "down"}
+        thresholds = {"queued": (60, 40), "load": (10, 5)}
+        # all have to agree, so the smallest shortfall
+        self.assertEqual(_size(values, thresholds, results), ("_scale_down", 3))
+        self.assertEqual(
+            _size(values, thresholds, results, max_down_increment=2),
+            ("_scale_down", 2),
+        )
+
+    def _metric_result(self, query_id, values):
+        now = datetime.utcnow()
+        return {
+            "Id": query_id,
+            "Timestamps": [now - timedelta(minutes=i) for i in range(len(values))],
+            "Values": values,
+        }
+
+    def _cloudwatch_strategy(self, name, metric, **settings):
+        settings.update(
+            {
+                "metric": metric,
+                "namespace": "AWS/OpsWorks",
+                "layer_name": "Workers",
+                "up_threshold": 10,
+                "down_threshold": 5,
+            }
+        )
+        return {"method": "cloudwatch", "name": name, "settings": settings}
+
+    def test_cloudwatch_batched(self):
+
+        config = {
+            "pause_cycles": 1,
+            "up_increment": 1,
+            "down_increment": 1,
+            "strategies": [
+                self._cloudwatch_strategy("load", "load_1"),
+                self._cloudwatch_strategy("iowait", "cpu_waitio"),
+                # identical query should not be fetched twice
+                self._cloudwatch_strategy("load again", "load_1"),
+            ],
+        }
+        autoscaler = self._create(config=config)
+        autoscaler.controller.get_layer_id.return_value = "5678-efgh"
+        autoscaler._cw = MagicMock()
+        paginator = autoscaler._cw.get_paginator.return_value
+
+        def paginate(MetricDataQueries, **kwargs):
+            values = {"load_1": [11, 12, 13], "cpu_waitio": [1, 2]}
+            # split the results across pages like the real api can
+            for query in MetricDataQueries:
+                metric = query["MetricStat"]["Metric"]["MetricName"]
+                yield {
+                    "MetricDataResults": [
+                        self._metric_result(query["Id"], values[metric][:1])
+                    ]
+                }
+                yield {
+                    "MetricDataResults": [
+                        self._metric_result(query["Id"], values[metric][1:])
+                    ]
+                }
+
+        paginator.paginate.side_effect = paginate
+
+        with patch.object(autoscaler, "_scale_up_or_down") as scale:
+            autoscaler.execute()
+            results = scale.call_args[0][0]
+
+        autoscaler._cw.get_paginator.assert_called_once_with("get_metric_data")
+        self.assertEqual(paginator.paginate.call_count, 1)
+        queries = paginator.paginate.call_args[1]["MetricDataQueries"]
+        self.assertEqual(2, len(queries))
+        self.assertEqual({"load": "up", "iowait": None, "load again": "up"}, results)
+        self.assertEqual(results, autoscaler.strategy_results)
+        # the most recent datapoint; iowait didn't get enough to decide
+        self.assertIn(autoscaler.strategy_values["load"], [11, 12])
+        self.assertIsNone(autoscaler.strategy_values["iowait"])
+
+    def test_forecast(self):
+
+        settings = {
+            "metric": "queued_jobs",
+            "namespace": "MH",
+            "layer_name": "Workers",
+            "up_threshold": 20,
+            "down_threshold": 5,
+            "sample_count": 5,
+            "horizon": 300,
+        }
+        checks = [
+            # rising 2 per minute, so 21 five minutes from now
+            ([3, 5, 7, 9, 11], "up"),
+            # already over, though falling
+            ([30, 28, 26, 24, 22], "up"),
+            ([2, 2, 2, 2, 2], "down"),
+            # low, but not staying that way
+            ([1, 2, 3, 4, 4], None),
+            ([10, 10, 10, 10, 10], None),
+        ]
+        for values, expected in checks:
+            autoscaler = self._create(config={"strategies": []})
+            autoscaler.controller.online_workers = []
+            autoscaler._cw = MagicMock()
+            paginator = autoscaler._cw.get_paginator.return_value
+            # newest first
+            paginator.paginate.return_value = [
+                {"MetricDataResults": [self._metric_result("q0", values[::-1])]}
+            ]
+            self.assertEqual(autoscaler.forecast(settings), expected, values)
+
+        # smoothed but without a trend a rise isn't anticipated
+        paginator.paginate.return_value = [
+            {"MetricDataResults": [self._metric_result("q0", [11, 9, 7, 5, 3])]}
+        ]
+        self.assertEqual(autoscaler.forecast(settings), "up")
+        settings["model"] = "ewma"
+        self.assertIsNone(autoscaler.forecast(settings))
+        settings["model"] = "arima"
+        self.assertRaises(AutoscaleException, autoscaler.forecast, settings)
+        settings["model"] = "holt"
+
+        # not enough history to fit anything
+        paginator.paginate.return_value = [
+            {"MetricDataResults": [self._metric_result("q0", [30, 30])]}
+        ]
+        self.assertIsNone(autoscaler.forecast(settings))
+
+    def test_cloudwatch_statistic(self):
+
+        settings = {
+            "metric": "load_1",
+            "namespace": "AWS/OpsWorks",
+            "layer_name": "Workers",
+            "up_threshold": 10,
+            "down_threshold": 2,
+            "sample_count": 5,
+        }
+        # newest first, with a noisy dip below the up threshold
+        values = [14, 15, 9, 16, 13]
+        checks = [
+            ({}, None),
+            ({"statistic": "fraction_above"}, "up"),
+            ({"statistic": "fraction_above", "fraction": 0.9}, None),
+            ({"statistic": "mean"}, "up"),
+            ({"statistic": "min"}, None),
+            ({"statistic": "percentile", "percentile": 25}, "up"),
+            ({"statistic": "rolling_mean", "window": 2}, "up"),
+            ({"statistic": "rolling_mean", "window": 1}, None),
+        ]
+        for extra, expected in checks:
+            autoscaler = self._create(config={"strategies": []})
+            autoscaler.controller.online_workers = []
+            autoscaler._cw = MagicMock()
+            paginator = autoscaler._cw.get_paginator.return_value
+            paginator.paginate.return_value = [
+                {"MetricDataResults": [self._metric_result("q0", values)]}
+            ]
+            self.assertEqual(
+                autoscaler.cloudwatch(dict(settings, **extra)), expected, extra
+            )
+
+        # the evaluated value is what's reported
+        autoscaler.cloudwatch(dict(settings, statistic="max"))
+        self.assertEqual(autoscaler._local.value, 16)
+
+        # rising ~2/period
+        paginator.paginate.return_value = [
+            {"MetricDataResults": [self._metric_result("q0", [9, 7, 5, 3, 1])]}
+        ]
+        slope = dict(settings, statistic="slope", up_threshold=1.5, down_threshold=0)
+        self.assertEqual(autoscaler.cloudwatch(slope), "up")
+
+        settings["statistic"] = "median"
+        self.assertRaises(AutoscaleException, autoscaler.cloudwatch, settings)
+
+    def test_forecast_prefetched(self):
+
+        strategy = self._cloudwatch_strategy("load", "load_1")
+        strategy["method"] = "forecast"
+        autoscaler = self._create(
+            config={"strategies": [strategy, self._cloudwatch_strategy("l", "load_1")]}
+        )
+        autoscaler.controller.get_layer_id.return_value = "5678-efgh"
+        autoscaler._cw = MagicMock()
+        paginator = autoscaler._cw.get_paginator.return_value
+        now = datetime(2016, 1, 1, 12, 0)
+
+        def paginate(MetricDataQueries, **kwargs):
+            # a datapoint a minute for the whole (widest) window
+            timestamps = [now - timedelta(minutes=i) for i in range(17)]
+            results = [
+                {"Id": x["Id"], "Timestamps": timestamps, "Values": [1] * 17}
+                for x in MetricDataQueries
+            ]
+            return [{"MetricDataResults": results}]
+
+        paginator.paginate.side_effect = paginate
+        with patch.object(autoscaler, "now", return_value=now):
+            metric_data = autoscaler._prefetch_metrics()
+
+        # one request; the forecast's query covers a longer window
+        self.assertEqual(paginator.paginate.call_count, 1)
+        windows = sorted(x.window for x in metric_data)
+        self.assertEqual(windows, [300, 1020])
+        # but each series only covers its own
+        counts = {x.window: len(y) for x, y in metric_data.items()}
+        self.assertEqual(counts, {300: 6, 1020: 17})
+
+    def test_metric_history(self):
+
+        autoscaler = self._create(config={"metric_history": True, "strategies": []})
+        autoscaler.controller.online_workers = []
+        autoscaler.controller.get_layer_id.return_value = "5678-efgh"
+        autoscaler._cw = MagicMock()
+        paginator = autoscaler._cw.get_paginator.return_value
+        settings = self._cloudwatch_strategy("load", "load_1")["settings"]
+        query = autoscaler._metric_query(settings)
+
+        now = datetime(2016, 1, 1, 12, 0)
+
+        def minutes(*x):
+            return [now - timedelta(minutes=m) for m in x]
+
+        def paginate(MetricDataQueries, StartTime, EndTime):
+            # the datapoints in the requested range, newest first
+            timestamps = [
+                x for x in minutes(0, 1, 2, 3, 4, 5, 6) if StartTime <= x <= EndTime
+            ]
+            yield {
+                "MetricDataResults": [
+                    {
+                        "Id": x["Id"],
+                        "Timestamps": timestamps,
+                        "Values": [11.0] * len(timestamps),
+                    }
+                    for x in MetricDataQueries
+                ]
+            }
+
+        paginator.paginate.side_effect = paginate
+
+        with patch.object(autoscaler, "now", return_value=now - timedelta(minutes=3)):
+            series = autoscaler._get_metric_data([query])
+        self.assertEqual(len(series[query]), 4)
+        self.assertEqual(
+            paginator.paginate.call_args[1]["StartTime"], now - timedelta(minutes=8)
+        )
+
+        # only the periods since the latest stored datapoint, plus 2 more
+        with patch.object(autoscaler, "now", return_value=now):
+            series = autoscaler._get_metric_data([query])
+        self.assertEqual(
+            paginator.paginate.call_args[1]["StartTime"], now - timedelta(minutes=5)
+        )
+        self.assertEqual([x[0] for x in series[query]], minutes(5, 4, 3, 2, 1, 0))
+
+        # datapoints outside of the fetched range come from the history
+        with patch.object(autoscaler, "now", return_value=now):
+            self.assertEqual(autoscaler.cloudwatch(settings), "up")
+
+        # a longer window of the same series than the history covers is
+        # fetched in full, then incrementally
+        longer = autoscaler._metric_query(dict(settings, sample_count=8))
+        self.assertEqual(series_key(longer), series_key(query))
+        for start in [10, 2]:
+            with patch.object(autoscaler, "now", return_value=now):
+                autoscaler._get_metric_data([longer])
+            self.assertEqual(
+                paginator.paginate.call_args[1]["StartTime"],
+                now - timedelta(minutes=start),
+            )
+
+    def test_cloudwatch_chunked(self):
+
+        autoscaler = self._create(config={"strategies": []})
+        autoscaler._cw = MagicMock()
+        paginator = autoscaler._cw.get_paginator.return_value
+        paginator.paginate.return_value = []
+        queries = [
+            autoscaler._metric_query(
+                {"metric": "m%d" % i, "namespace": "foo", "instance_name": "bar"}
+            )
+            for i in range(501)
+        ]
+        series = autoscaler._get_metric_data(queries)
+        self.assertEqual(paginator.paginate.call_count, 2)
+        self.assertEqual(501, len(series))
+
+    def test_execute_parallel(self):
+
+        config = {
+            "parallel": True,
+            "strategy_timeout": 0.2,
+            "strategies": [
+                {"method": "queued_jobs", "name": "slow", "settings": "slow"},
+                {"method": "queued_jobs", "name": "fast", "settings": "fast"},
+            ],
+        }
+        autoscaler = self._create(config=config)
+
+        def strategy(settings):
+            if settings == "slow":
+                time.sleep(1)
+            return "up"
+
+        with patch.object(autoscaler, "queued_jobs", side_effect=strategy):
+            with patch.object(autoscaler, "_scale_up_or_down") as scale:
+                start = time.time()
+                autoscaler.execute()
+                self.assertLess(time.time() - start, 1)
+
+        # the timed-out strategy counts as no action
+        scale.assert_called_once_with({"slow": None, "fast": "up"})
+        self.assertGreaterEqual(autoscaler.strategy_times["slow"], 0.2)
+        self.assertLess(autoscaler.strategy_times["fast"], 0.2)
+
+    def test_execute_parallel_cluster_context(self):
+
+        config = {
+            "parallel": True,
+            "strategies": [
+                {"method": "queued_jobs", "name": "a", "settings": {}},
+                {"method": "queued_jobs", "name": "b", "settings": {}},
+            ],
+        }
+        autoscaler = self._create(config=config)
+        seen = []
+
+        def strategy(settings):
+            seen.append((CURRENT_CLUSTER.get(), SCOPE.get()))
+
+        with patch.object(autoscaler, "queued_jobs", side_effect=strategy):
+            with patch.object(autoscaler, "_scale_up_or_down"):
+                with cluster_context("prod"):
+                    autoscaler.execute()
+
+        # logged & counted as the cluster's
+        self.assertEqual(seen, [("prod", "prod")] * 2)
+
+    def test_execute_parallel_slow_cloudwatch(self):
+
+        config = {
+            "parallel": True,
+            "strategy_timeout": 0.2,
+            "strategies": [
+                self._cloudwatch_strategy("load", "load_1"),
+                {"method": "queued_jobs", "name": "queued", "settings": {}},
+            ],
+        }
+        autoscaler = self._create(config=config)
+        autoscaler.controller.online_workers = []
+        autoscaler._cw = MagicMock()
+
+        def paginate(**kwargs):
+            time.sleep(1)
+            return []
+
+        autoscaler._cw.get_paginator.return_value.paginate.side_effect = paginate
+
+        with patch.object(autoscaler, "queued_jobs", return_value="up"):
+            with patch.object(autoscaler, "_scale_up_or_down") as scale:
+                start = time.time()
+                autoscaler.execute()
+                # the metric fetch is subject to the timeout too
+                self.assertLess(time.time() - start, 1)
+
+        scale.assert_called_once_with({"load": None, "queued": "up"})
+        self.assertGreaterEqual(autoscaler.strategy_times["load"], 0.2)
+        self.assertLess(autoscaler.strategy_times["queued"], 0.2)
+
+    def test_execute_parallel_late_prefetch(self):
+
+        config = {
+            "parallel": True,
+            "strategy_timeout": 0.2,
+            "strategies": [self._cloudwatch_strategy("load", "load_1")],
+        }
+        autoscaler = self._create(config=config)
+        autoscaler.controller.online_workers = []
+        autoscaler._cw = MagicMock()
+        released = threading.Event()
+        calls = []
+
+        def paginate(**kwargs):
+            calls.append(kwargs)
+            query_id = kwargs["MetricDataQueries"][0]["Id"]
+            if len(calls) == 1:
+                # the first execution's fetch outlives its timeout
+                released.wait(5)
+                values = [20, 20, 20]
+            else:
+                values = [1, 1, 1]
+            return [{"MetricDataResults": [self._metric_result(query_id, values)]}]
+
+        autoscaler._cw.get_paginator.return_value.paginate.side_effect = paginate
+
+        with patch.object(autoscaler, "_scale_up_or_down") as scale:
+            autoscaler.execute()
+            scale.assert_called_with({"load": None})
+            # finishes while the next execution is underway
+            timer = threading.Timer(0.05, released.set)
+            timer.start()
+            autoscaler.execute()
+            timer.join()
+
+        self.assertEqual(len(calls), 2)
+        scale.assert_called_with({"load": "down"})
+
+    def test_execute_prefetch_timing(self):
+
+        config = {
+            "pause_cycles": 0,
+            "strategies": [
+                self._cloudwatch_strategy("load", "load_1"),
+                self._cloudwatch_strategy("iowait", "iowait"),
+                {"method": "queued_jobs", "name": "queued", "settings": {}},
+            ],
+        }
+        autoscaler = self._create(config=config)
+        autoscaler.controller.online_workers = []
+        autoscaler._cw = MagicMock()
+        paginator = autoscaler._cw.get_paginator.return_value
+
+        def paginate(**kwargs):
+            time.sleep(0.2)
+            return []
+
+        paginator.paginate.side_effect = paginate
+
+        with patch.object(autoscaler, "queued_jobs", return_value=None):
+            autoscaler.execute()
+
+        # one batched fetch, counted towards the strategy that needed it first
+        self.assertEqual(paginator.paginate.call_count, 1)
+        self.assertGreaterEqual(autoscaler.strategy_times["load"], 0.2)
+        self.assertLess(autoscaler.strategy_times["iowait"], 0.2)
+        self.assertLess(autoscaler.strategy_times["queued"], 0.2)
+
+    def test_execute_no_such_method(self):
+
+        config = {"strategies": [{"method": "foo", "name": "foo", "settings": {}}]}
+        self.assertRaisesRegex(
+            OpsworksScalingException,
+            "No such autoscale method: 'foo'",
+            self._create(config=config).execute,
+        )
@@ -0,0 +1,17 @@
+import unittest
+
+from benchmarks.run import OPERATIONS, run_operation
+
+
+class TestBenchmarks(unittest.TestCase):
+    def test_operations_run(self):
+
+        for name, setup in OPERATIONS.items():
+            wall, calls = run_operation(10, setup, latency=0, repeat=1)
+            self.assertGreaterEqual(wall, 0)
+            self.assertTrue(calls, name)
+
+    def test_warm_construct_calls(self):
+
+        _, calls = run_operation(10, OPERATIONS["construct (warm)"], 0, 1)
+        self.assertEqual(calls, {"opsworks.describe_instances": 1})
@@ -0,0 +1,96 @@
+import os
+import shutil
+import logging
+import tempfile
+import unittest
+from mock import MagicMock
+
+from moscaler.clusters import (
+    CURRENT_CLUSTER,
+    ClusterLogFilter,
+    ClusterSet,
+    cluster_context,
+    read_cluster_file,
+)
+from moscaler.concurrency import map_concurrently
+from moscaler.instrumentation import STATS
+from moscaler.exceptions import OpsworksControllerException
+
+
+def build(name):
+    if name == "missing":
+        raise OpsworksControllerException("No opsworks stack named 'missing' found")
+    return MagicMock(name=name, cluster=CURRENT_CLUSTER.get())
+
+
+class TestClusters(unittest.TestCase):
+    def test_read_cluster_file(self):
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, "clusters")
+        with open(path, "w") as f:
+            f.write("# all of them\nprod\n\n  staging  # for testing\n")
+        self.assertEqual(read_cluster_file(path), ["prod", "staging"])
+
+    def test_cluster_set(self):
+
+        clusters = ClusterSet(["prod", "missing", "staging", "prod"], build, 4)
+        self.assertEqual(clusters.names, ["prod", "missing", "staging"])
+        self.assertEqual(list(clusters.controllers), ["prod", "staging"])
+        # each built in its own cluster's context
+        self.assertEqual(clusters.controllers["staging"].cluster, "staging")
+        self.assertEqual(clusters.exit_code, 1)
+
+        def check(controller, expected):
+            if controller.cluster == "staging":
+                raise OpsworksControllerException("oops")
+            return (CURRENT_CLUSTER.get(), expected)
+
+        results = clusters.run(check, expected="foo")
+        # clusters that couldn't be built are skipped
+        self.assertEqual(dict(results), {"prod": ("prod", "foo")})
+        self.assertEqual(
+            dict(clusters.exit_codes), {"prod": 0, "missing": 1, "staging": 1}
+        )
+
+        # exit codes reflect the last operation
+        clusters.run(lambda controller: None)
+        self.assertEqual(clusters.exit_codes["staging"], 0)
+        self.assertEqual(clusters.exit_code, 1)
+
+    def test_unexpected_errors(self):
+
+        clusters = ClusterSet(["prod", "staging"], build, 2)
+        with self.assertLogs("moscaler.clusters", level="ERROR"):
+            results = clusters.run(lambda controller: 1 / 0)
+        self.assertEqual(results, {})
+        self.assertEqual(clusters.exit_code, 1)
+
+    def test_cluster_context(self):
+
+        STATS.reset()
+        self.addCleanup(STATS.reset)
+        with cluster_context("prod"):
+            # carried over into helper threads
+            map_concurrently(
+                lambda x: STATS.record("opsworks.DescribeInstances", 0.1), [1, 2], 2
+            )
+        with cluster_context("staging"):
+            STATS.record("opsworks.DescribeInstances", 0.1)
+        STATS.record("opsworks.DescribeStacks", 0.1)
+
+        self.assertEqual(STATS.report(scope="prod")["calls"], 2)
+        self.assertEqual(STATS.report(scope="staging")["calls"], 1)
+        self.assertEqual(STATS.report()["calls"], 4)
+        self.assertIsNone(CURRENT_CLUSTER.get())
+
+    def test_log_filter(self):
+
+        log_filter = ClusterLogFilter("prod,staging")
+        record = logging.LogRecord("moscaler", logging.INFO, "", 0, "", (), None)
+        log_filter.filter(record)
+        self.assertEqual(record.cluster, "prod,staging")
+        with cluster_context("prod"):
+            log_filter.filter(record)
+        self.assertEqual(record.cluster, "prod")
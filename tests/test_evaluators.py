@@ -0,0 +1,57 @@
+import unittest
+from mock import patch
+
+from moscaler import evaluators
+from moscaler.evaluators import evaluate, fraction_past
+
+
+class TestEvaluators(unittest.TestCase):
+    def _check_all(self):
+
+        # newest first
+        values = [14.0, 15.0, 9.0, 16.0, 13.0]
+        self.assertEqual(evaluate("all", values, {}), (values, 1.0))
+        self.assertEqual(evaluate("fraction_above", values, {}), (values, 0.5))
+        self.assertEqual(
+            evaluate("fraction_above", values, {"fraction": 0.8}), (values, 0.8)
+        )
+        self.assertEqual(evaluate("mean", values, {}), ([13.4], 1.0))
+        self.assertEqual(evaluate("max", values, {}), ([16.0], 1.0))
+        self.assertEqual(evaluate("min", values, {}), ([9.0], 1.0))
+
+        # interpolated between the closest ranks
+        (p90,), _ = evaluate("percentile", values, {})
+        self.assertAlmostEqual(p90, 15.6)
+        (p25,), _ = evaluate("percentile", values, {"percentile": 25})
+        self.assertAlmostEqual(p25, 13.0)
+        (p50,), _ = evaluate("percentile", [3.0], {"percentile": 50})
+        self.assertAlmostEqual(p50, 3.0)
+
+        means, _ = evaluate("rolling_mean", values, {"window": 2})
+        self.assertEqual(means, [14.5, 12.0, 12.5, 14.5])
+        # window wider than the series
+        means, _ = evaluate("rolling_mean", values, {"window": 10})
+        self.assertEqual(means, [13.4])
+
+        # rising 2 per period
+        (slope,), _ = evaluate("slope", [9.0, 7.0, 5.0, 3.0, 1.0], {})
+        self.assertAlmostEqual(slope, 2.0)
+        (slope,), _ = evaluate("slope", [1.0, 2.0, 3.0], {})
+        self.assertAlmostEqual(slope, -1.0)
+        self.assertEqual(evaluate("slope", [5.0], {}), ([0.0], 1.0))
+
+        self.assertEqual(fraction_past(values, 14), 0.6)
+        self.assertEqual(fraction_past(values, 14, above=False), 0.4)
+
+        self.assertRaises(ValueError, evaluate, "mean", [], {})
+        self.assertRaises(ValueError, evaluate, "median", values, {})
+
+    def test_pure_python(self):
+
+        with patch.object(evaluators, "numpy", None):
+            self._check_all()
+
+    @unittest.skipIf(evaluators.numpy is None, "numpy is not installed")
+    def test_numpy(self):
+
+        self._check_all()
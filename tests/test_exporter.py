@@ -0,0 +1,155 @@
+import os
+import socket
+import shutil
+import tempfile
+import unittest
+from mock import MagicMock
+
+from moscaler.exporter import (
+    PrometheusTextfileExporter,
+    StatsdExporter,
+    cycle_samples,
+    export,
+)
+
+
+class TestExporter(unittest.TestCase):
+    def setUp(self):
+
+        self.controller = MagicMock()
+        self.controller.stopped_workers = [1, 2, 3]
+        autoscaler = self.controller.autoscaler
+        autoscaler.strategy_results = {"layer load": "up", "queued jobs": None}
+        autoscaler.strategy_values = {"layer load": 12.5, "queued jobs": None}
+        autoscaler.strategy_times = {"layer load": 0.25, "queued jobs": 0.5}
+
+        self.status = {
+            "cluster": "test-cluster",
+            "workers_online": 2,
+            "workers_pending": 1,
+            "job_status": {"queued_jobs": 7},
+        }
+        self.actions = {
+            "total_started": 1,
+            "total_stopped": 0,
+            "mh_snapshot": {"hits": 4, "misses": 1},
+        }
+
+    def _samples(self):
+        return cycle_samples(
+            self.controller,
+            self.status,
+            self.actions,
+            1.5,
+            {"calls": 9, "seconds": 0.75},
+        )
+
+    def test_cycle_samples(self):
+
+        samples = dict(
+            ((x.name,) + tuple(x.labels.values()), x.value) for x in self._samples()
+        )
+        self.assertEqual(samples[("moscaler_workers", "test-cluster", "stopped")], 3)
+        self.assertEqual(samples[("moscaler_queued_jobs", "test-cluster")], 7)
+        self.assertEqual(samples[("moscaler_actions", "test-cluster", "started")], 1)
+        self.assertEqual(
+            samples[("moscaler_mh_snapshot_lookups", "test-cluster", "hit")], 4
+        )
+        self.assertEqual(
+            samples[("moscaler_mh_snapshot_lookups", "test-cluster", "miss")], 1
+        )
+        self.assertEqual(
+            samples[("moscaler_strategy_decision", "test-cluster", "layer load")], 1
+        )
+        self.assertEqual(
+            samples[("moscaler_strategy_decision", "test-cluster", "queued jobs")], 0
+        )
+        self.assertNotIn(
+            ("moscaler_strategy_value", "test-cluster", "queued jobs"), samples
+        )
+        self.assertEqual(samples[("moscaler_remote_calls", "test-cluster")], 9)
+
+        # matterhorn not consulted
+        del self.status["job_status"]
+        self.assertNotIn("moscaler_queued_jobs", [x.name for x in self._samples()])
+
+    def test_prometheus_textfile(self):
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, "moscaler.prom")
+
+        export([PrometheusTextfileExporter(path)], self._samples())
+        with open(path) as f:
+            lines = f.read().splitlines()
+
+        self.assertIn("# TYPE moscaler_workers gauge", lines)
+        self.assertIn(
+            'moscaler_workers{cluster="test-cluster",state="online"} 2.0', lines
+        )
+        self.assertIn(
+            'moscaler_strategy_value{cluster="test-cluster",strategy="layer load"} 12.5',
+            lines,
+        )
+        # no temp files left behind
+        self.assertEqual(os.listdir(tmp_dir), ["moscaler.prom"])
+
+    def test_prometheus_textfile_clusters(self):
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        path = os.path.join(tmp_dir, "moscaler.prom")
+        exporter = PrometheusTextfileExporter(path)
+
+        export([exporter], self._samples())
+        self.status["cluster"] = "other-cluster"
+        export([exporter], self._samples())
+        # a later cycle replaces the first cluster's samples
+        self.status["cluster"] = "test-cluster"
+        self.status["workers_online"] = 5
+        export([exporter], self._samples())
+
+        with open(path) as f:
+            lines = f.read().splitlines()
+        self.assertEqual(lines.count("# TYPE moscaler_workers gauge"), 1)
+        self.assertIn(
+            'moscaler_workers{cluster="test-cluster",state="online"} 5.0', lines
+        )
+        self.assertIn(
+            'moscaler_workers{cluster="other-cluster",state="online"} 2.0', lines
+        )
+        self.assertNotIn(
+            'moscaler_workers{cluster="test-cluster",state="online"} 2.0', lines
+        )
+
+    def test_export_failure(self):
+
+        exporter = PrometheusTextfileExporter("/nonexistent/dir/moscaler.prom")
+        # logged, not raised
+        export([exporter], self._samples())
+
+    def test_statsd(self):
+
+        sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self.addCleanup(sock.close)
+        sock.bind(("127.0.0.1", 0))
+        sock.settimeout(2)
+        exporter = StatsdExporter("127.0.0.1:%d" % sock.getsockname()[1])
+
+        export([exporter], self._samples())
+        lines = []
+        for _ in exporter.packets(self._samples()):
+            lines.extend(sock.recv(4096).decode("utf-8").splitlines())
+
+        self.assertIn("moscaler.test-cluster.workers.online:2|g", lines)
+        self.assertIn("moscaler.test-cluster.cycle_duration_seconds:1500|ms", lines)
+        self.assertIn("moscaler.test-cluster.strategy_decision.layer_load:1|g", lines)
+
+    def test_statsd_packets(self):
+
+        exporter = StatsdExporter("localhost:8125")
+        samples = self._samples() * 20
+        packets = list(exporter.packets(samples))
+        self.assertGreater(len(packets), 1)
+        self.assertTrue(all(len(x) <= 512 for x in packets))
+        self.assertEqual(sum(len(x.splitlines()) for x in packets), len(samples))
@@ -0,0 +1,30 @@
+import unittest
+
+from moscaler.forecast import ewma, holt, project
+
+
+class TestForecast(unittest.TestCase):
+    def test_ewma(self):
+
+        self.assertEqual(ewma([4.0]), 4.0)
+        self.assertEqual(ewma([0.0, 4.0], alpha=0.5), 2.0)
+        self.assertEqual(ewma([0.0, 4.0, 4.0], alpha=0.5), 3.0)
+        self.assertRaises(ValueError, ewma, [])
+
+    def test_holt(self):
+
+        self.assertEqual(holt([3.0]), (3.0, 0.0))
+        self.assertRaises(ValueError, holt, [])
+
+        # a perfectly linear series is fitted exactly
+        level, trend = holt([1.0, 3.0, 5.0, 7.0, 9.0])
+        self.assertAlmostEqual(level, 9.0)
+        self.assertAlmostEqual(trend, 2.0)
+        self.assertAlmostEqual(project(level, trend, 5), 19.0)
+
+        level, trend = holt([5.0] * 10)
+        self.assertEqual((level, trend), (5.0, 0.0))
+
+        # noise around a flat line doesn't make much of a trend
+        level, trend = holt([5.0, 6.0, 4.0, 6.0, 4.0, 5.0, 6.0, 4.0])
+        self.assertLess(abs(trend), 0.5)
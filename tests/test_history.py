@@ -0,0 +1,78 @@
+import os
+import shutil
+import tempfile
+import unittest
+from datetime import datetime, timedelta, timezone
+
+from moscaler.autoscale import MetricQuery
+from moscaler.history import MetricHistory, series_key
+
+
+class TestMetricHistory(unittest.TestCase):
+    def setUp(self):
+
+        tmp_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tmp_dir)
+        self.path = os.path.join(tmp_dir, "metrics.db")
+        self.start = datetime(2016, 1, 1, 12, 0)
+
+    def _minutes(self, *minutes):
+        return [self.start + timedelta(minutes=x) for x in minutes]
+
+    def test_series_key(self):
+
+        query = MetricQuery("AWS/OpsWorks", "load_1", ("LayerId", "abcd"), 60, 300)
+        self.assertEqual(series_key(query), "AWS/OpsWorks/load_1/LayerId=abcd/60")
+
+    def test_add_get(self):
+
+        history = MetricHistory(self.path)
+        self.assertIsNone(history.latest("foo"))
+
+        history.add("foo", zip(self._minutes(0, 1, 2), [1.0, 2.0, 3.0]))
+        # overlapping & out of order, with timezone info as from cloudwatch
+        aware = [x.replace(tzinfo=timezone.utc) for x in self._minutes(3, 2)]
+        history.add("foo", zip(aware, [4.0, 3.5]))
+        history.add("bar", zip(self._minutes(5), [9.0]))
+
+        self.assertEqual(history.latest("foo"), self.start + timedelta(minutes=3))
+        self.assertEqual(
+            history.get("foo", self.start + timedelta(minutes=1)),
+            list(zip(self._minutes(1, 2, 3), [2.0, 3.5, 4.0])),
+        )
+
+        # persisted
+        history = MetricHistory(self.path)
+        self.assertEqual(len(history.get("foo", self.start)), 4)
+
+    def test_retention(self):
+
+        history = MetricHistory(self.path, retention=120)
+        history.add("foo", zip(self._minutes(0, 1, 2), [1.0, 2.0, 3.0]))
+        history.add("foo", zip(self._minutes(4), [5.0]))
+        self.assertEqual([x[1] for x in history.get("foo", self.start)], [3.0, 5.0])
+
+        # per series; a series that's behind keeps what its coverage claims
+        history.add("bar", zip(self._minutes(0, 1), [1.0, 2.0]), since=self.start)
+        history.add("foo", zip(self._minutes(10), [6.0]))
+        self.assertEqual(history.covered_since("bar"), self.start)
+        self.assertEqual(len(history.get("bar", self.start)), 2)
+        self.assertEqual(len(history.get("foo", self.start)), 1)
+
+    def test_coverage(self):
+
+        history = MetricHistory(self.path, retention=600)
+        self.assertIsNone(history.covered_since("foo"))
+        # fetched, but nothing there yet
+        history.add("foo", [], since=self._minutes(0)[0])
+        self.assertEqual(history.covered_since("foo"), self.start)
+
+        # fetching a later range doesn't narrow it, an earlier one widens it
+        history.add("foo", zip(self._minutes(3), [1.0]), since=self._minutes(2)[0])
+        history.add("foo", zip(self._minutes(4), [1.0]), since=self._minutes(-2)[0])
+        self.assertEqual(history.covered_since("foo"), self._minutes(-2)[0])
+
+        # retention narrows it
+        history.add("foo", zip(self._minutes(12), [1.0]), since=self._minutes(10)[0])
+        self.assertEqual(history.covered_since("foo"), self._minutes(2)[0])
+        self.assertIsNone(history.covered_since("bar"))
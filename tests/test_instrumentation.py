@@ -0,0 +1,126 @@
+import time
+import boto3
+import unittest
+import requests
+import threading
+from http.server import BaseHTTPRequestHandler, HTTPServer
+from requests.auth import HTTPDigestAuth
+from botocore.stub import Stubber
+
+from moscaler.instrumentation import (
+    STATS,
+    CallStats,
+    percentile,
+    instrument_client,
+    instrument_session,
+)
+
+
+class TestInstrumentation(unittest.TestCase):
+    def setUp(self):
+        STATS.reset()
+        self.addCleanup(STATS.reset)
+
+    def test_percentile(self):
+
+        values = list(range(1, 101))
+        self.assertEqual(percentile(values, 50), 50)
+        self.assertEqual(percentile(values, 95), 95)
+        self.assertEqual(percentile(values, 100), 100)
+        self.assertEqual(percentile([3], 95), 3)
+
+    def test_call_stats(self):
+
+        stats = CallStats()
+        stats.record("opsworks.DescribeInstances", 0.5, retries=2)
+        stats.record("opsworks.DescribeInstances", 1.5, throttled=True)
+        stats.record("ec2.DescribeInstances", 0.25, error=True)
+
+        report = stats.report()
+        self.assertEqual(report["calls"], 3)
+        self.assertEqual(report["seconds"], 2.25)
+        self.assertEqual(report["retries"], 2)
+        self.assertEqual(report["throttles"], 1)
+        describe = report["operations"]["opsworks.DescribeInstances"]
+        self.assertEqual(describe["calls"], 2)
+        self.assertEqual(describe["p50"], 0.5)
+        self.assertEqual(describe["p95"], 1.5)
+        self.assertEqual(report["operations"]["ec2.DescribeInstances"]["errors"], 1)
+        # slowest first
+        self.assertTrue(
+            stats.summary().startswith(
+                "3 calls, 2.25s total, 2 retries, 1 throttles; "
+                "opsworks.DescribeInstances x2"
+            )
+        )
+
+        stats.reset()
+        self.assertEqual(stats.report()["calls"], 0)
+
+    def test_instrument_client(self):
+
+        client = instrument_client(
+            boto3.client(
+                "opsworks",
+                region_name="us-east-1",
+                aws_access_key_id="x",
+                aws_secret_access_key="x",
+            )
+        )
+        with Stubber(client) as stubber:
+            stubber.add_response("describe_stacks", {"Stacks": []})
+            stubber.add_client_error("describe_layers", "ThrottlingException")
+            client.describe_stacks()
+            with self.assertRaises(Exception):
+                client.describe_layers(StackId="foo")
+
+        operations = STATS.report()["operations"]
+        self.assertEqual(operations["opsworks.DescribeStacks"]["calls"], 1)
+        self.assertEqual(operations["opsworks.DescribeLayers"]["throttles"], 1)
+        self.assertEqual(operations["opsworks.DescribeLayers"]["errors"], 1)
+
+    def test_instrument_session(self):
+
+        # each leg of the digest auth exchange takes 0.2s
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                time.sleep(0.2)
+                if "Authorization" not in self.headers:
+                    self.send_response(401)
+                    self.send_header(
+                        "WWW-Authenticate",
+                        'Digest realm="mh", nonce="abc", qop="auth"',
+                    )
+                else:
+                    self.send_response(200)
+                self.send_header("Content-Length", "0")
+                self.end_headers()
+
+            def log_message(self, *args):
+                pass
+
+        server = HTTPServer(("127.0.0.1", 0), Handler)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        self.addCleanup(server.server_close)
+        self.addCleanup(server.shutdown)
+
+        session = instrument_session(instrument_session(requests.Session()))
+        session.auth = HTTPDigestAuth("user", "pass")
+        url = "http://127.0.0.1:%d/services/hosts.json?foo=bar" % server.server_port
+        resp = session.get(url)
+        self.assertEqual(resp.status_code, 200)
+        self.assertEqual(len(resp.history), 1)
+
+        # recorded once, for the whole exchange
+        operation = STATS.report()["operations"]["matterhorn.GET /services/hosts.json"]
+        self.assertEqual(operation["calls"], 1)
+        self.assertGreaterEqual(operation["seconds"], 0.4)
+        self.assertEqual(operation["errors"], 0)
+
+        # connection errors are counted too
+        server.shutdown()
+        server.server_close()
+        self.assertRaises(requests.ConnectionError, session.get, url, timeout=1)
+        operation = STATS.report()["operations"]["matterhorn.GET /services/hosts.json"]
+        self.assertEqual(operation["calls"], 2)
+        self.assertEqual(operation["errors"], 1)
@@ -0,0 +1,29 @@
+import unittest
+
+from manager import action_summary, uses_matterhorn
+
+
+class TestManager(unittest.TestCase):
+    def test_uses_matterhorn(self):
+        def _check(expected, *methods):
+            strategies = [{"method": x, "name": x, "settings": {}} for x in methods]
+            config = {"strategies": strategies}
+            self.assertEqual(uses_matterhorn({"config": config}), expected, methods)
+
+        _check(False)
+        _check(False, "cloudwatch")
+        # forecast strategies are based on cloudwatch metrics too
+        _check(False, "forecast")
+        _check(False, "cloudwatch", "forecast")
+        _check(True, "queued_jobs")
+        _check(True, "forecast", "queued_jobs")
+
+    def test_action_summary(self):
+
+        actions = {"total_stopped": 1, "total_started": 0}
+        self.assertEqual(action_summary(actions), "stopped: 1, started: 0")
+        actions["mh_snapshot"] = {"hits": 4, "misses": 1}
+        self.assertEqual(
+            action_summary(actions),
+            "stopped: 1, started: 0, matterhorn snapshot hits/misses: 4/1",
+        )
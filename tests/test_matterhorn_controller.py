@@ -1,9 +1,11 @@
 import unittest
 import os
+from datetime import timedelta
+from freezegun import freeze_time
 from mock import patch, Mock, MagicMock
 from requests.exceptions import Timeout
 
-from moscaler.matterhorn import MatterhornController
+from moscaler.matterhorn import MatterhornController, normalize_url
 from moscaler.exceptions import MatterhornCommunicationException
 from pyhorn import MHClient
 
@@ -54,79 +56,45 @@ class TestMatterhornController(unittest.TestCase):
     def test_queued_job_counts(self, mock_pyhorn):
 
         controller = MatterhornController("mh.example.edu")
-        controller.client = MagicMock(spec_set=MHClient)
-        controller.client.workflows.return_value = [
-            Mock(
-                operations=[
-                    Mock(
-                        id="foo",
-                        state="RUNNING",
-                        job=Mock(
-                            children=[Mock(status="RUNNING"), Mock(status="QUEUED")]
-                        ),
-                    ),
-                    Mock(
-                        id="foo",
-                        state="RUNNING",
-                        job=Mock(
-                            children=[Mock(status="RUNNING"), Mock(status="QUEUED")]
-                        ),
-                    ),
-                ]
-            ),
-            Mock(
-                operations=[
-                    Mock(
-                        id="foo",
-                        state="RUNNING",
-                        job=Mock(
-                            children=[Mock(status="QUEUED"), Mock(status="QUEUED")]
-                        ),
-                    ),
-                    Mock(
-                        id="bar",
-                        state="RUNNING",
-                        job=Mock(
-                            children=[Mock(status="QUEUED"), Mock(status="QUEUED")]
-                        ),
-                    ),
-                    Mock(id="foo", state="INSTANTIATED"),
-                ]
-            ),
-            Mock(
-                operations=[
-                    Mock(id="foo", state="INSTANTIATED"),
-                    Mock(
-                        id="foo",
-                        state="RUNNING",
-                        job=Mock(
-                            children=[Mock(status="RUNNING"), Mock(status="RUNNING")]
-                        ),
-                    ),
-                    Mock(
-                        id="bar",
-                        state="WAITING",
-                        job=Mock(
-                            children=[Mock(status="QUEUED"), Mock(status="QUEUED")]
-                        ),
-                    ),
-                    Mock(
-                        id="baz",
-                        state="RUNNING",
-                        job=Mock(
-                            children=[Mock(status="RUNNING"), Mock(status="QUEUED")]
-                        ),
-                    ),
-                ]
-            ),
+        controller._session = MagicMock()
+        controller._session.get.side_effect = [
+            Mock(status_code=200, text="9"),
+            Mock(status_code=200, text="4"),
+            Mock(status_code=500, text="oops"),
         ]
-        self.assertEqual(controller.queued_job_count(), 9)
-        self.assertEqual(controller.queued_job_count(operation_types=["foo"]), 4)
-        self.assertEqual(controller.queued_job_count(operation_types=["bar"]), 4)
-        self.assertEqual(controller.queued_job_count(operation_types=["foo", "bar"]), 8)
+        self.assertEqual(controller.queued_job_counts([None, ["foo", "bar"]]), [9, 4])
+        self.assertEqual(controller.queued_job_count(operation_types=["foo"]), 0)
+        urls = [x[0][0] for x in controller._session.get.call_args_list]
         self.assertEqual(
-            controller.queued_job_count(operation_types=["foo", "bar", "baz"]), 9
+            urls,
+            [
+                "http://mh.example.edu/workflow/queuedJobCount",
+                "http://mh.example.edu/workflow/queuedJobCount?operations=foo,bar",
+                "http://mh.example.edu/workflow/queuedJobCount?operations=foo",
+            ],
         )
+        for call in controller._session.get.call_args_list:
+            self.assertEqual(call[1]["timeout"], (5, 30))
+
+        controller._session.get.side_effect = Timeout("timeout test")
+        self.assertRaisesRegex(
+            MatterhornCommunicationException,
+            "timeout test",
+            controller.queued_job_count,
+        )
+
+    @patch("moscaler.matterhorn.pyhorn.MHClient", spec_set=MHClient)
+    def test_session(self, mock_pyhorn):
+
+        with patch.dict(
+            os.environ, {"MATTERHORN_USER": "foo", "MATTERHORN_PASS": "bar"}
+        ):
+            controller = MatterhornController("mh.example.edu")
+            session = controller.session
+        self.assertIs(session, controller.session)
+        self.assertEqual(session.auth.username, "foo")
+        self.assertEqual(session.headers["X-REQUESTED-AUTH"], "Digest")
+        self.assertEqual(session.get_adapter("http://foo").max_retries.total, 2)
 
     @patch("moscaler.matterhorn.pyhorn.MHClient", spec_set=MHClient)
     def test_is_registered(self, mock_pyhorn):
@@ -136,6 +104,30 @@ class TestMatterhornController(unittest.TestCase):
         self.assertTrue(controller.is_registered(Mock(mh_host_url="bar")))
         self.assertFalse(controller.is_registered(Mock(mh_host_url="blerg")))
 
+    @patch("moscaler.matterhorn.pyhorn.MHClient", spec_set=MHClient)
+    def test_host_lookup_normalized(self, mock_pyhorn):
+
+        controller = MatterhornController("http://mh.example.edu")
+        controller._hosts = [
+            Mock(id=1, base_url="http://Worker1.example.edu/"),
+            Mock(id=2, base_url="https://worker2.example.edu"),
+        ]
+        inst = Mock(mh_host_url="http://worker1.example.edu")
+        self.assertTrue(controller.is_registered(inst))
+        self.assertEqual(controller.get_host(inst).id, 1)
+        inst = Mock(mh_host_url="http://worker2.example.edu//")
+        self.assertTrue(controller.is_registered(inst))
+        self.assertEqual(controller.get_host(inst).id, 2)
+        inst = Mock(mh_host_url=None)
+        self.assertFalse(controller.is_registered(inst))
+        self.assertIsNone(controller.get_host(inst))
+
+    def test_normalize_url(self):
+        self.assertEqual(normalize_url("http://Foo.edu/"), "foo.edu")
+        self.assertEqual(normalize_url("https://foo.edu:8080"), "foo.edu:8080")
+        self.assertEqual(normalize_url("foo.edu"), "foo.edu")
+        self.assertIsNone(normalize_url(None))
+
     @patch("moscaler.matterhorn.pyhorn.MHClient", spec_set=MHClient)
     def test_is_idle(self, mock_pyhorn):
 
@@ -162,3 +154,97 @@ class TestMatterhornController(unittest.TestCase):
         ]
         self.assertFalse(controller.is_in_maintenance(Mock(mh_host_url="foo")))
         self.assertTrue(controller.is_in_maintenance(Mock(mh_host_url="bar")))
+
+    @patch("moscaler.matterhorn.pyhorn.MHClient", spec_set=MHClient)
+    def test_refresh_reconnects(self, mock_pyhorn):
+
+        controller = MatterhornController("mh.example.edu")
+        controller.client.me.side_effect = Timeout("timeout test")
+        controller._online = False
+        controller.refresh()
+        self.assertFalse(controller.is_online())
+
+        controller.client.me.side_effect = None
+        controller.refresh()
+        self.assertTrue(controller.is_online())
+        self.assertEqual(controller.client.hosts.call_count, 2)
+
+    @patch("moscaler.matterhorn.pyhorn.MHClient", spec_set=MHClient)
+    def test_refresh_stats_snapshot(self, mock_pyhorn):
+
+        with freeze_time("2015-11-12 12:00:00") as frozen:
+            controller = MatterhornController("mh.example.edu", stats_max_age=10)
+            self.assertEqual(controller.snapshot_misses, 1)
+
+            controller.filter_idle([])
+            controller.refresh_stats()
+            self.assertEqual(controller.client.hosts.call_count, 1)
+            self.assertEqual(controller.snapshot_hits, 2)
+
+            frozen.tick(timedelta(seconds=11))
+            controller.filter_idle([])
+            self.assertEqual(controller.client.hosts.call_count, 2)
+
+            # changing maintenance state invalidates the snapshot
+            controller._hosts = [Mock(base_url="foo")]
+            controller.maintenance_on(Mock(mh_host_url="foo"))
+            controller.refresh_stats()
+            self.assertEqual(controller.client.hosts.call_count, 3)
+
+            controller.refresh_stats(force=True)
+            self.assertEqual(controller.client.hosts.call_count, 4)
+            self.assertEqual(controller.snapshot_misses, 4)
+            self.assertEqual(controller.snapshot_hits, 2)
+
+            controller.reset_snapshot_counts()
+            self.assertEqual(
+                (controller.snapshot_hits, controller.snapshot_misses), (0, 0)
+            )
+
+    @patch("moscaler.matterhorn.pyhorn.MHClient", spec_set=MHClient)
+    def test_in_maintenance(self, mock_pyhorn):
+
+        controller = MatterhornController("mh.example.edu", maintenance_concurrency=4)
+        hosts = [Mock(base_url="w%d" % i, maintenance=False) for i in range(4)]
+        hosts[3].maintenance = True
+        controller.client.hosts.return_value = hosts
+        controller._hosts = hosts
+        instances = [Mock(mh_host_url="w%d" % i, action_taken=None) for i in range(4)]
+        instances[1].action_taken = "stopped"
+
+        with controller.in_maintenance(instances):
+            for host in hosts[:3]:
+                host.set_maintenance.assert_called_once_with(True)
+            # already in maintenance
+            hosts[3].set_maintenance.assert_not_called()
+
+        hosts[0].set_maintenance.assert_called_with(False)
+        hosts[2].set_maintenance.assert_called_with(False)
+        # stopped nodes are left in maintenance
+        self.assertEqual(hosts[1].set_maintenance.call_count, 1)
+
+    @patch("moscaler.matterhorn.pyhorn.MHClient", spec_set=MHClient)
+    def test_in_maintenance_host_failure(self, mock_pyhorn):
+
+        controller = MatterhornController("mh.example.edu", maintenance_concurrency=4)
+        hosts = [Mock(base_url="w%d" % i, maintenance=False) for i in range(3)]
+        hosts[1].set_maintenance.side_effect = Exception("boom")
+        controller.client.hosts.return_value = hosts
+        controller._hosts = hosts
+        instances = [Mock(mh_host_url="w%d" % i, action_taken=None) for i in range(3)]
+
+        body = Mock()
+        with self.assertRaisesRegex(MatterhornCommunicationException, "1 of 3 nodes"):
+            with controller.in_maintenance(instances):
+                body()
+
+        body.assert_not_called()
+        # the nodes that did go into maintenance are restored
+        hosts[0].set_maintenance.assert_called_with(False)
+        hosts[2].set_maintenance.assert_called_with(False)
+        self.assertEqual(hosts[1].set_maintenance.call_count, 1)
+
+        # the failures are returned rather than kept around
+        failures = controller.set_maintenance(instances, True)
+        self.assertEqual([instances[1]], [inst for inst, _ in failures])
+        self.assertFalse(hasattr(controller, "maintenance_failures"))
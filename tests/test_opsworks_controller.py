@@ -1,10 +1,16 @@
 import os
+import time
+import shutil
+import threading
+import tempfile
 import unittest
 from mock import patch, MagicMock
-from datetime import datetime
+from datetime import datetime, timedelta
 from freezegun import freeze_time
 
 import boto3
+from botocore.exceptions import ClientError
+from requests.exceptions import HTTPError
 from moscaler.exceptions import *
 
 from moscaler.opsworks import OpsworksController, OpsworksInstance
@@ -35,17 +41,25 @@ class TestOpsworksController(unittest.TestCase):
                 }
             ]
         }
+        mock_ec2 = MagicMock(spec_set=boto3.client("ec2"))
+        clients = {"opsworks": mock_opsworks, "ec2": mock_ec2}
         self.mock_boto3 = patch(
-            "boto3.client", autospec=True, return_value=mock_opsworks
+            "boto3.client",
+            autospec=True,
+            side_effect=lambda service, *args, **kwargs: clients[service],
         )
-        self.mock_mh = patch("moscaler.opsworks.MatterhornController")
+        self.mock_mh = patch("moscaler.matterhorn.MatterhornController")
 
         self.mock_boto3.start()
-        self.mock_mh.start()
+        self.mock_mh_class = self.mock_mh.start()
         self.addCleanup(self.mock_boto3.stop)
         self.addCleanup(self.mock_mh.stop)
 
-        self.controller = OpsworksController("test-stack")
+        self.mock_opsworks = mock_opsworks
+        self.mock_ec2 = mock_ec2
+        self.cache_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.cache_dir)
+        self.controller = OpsworksController("test-stack", cache_dir=self.cache_dir)
 
     def _create_instance(self, inst_dict, wrap=False):
         inst_dict.setdefault("InstanceType", "t2.medium")
@@ -69,6 +83,205 @@ class TestOpsworksController(unittest.TestCase):
             OpsworksControllerException, self.controller.get_layer_id, "Foobar"
         )
 
+    def test_refresh(self):
+
+        self.mock_opsworks.describe_instances.return_value = {
+            "Instances": [
+                {"InstanceId": "1", "Hostname": "admin1", "PublicDns": "foo"},
+                {"InstanceId": "2", "Hostname": "workers1", "Status": "online"},
+            ]
+        }
+        self.controller._instances[0].action_taken = "started"
+        # not connected to matterhorn yet, so nothing to refresh there
+        self.controller.refresh()
+        self.mock_mh_class.assert_not_called()
+
+        mhorn = self.controller.mhorn
+        self.controller.refresh()
+        self.assertEqual(["1", "2"], [x.InstanceId for x in self.controller._instances])
+        self.assertIsNone(self.controller._instances[0].action_taken)
+        mhorn.refresh.assert_called_once_with()
+        # snapshot reuse is counted per cycle
+        mhorn.reset_snapshot_counts.assert_called_once_with()
+        # stack & layer discovery only happen at construction
+        self.assertEqual(self.mock_opsworks.describe_stacks.call_count, 1)
+        self.assertEqual(self.mock_opsworks.describe_layers.call_count, 1)
+
+    def test_actions_snapshot_counts(self):
+
+        # only if matterhorn was consulted
+        self.assertNotIn("mh_snapshot", self.controller.actions())
+        mhorn = self.controller.mhorn
+        mhorn.snapshot_hits, mhorn.snapshot_misses = 3, 1
+        self.assertEqual(
+            self.controller.actions()["mh_snapshot"], {"hits": 3, "misses": 1}
+        )
+
+    def test_lazy_matterhorn(self):
+
+        self.controller._instances = self._create_instances(
+            {"InstanceId": "1", "Hostname": "admin1", "Status": "online"},
+        )
+        self.mock_mh_class.assert_not_called()
+        status = self.controller.status(include_matterhorn=False)
+        self.mock_mh_class.assert_not_called()
+        self.assertNotIn("job_status", status)
+        self.assertNotIn("matterhorn_online", status)
+
+        self.controller.mhorn.job_status.return_value = {"queued_jobs": 0}
+        status = self.controller.status()
+        self.mock_mh_class.assert_called_once_with("http://mh.example.edu")
+        self.assertEqual(status["job_status"], {"queued_jobs": 0})
+        self.assertIs(self.controller.mhorn, self.controller.mhorn)
+        self.mock_mh_class.assert_called_once_with("http://mh.example.edu")
+
+    def test_lazy_matterhorn_threads(self):
+
+        # slow to connect, so both threads get in before it's done
+        def connect(admin_host):
+            time.sleep(0.1)
+            return MagicMock()
+
+        self.mock_mh_class.side_effect = connect
+        results = []
+        threads = [
+            threading.Thread(target=lambda: results.append(self.controller.mhorn))
+            for _ in range(2)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        self.assertEqual(self.mock_mh_class.call_count, 1)
+        self.assertIs(results[0], results[1])
+
+    @patch("moscaler.opsworks.Autoscaler")
+    def test_autoscale_reuses_autoscaler(self, mock_autoscaler):
+
+        mock_autoscaler.side_effect = lambda controller, config, cluster: MagicMock(
+            config=config
+        )
+        config = {"strategies": []}
+        self.controller.autoscale(config)
+        mock_autoscaler.assert_called_once_with(
+            self.controller, config, cluster="test-stack"
+        )
+        self.controller.autoscale(dict(config))
+        self.assertEqual(mock_autoscaler.call_count, 1)
+        self.assertEqual(self.controller._autoscaler.execute.call_count, 2)
+        self.controller.autoscale({"strategies": [{"name": "foo"}]})
+        self.assertEqual(mock_autoscaler.call_count, 2)
+
+    def test_get_launch_time(self):
+
+        self.controller._instances = self._create_workers(
+            {"InstanceId": "1", "Hostname": "workers1", "Ec2InstanceId": "i-1"},
+            {"InstanceId": "2", "Hostname": "workers2", "Ec2InstanceId": "i-2"},
+            {"InstanceId": "3", "Hostname": "workers3"},
+        )
+        paginator = self.mock_ec2.get_paginator.return_value
+        paginator.paginate.return_value = [
+            {"Reservations": [{"Instances": [{"InstanceId": "i-1", "LaunchTime": 1}]}]},
+            {"Reservations": [{"Instances": [{"InstanceId": "i-2", "LaunchTime": 2}]}]},
+        ]
+        self.assertEqual(self.controller.get_launch_time("i-1"), 1)
+        self.assertEqual(self.controller.get_launch_time("i-2"), 2)
+        self.assertIsNone(self.controller.get_launch_time("i-3"))
+        # all fetched in one go
+        paginator.paginate.assert_called_once_with(
+            Filters=[{"Name": "instance-id", "Values": ["i-1", "i-2"]}]
+        )
+
+        # refreshing re-fetches them along with the instances
+        self.mock_opsworks.describe_instances.return_value = {
+            "Instances": [
+                {"InstanceId": "1", "Hostname": "admin1", "PublicDns": "foo"},
+                {"InstanceId": "2", "Hostname": "workers2", "Ec2InstanceId": "i-2"},
+            ]
+        }
+        self.controller.refresh()
+        paginator.paginate.assert_called_with(
+            Filters=[{"Name": "instance-id", "Values": ["i-2"]}]
+        )
+        self.assertEqual(self.controller.get_launch_time("i-2"), 2)
+        self.assertEqual(paginator.paginate.call_count, 2)
+
+    def test_refresh_concurrently(self):
+
+        # both sides have to be in flight at the same time to get past this
+        barrier = threading.Barrier(2, timeout=5)
+        instances = self.mock_opsworks.describe_instances.return_value
+
+        def describe_instances(**kwargs):
+            barrier.wait()
+            return instances
+
+        mhorn = self.controller.mhorn
+        mhorn.refresh.side_effect = lambda: barrier.wait()
+        self.mock_opsworks.describe_instances.side_effect = describe_instances
+        self.controller.refresh()
+        mhorn.refresh.assert_called_once_with()
+
+        # no concurrency, no barrier
+        self.controller.refresh_concurrency = 1
+        mhorn.refresh.side_effect = None
+        self.mock_opsworks.describe_instances.side_effect = None
+        self.controller.refresh()
+        self.assertEqual(mhorn.refresh.call_count, 2)
+
+    def test_refresh_error(self):
+
+        self.mock_opsworks.describe_instances.side_effect = ClientError(
+            {"Error": {"Code": "InternalFailure"}}, "DescribeInstances"
+        )
+        instances = self.controller._instances
+        self.assertRaises(ClientError, self.controller.refresh)
+        self.assertIs(self.controller._instances, instances)
+
+        # matterhorn errors aren't swallowed either, however many threads
+        self.mock_opsworks.describe_instances.side_effect = None
+        mhorn = self.controller.mhorn
+        mhorn.refresh.side_effect = HTTPError("500 Server Error")
+        for concurrency in [2, 1]:
+            self.controller.refresh_concurrency = concurrency
+            self.assertRaises(HTTPError, self.controller.refresh)
+            self.assertIs(self.controller._instances, instances)
+
+    def test_topology_cache(self):
+
+        # setUp's controller populated the cache
+        controller = OpsworksController("test-stack", cache_dir=self.cache_dir)
+        self.assertEqual(self.mock_opsworks.describe_stacks.call_count, 1)
+        self.assertEqual(self.mock_opsworks.describe_layers.call_count, 1)
+        self.assertEqual(controller.stack["StackId"], "abcd1234")
+        self.assertEqual(controller.get_layer_id("Workers"), "5678-efgh")
+
+        # unknown layer triggers one re-fetch
+        self.assertRaises(OpsworksControllerException, controller.get_layer_id, "Foo")
+        self.assertRaises(OpsworksControllerException, controller.get_layer_id, "Foo")
+        self.assertEqual(self.mock_opsworks.describe_layers.call_count, 2)
+
+        # a stack that's gone away invalidates the cache
+        self.mock_opsworks.describe_instances.side_effect = [
+            ClientError(
+                {"Error": {"Code": "ResourceNotFoundException", "Message": "gone"}},
+                "DescribeInstances",
+            ),
+            self.mock_opsworks.describe_instances.return_value,
+        ]
+        OpsworksController("test-stack", cache_dir=self.cache_dir)
+        self.assertEqual(self.mock_opsworks.describe_stacks.call_count, 2)
+
+    def test_topology_cache_expired(self):
+
+        with patch.dict(os.environ, {"MOSCALER_TOPOLOGY_TTL": "0"}):
+            OpsworksController("test-stack", cache_dir=self.cache_dir)
+        self.assertEqual(self.mock_opsworks.describe_stacks.call_count, 2)
+
+        with freeze_time(datetime.now() + timedelta(days=2)):
+            OpsworksController("test-stack", cache_dir=self.cache_dir)
+        self.assertEqual(self.mock_opsworks.describe_stacks.call_count, 3)
+
     def test_instances(self):
 
         self.controller._instances = self._create_instances(
@@ -149,6 +362,49 @@ class TestOpsworksController(unittest.TestCase):
             [2, 7], [x.InstanceId for x in self.controller.pending_workers]
         )
 
+    def test_registry_cached(self):
+
+        instances = self._create_workers(
+            {"InstanceId": "1", "Hostname": "workers1", "Status": "online"},
+            {"InstanceId": "2", "Hostname": "workers2", "Status": "stopped"},
+            wrap=True,
+        )
+        self.controller._instances = instances
+        for _ in range(3):
+            self.assertEqual(1, len(self.controller.online_workers))
+            self.assertEqual(1, len(self.controller.stopped_workers))
+            self.assertEqual(1, len(self.controller.online_or_pending_workers))
+        self.assertEqual([1, 1], [x.is_worker.call_count for x in instances])
+
+        # returned lists are copies
+        self.controller.online_workers.append("foo")
+        self.assertEqual(1, len(self.controller.online_workers))
+
+        # starting/stopping an instance invalidates the indexes
+        self.controller.stop_instance(instances[0])
+        self.controller.workers
+        self.assertEqual([2, 2], [x.is_worker.call_count for x in instances])
+
+        # as does a new instance list
+        self.controller._instances = instances[:1]
+        self.assertEqual(1, len(self.controller.workers))
+
+    def test_lookups(self):
+
+        self.controller._instances = self._create_workers(
+            {"InstanceId": "1", "Hostname": "workers1", "Ec2InstanceId": "i-1"},
+            {"InstanceId": "2", "Hostname": "workers2"},
+        )
+        self.assertEqual(self.controller.get_ec2_id("workers1"), "i-1")
+        self.assertIsNone(self.controller.get_ec2_id("workers2"))
+        self.assertEqual(self.controller.get_instance("2").Hostname, "workers2")
+        self.assertRaises(
+            OpsworksControllerException, self.controller.get_ec2_id, "workers3"
+        )
+        self.assertRaises(
+            OpsworksControllerException, self.controller.get_instance, "3"
+        )
+
     def test_admin(self):
 
         self.controller._instances = self._create_instances(
@@ -240,23 +496,33 @@ class TestOpsworksController(unittest.TestCase):
     def test_workers_to_stop_uptime_check(self):
 
         instances = self._create_workers(
-            {"InstanceId": "1", "Hostname": "workers1", "Status": "online"},
-            {"InstanceId": "2", "Hostname": "workers2", "Status": "online"},
-            {"InstanceId": "3", "Hostname": "workers3", "Status": "online"},
+            {
+                "InstanceId": "1",
+                "Hostname": "workers1",
+                "Status": "online",
+                "Ec2InstanceId": "i-1",
+            },
+            {
+                "InstanceId": "2",
+                "Hostname": "workers2",
+                "Status": "online",
+                "Ec2InstanceId": "i-2",
+            },
+            {
+                "InstanceId": "3",
+                "Hostname": "workers3",
+                "Status": "online",
+                "Ec2InstanceId": "i-3",
+            },
             {"InstanceId": "4", "Hostname": "workers4", "Status": "online"},
             wrap=True,
         )
 
-        instances[0]._mock_wraps.ec2_inst = MagicMock(
-            launch_time=datetime(2015, 11, 13, 10, 45, 0)
-        )
-        instances[1]._mock_wraps.ec2_inst = MagicMock(
-            launch_time=datetime(2015, 11, 13, 10, 20, 0)
-        )
-        instances[2]._mock_wraps.ec2_inst = MagicMock(
-            launch_time=datetime(2015, 11, 13, 10, 4, 0)
-        )
-        instances[3]._mock_wraps.ec2_inst = None
+        self.controller._launch_times = {
+            "i-1": datetime(2015, 11, 13, 10, 45, 0),
+            "i-2": datetime(2015, 11, 13, 10, 20, 0),
+            "i-3": datetime(2015, 11, 13, 10, 4, 0),
+        }
 
         self.controller._instances = instances
         self.controller.mhorn.filter_idle.return_value = instances
@@ -343,6 +609,37 @@ class TestOpsworksController(unittest.TestCase):
                 len([x for x in self.controller._instances if x.stop.call_count == 1]),
             )
 
+    @patch.dict(os.environ, {"MOSCALER_MIN_WORKERS": "2"})
+    def test_plan_scale_down(self):
+
+        instances = self._create_workers(
+            {"InstanceId": "1", "Hostname": "workers1", "Status": "online"},
+            {"InstanceId": "2", "Hostname": "workers2", "Status": "online"},
+            {"InstanceId": "3", "Hostname": "workers3", "Status": "online"},
+            {"InstanceId": "4", "Hostname": "workers4", "Status": "online"},
+            {"InstanceId": "5", "Hostname": "workers5", "Status": "stopped"},
+        )
+        self.controller._instances = instances
+        self.controller.mhorn.filter_idle.return_value = instances[1:4]
+
+        plan = self.controller.plan_scale_down(5, scale_available=True)
+        self.assertTrue(plan.feasible)
+        self.assertEqual(plan.requested, 5)
+        # reduced to the online/pending count, then to MIN_WORKERS
+        self.assertEqual(plan.num_workers, 2)
+        self.assertEqual(len(plan.warnings), 2)
+        self.assertEqual(len(plan.instances), 2)
+        reasons = dict((x.InstanceId, r) for x, r in plan.excluded)
+        self.assertEqual(reasons["1"], "not idle")
+        self.assertEqual(len(reasons), 2)
+        # idleness is only checked once
+        self.assertEqual(self.controller.mhorn.filter_idle.call_count, 1)
+
+        plan = self.controller.plan_scale_down(3)
+        self.assertFalse(plan.feasible)
+        self.assertEqual(plan.instances, [])
+        self.assertIn("Stopping 3 workers violates MIN_WORKERS 2", plan.error)
+
     def test_sort_by_uptime(self):
 
         instances = self._create_workers(
@@ -465,3 +762,53 @@ class TestOpsworksController(unittest.TestCase):
         self.assertEqual(
             [0, 1, 1, 0, 0, 1], [x.start.call_count for x in self.controller._instances]
         )
+
+    @patch("moscaler.opsworks.time.sleep")
+    def test_throttled_start(self, mock_sleep):
+
+        inst = self._create_workers({"InstanceId": "1", "Hostname": "workers1"})[0]
+        throttled = ClientError(
+            {"Error": {"Code": "ThrottlingException", "Message": "slow down"}},
+            "StartInstance",
+        )
+        self.mock_opsworks.start_instance.side_effect = [throttled, throttled, {}]
+        self.controller.start_instance(inst)
+        self.assertEqual(self.mock_opsworks.start_instance.call_count, 3)
+        self.assertEqual(mock_sleep.call_count, 2)
+
+        # other errors aren't retried
+        self.mock_opsworks.start_instance.reset_mock()
+        self.mock_opsworks.start_instance.side_effect = ClientError(
+            {"Error": {"Code": "ValidationException", "Message": "nope"}},
+            "StartInstance",
+        )
+        self.assertRaises(ClientError, self.controller.start_instance, inst)
+        self.assertEqual(self.mock_opsworks.start_instance.call_count, 1)
+
+    def test_dispatch(self):
+
+        self.controller._instances = self._create_workers(
+            {"InstanceId": "1", "Hostname": "workers1", "Status": "stopped"},
+            {"InstanceId": "2", "Hostname": "workers2", "Status": "stopped"},
+            {"InstanceId": "3", "Hostname": "workers3", "Status": "stopped"},
+        )
+
+        def start_instance(InstanceId):
+            if InstanceId == "2":
+                raise Exception("boom")
+
+        self.mock_opsworks.start_instance.side_effect = start_instance
+        self.assertRaisesRegex(
+            OpsworksScalingException,
+            "Failed to start 1 of 3",
+            self.controller._scale_up,
+            3,
+        )
+        self.assertEqual(self.mock_opsworks.start_instance.call_count, 3)
+
+        actions = self.controller.actions()
+        self.assertEqual(actions["total_started"], 2)
+        self.assertEqual(
+            ["workers1", "workers2", "workers3"],
+            sorted(actions["dispatch_latency"]),
+        )
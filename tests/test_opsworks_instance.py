@@ -1,3 +1,4 @@
+import arrow
 import unittest
 from datetime import datetime
 from mock import MagicMock, patch
@@ -9,7 +10,7 @@ from moscaler.opsworks import OpsworksInstance, OpsworksController
 class TestOpsworksInstance(unittest.TestCase):
     def setUp(self):
         self.mock_controller = MagicMock(spec=OpsworksController)
-        self.mock_controller.ec2 = MagicMock()
+        self.mock_controller.now.side_effect = arrow.utcnow
 
     def _create(self, inst_dict):
         return OpsworksInstance(inst_dict, self.mock_controller)
@@ -18,7 +19,7 @@ class TestOpsworksInstance(unittest.TestCase):
 
         inst = self._create({"foo": 1})
         self.assertEqual(inst.foo, 1)
-        self.assertIsNone(inst.ec2_inst)
+        self.assertFalse(inst.has_ec2_instance())
 
     def test_repr(self):
 
@@ -80,20 +81,29 @@ class TestOpsworksInstance(unittest.TestCase):
         inst = self._create({"Status": "online"})
         self.assertEqual(inst.uptime(), 0)
 
-        inst = self._create({"Status": "online"})
-        inst.ec2_inst = MagicMock(launch_time=datetime(2015, 11, 12, 12, 0, 0))
+        inst = self._create({"Status": "online", "Ec2InstanceId": "i-1"})
+        self.mock_controller.get_launch_time.return_value = datetime(
+            2015, 11, 12, 12, 0, 0
+        )
         with freeze_time("2015-11-12 15:32:09"):
             self.assertEqual(inst.uptime(), 12729)
         with freeze_time("2015-11-12 15:32:39"):
             self.assertEqual(inst.uptime(), 12759)
+        self.mock_controller.get_launch_time.assert_called_with("i-1")
+
+        # launch time unknown
+        self.mock_controller.get_launch_time.return_value = None
+        self.assertEqual(inst.uptime(), 0)
 
     def test_billed_minutes(self):
 
         inst = self._create({"Status": "online"})
         self.assertEqual(inst.billed_minutes(), 0)
 
-        inst = self._create({"Status": "online"})
-        inst.ec2_inst = MagicMock(launch_time=datetime(2015, 11, 12, 12, 0, 0))
+        inst = self._create({"Status": "online", "Ec2InstanceId": "i-1"})
+        self.mock_controller.get_launch_time.return_value = datetime(
+            2015, 11, 12, 12, 0, 0
+        )
         with freeze_time("2015-11-12 15:32:09"):
             self.assertEqual(inst.billed_minutes(), 32)
 
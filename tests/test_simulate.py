@@ -0,0 +1,183 @@
+import os
+import json
+import unittest
+
+from moscaler.simulate import Simulation
+
+
+class TestSimulation(unittest.TestCase):
+    def _trace(self, queued, **kwargs):
+        trace = {
+            "interval": 60,
+            "workers": 4,
+            "online_workers": 1,
+            "samples": [
+                {"queued_jobs": q, "running_jobs": 0, "metrics": {"load_1": q}}
+                for q in queued
+            ],
+        }
+        trace.update(kwargs)
+        return trace
+
+    def _config(self, **kwargs):
+        config = {
+            "up_increment": 1,
+            "down_increment": 1,
+            "pause_cycles": 0,
+            "strategies": [
+                {
+                    "method": "cloudwatch",
+                    "name": "load",
+                    "settings": {
+                        "metric": "load_1",
+                        "namespace": "AWS/OpsWorks",
+                        "layer_name": "Workers",
+                        "sample_count": 1,
+                        "up_threshold": 10,
+                        "down_threshold": 5,
+                    },
+                }
+            ],
+        }
+        config.update(kwargs)
+        return config
+
+    def test_steady(self):
+
+        results = Simulation(self._trace([6] * 60), self._config()).run()
+        self.assertEqual(results["cycles"], 60)
+        self.assertEqual(results["worker_hours"], 1.0)
+        self.assertEqual(results["billed_worker_hours"], 1)
+        self.assertEqual(results["workers_started"], 0)
+        self.assertEqual(results["flaps"], 0)
+        self.assertEqual(results["spikes"], [])
+
+    def test_spike(self):
+
+        queued = [0] * 5 + [20] * 10 + [6] * 5
+        results = Simulation(self._trace(queued), self._config(), boot_time=120).run()
+        # one worker started per cycle until none are left
+        self.assertEqual(results["workers_started"], 3)
+        self.assertEqual(results["scale_up_events"], 3)
+        self.assertEqual(results["peak_online_workers"], 4)
+        self.assertEqual(len(results["spikes"]), 1)
+        spike = results["spikes"][0]
+        self.assertEqual(spike["start"], 300)
+        self.assertEqual(spike["duration"], 600)
+        # the third worker is started 2 cycles in and takes 2 more to boot
+        self.assertEqual(spike["time_to_capacity"], 240)
+        self.assertEqual(results["max_time_to_capacity"], 240)
+
+    def test_capacity_not_reached(self):
+
+        # workers are started, but the trace ends before any come online
+        queued = [0] * 5 + [20] * 3 + [0] * 2 + [20] * 10
+        results = Simulation(self._trace(queued), self._config(), boot_time=1200).run()
+        self.assertEqual(results["workers_started"], 3)
+        self.assertEqual(len(results["spikes"]), 2)
+        for spike in results["spikes"]:
+            self.assertIsNone(spike["time_to_capacity"])
+            self.assertEqual(spike["peak_online_workers"], 1)
+        self.assertIsNone(results["mean_time_to_capacity"])
+        self.assertIsNone(results["max_time_to_capacity"])
+
+    def test_forecast_lead_time(self):
+
+        # a steady ramp up to a plateau, like a scheduled ingest surge
+        queued = [0] * 20 + list(range(0, 40, 2)) + [40] * 20
+        trace = self._trace(queued, workers=6)
+
+        config = self._config(up_increment=5)
+        config["strategies"][0]["settings"]["up_threshold"] = 20
+        reactive = Simulation(trace, config, boot_time=300).run()
+
+        settings = config["strategies"][0]["settings"]
+        settings.update({"sample_count": 5, "horizon": 300})
+        config["strategies"][0]["method"] = "forecast"
+        predictive = Simulation(trace, config, boot_time=300).run()
+
+        # starting as the queue heads for the threshold rather than once it's
+        # there gets the workers online 5 minutes sooner
+        self.assertEqual(reactive["max_time_to_capacity"], 600)
+        self.assertEqual(predictive["max_time_to_capacity"], 300)
+        self.assertEqual(predictive["workers_started"], reactive["workers_started"])
+
+    def test_proportional_sizing(self):
+
+        # a sudden backlog of 200 jobs, each worker handling 10
+        queued = [0] * 5 + [200] * 30 + [0] * 5
+        trace = self._trace(queued, workers=25)
+
+        config = self._config(up_increment=2)
+        settings = config["strategies"][0]["settings"]
+        settings.update(
+            {"up_threshold": 10, "up_threshold_online_workers_multiplier": 10}
+        )
+        fixed = Simulation(trace, config, boot_time=300).run()
+
+        config["sizing"] = "proportional"
+        proportional = Simulation(trace, config, boot_time=300).run()
+
+        # 2 at a time, on and on while they boot, eventually starts them all
+        self.assertEqual(fixed["scale_up_events"], 12)
+        self.assertEqual(fixed["workers_started"], 24)
+        self.assertEqual(fixed["max_time_to_capacity"], 960)
+        # the workers needed are all started in one go, and no more
+        self.assertEqual(proportional["scale_up_events"], 1)
+        self.assertEqual(proportional["workers_started"], 19)
+        self.assertEqual(proportional["peak_online_workers"], 20)
+        self.assertEqual(proportional["max_time_to_capacity"], 300)
+
+    def test_instance_metrics(self):
+
+        # e.g. the example config's queued jobs metric, published by a
+        # monitoring node
+        config = self._config()
+        settings = config["strategies"][0]["settings"]
+        del settings["layer_name"]
+        settings["instance_name"] = "monitoring-master1"
+        queued = [0] * 5 + [20] * 10 + [6] * 5
+        results = Simulation(self._trace(queued), config, boot_time=120).run()
+        self.assertEqual(results["aborted_cycles"], 0)
+        self.assertEqual(results["workers_started"], 3)
+
+        path = os.path.join(os.path.dirname(__file__), "..", "autoscale.json.example")
+        with open(path) as f:
+            example = json.load(f)
+        results = Simulation(self._trace(queued), example).run()
+        self.assertEqual(results["aborted_cycles"], 0)
+
+    def test_aborted_cycles(self):
+
+        config = self._config()
+        del config["strategies"][0]["settings"]["namespace"]
+        with self.assertLogs("moscaler.simulate", level="ERROR"):
+            results = Simulation(self._trace([6] * 5), config).run()
+        self.assertEqual(results["aborted_cycles"], 5)
+
+    def test_metric_history(self):
+
+        queued = [0] * 5 + [20] * 10 + [6] * 5
+        config = self._config()
+        config["strategies"][0]["settings"]["sample_count"] = 3
+        expected = Simulation(self._trace(queued), config, boot_time=120).run()
+
+        config["metric_history"] = True
+        results = Simulation(self._trace(queued), config, boot_time=120).run()
+        self.assertEqual(results, expected)
+
+    def test_flaps(self):
+
+        # workers are only stopped once 50 minutes into their billing hour
+        queued = [20] + [0] * 55 + [20] + [0] * 59
+        results = Simulation(
+            self._trace(queued, online_workers=2),
+            self._config(),
+            boot_time=60,
+            spike_threshold=15,
+        ).run()
+        # up, down (x2, to MIN_WORKERS), up, down
+        self.assertEqual(results["scale_up_events"], 2)
+        self.assertEqual(results["scale_down_events"], 3)
+        self.assertEqual(results["flaps"], 3)
+        self.assertEqual(len(results["spikes"]), 2)
@@ -0,0 +1,18 @@
+import unittest
+
+from benchmarks.startup import deferred_imports, imported_modules
+
+
+class TestStartup(unittest.TestCase):
+    def test_deferred_imports(self):
+
+        self.assertEqual(
+            deferred_imports({"boto3", "botocore.client", "click", "requestsx"}),
+            ["boto3", "botocore"],
+        )
+
+    def test_no_heavy_imports_at_startup(self):
+
+        modules = imported_modules()
+        self.assertIn("click", modules)
+        self.assertEqual(deferred_imports(modules), [])
@@ -0,0 +1,40 @@
+import unittest
+from mock import patch
+
+from moscaler.timing import Timings, process_age
+
+
+class TestTimings(unittest.TestCase):
+    @patch("moscaler.timing.time.perf_counter")
+    def test_nested_phases(self, perf_counter):
+
+        timings = Timings(start=0)
+        perf_counter.side_effect = [1, 2, 4, 7, 8, 9, 10]
+        with timings.phase("actions"):
+            with timings.phase("strategies"):
+                pass
+        with timings.phase("actions"):
+            pass
+
+        # the nested time only counts towards the inner phase
+        self.assertEqual(timings.phases, {"actions": 5, "strategies": 2})
+        self.assertEqual(
+            timings.report(),
+            [("strategies", 2), ("actions", 5), ("other", 3), ("total", 10)],
+        )
+
+    @patch("moscaler.timing.time.perf_counter")
+    def test_phase_exception(self, perf_counter):
+
+        timings = Timings(start=0)
+        perf_counter.side_effect = [1, 3]
+        with self.assertRaises(ValueError):
+            with timings.phase("status"):
+                raise ValueError()
+        self.assertEqual(timings.phases, {"status": 2})
+
+    def test_process_age(self):
+
+        age = process_age()
+        if age is not None:
+            self.assertGreaterEqual(age, 0)